@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк ai_client против локальной AI-заглушки (без сети).
+
+Сравнивает наивный режим (по одной записи, последовательно) с пачками
+и параллельными запросами, затем повторный прогон из кэша.
+
+    python -m benchmarks.bench_ai_client --records 400 --latency 0.05
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs.ai_server import LocalAIServer
+from modules.ai_client import analyze_with_ai
+
+def make_records(count, duplicate_share=0.3, complete_share=0.3, seed=42):
+    """Записи парсера: часть полных, часть повторяющихся"""
+    rnd = random.Random(seed)
+    records = []
+    for i in range(count):
+        if records and rnd.random() < duplicate_share:
+            records.append(dict(rnd.choice(records)))
+            continue
+        doc = {'date': '', 'number_ip': str(10**10 + i), 'fio': '',
+               'file': f'сеть/asf01/files/юристы/VALB/{10**10 + i}/договор.pdf', 'creditor': 'VALB',
+               'excerpt': f'Договор займа № {10**10 + i} от 01.01.2024, заёмщик Петров Петр Петрович'}
+        if rnd.random() < complete_share:
+            doc.update(date='01.01.2024', fio='Петров Петр Петрович')
+        records.append(doc)
+    return records
+
+def run(records, server, batch_size, concurrency, cache_dir):
+    configs = {'ai_settings.yaml': {
+        'enabled': True, 'endpoint': server.url, 'batch_size': batch_size,
+        'concurrency': concurrency, 'timeout': 30, 'cache_dir': cache_dir,
+    }}
+    requests_before = server.requests
+    started = time.perf_counter()
+    analyze_with_ai(records, configs)
+    elapsed = time.perf_counter() - started
+    return elapsed, server.requests - requests_before
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк ai_client')
+    parser.add_argument('--records', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.05, help='Задержка заглушки на запрос, сек')
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    with tempfile.TemporaryDirectory() as tmp_dir, LocalAIServer(latency=args.latency) as server:
+        os.chdir(tmp_dir)
+        os.makedirs('logs', exist_ok=True)
+        scenarios = [
+            ('по одной, последовательно', 1, 1, 'cache_naive'),
+            ('пачки 20, 4 потока', 20, 4, 'cache_batched'),
+            ('повтор из кэша', 20, 4, 'cache_batched'),
+        ]
+        print(f"Записей: {len(records)}, задержка заглушки: {args.latency * 1000:.0f} мс")
+        for name, batch_size, concurrency, cache_dir in scenarios:
+            elapsed, requests = run(records, server, batch_size, concurrency, cache_dir)
+            print(f"{name:28s} {elapsed:8.3f} с  {len(records) / elapsed:10.0f} записей/с  запросов: {requests}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк извлечения текста DOCX: потоковое чтение word/document.xml
+(parser.iter_docx_blocks) против объектной модели python-docx.
+
+Документ собирается прямо в zip: абзацы договора и таблица графика платежей.
+Для каждого способа — время и прирост пикового RSS дочернего процесса
+(tracemalloc не видит память lxml, на котором стоит python-docx) на полный
+текст абзацев и ячеек, а для потокового — ещё извлечение полей с ранним
+выходом (extract_docx_fields), когда реквизиты в начале документа.
+
+    python -m benchmarks.bench_docx --paragraphs 20000 --rows 5000
+"""
+
+import os
+import sys
+import time
+import zipfile
+import resource
+import argparse
+import tempfile
+import multiprocessing
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.parser import iter_docx_blocks, extract_docx_fields
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>')
+RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>')
+
+def _paragraph(text):
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def make_docx(path, paragraphs, rows):
+    """Договор: реквизиты в начале, paragraphs абзацев текста и таблица из rows строк"""
+    body = [_paragraph('Договор займа № 1001 от 15.03.2024'),
+            _paragraph('Заёмщик: Петров Петр Петрович, исполнительное производство 1234567890')]
+    body.extend(_paragraph(f'{i}. Стороны договорились о нижеследующем: пункт {i} договора займа.')
+                for i in range(paragraphs))
+    body.append('<w:tbl>')
+    for i in range(rows):
+        cells = (f'{i + 1}', f'{1 + i % 28:02d}.{1 + i % 12:02d}.2025', f'{1000 + i}.00')
+        body.append('<w:tr>' + ''.join(f'<w:tc>{_paragraph(c)}</w:tc>' for c in cells) + '</w:tr>')
+    body.append('</w:tbl>')
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{"".join(body)}</w:body></w:document>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', RELS)
+        archive.writestr('word/document.xml', document)
+
+def python_docx_blocks(path):
+    import docx
+    document = docx.Document(path)
+    blocks = [p.text for p in document.paragraphs if p.text]
+    for table in document.tables:
+        for row in table.rows:
+            blocks.extend(cell.text for cell in row.cells if cell.text)
+    return blocks
+
+def _child(conn, func, args):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    conn.send((result, elapsed, grown / 1024))
+
+def measure(func, *args):
+    """(результат, секунд, прирост пикового RSS в МБ) — в отдельном процессе"""
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('fork').Process(target=_child, args=(child, func, args))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+def stream_blocks(path):
+    return list(iter_docx_blocks(path))
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк извлечения текста DOCX')
+    parser.add_argument('--paragraphs', type=int, default=20000)
+    parser.add_argument('--rows', type=int, default=5000, help='Строк в таблице (по 3 ячейки)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'договор.docx')
+        make_docx(path, args.paragraphs, args.rows)
+        print(f"Документ: {args.paragraphs} абзацев, таблица {args.rows}x3, "
+              f"{os.path.getsize(path) / 2**20:.1f} МБ")
+
+        # python-docx и потоковое чтение отдают блоки в разном порядке (таблицы у python-docx отдельно)
+        reference, docx_s, docx_mb = measure(python_docx_blocks, path)
+        streamed, stream_s, stream_mb = measure(stream_blocks, path)
+        assert sorted(reference) == sorted(streamed), "Текст блоков различается"
+        (fields, _), early_s, early_mb = measure(extract_docx_fields, path, {})
+        assert fields['number_ip'] and fields['fio']
+
+        print(f"{'python-docx':24s} {docx_s:7.3f} с  RSS +{docx_mb:7.1f} МБ")
+        print(f"{'потоково, весь текст':24s} {stream_s:7.3f} с  RSS +{stream_mb:7.1f} МБ")
+        print(f"{'потоково, поля':24s} {early_s:7.3f} с  RSS +{early_mb:7.1f} МБ")
+        print(f"Ускорение: {docx_s / stream_s:.1f}x")
+
+if __name__ == '__main__':
+    main()
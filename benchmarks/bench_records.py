@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк представления записей парсера: dict против ParsedRecord.
+
+Записи строятся так, как их собирает пайплайн: путь и кредитор каждой
+записи — отдельно созданные строки (строки реестра одного файла
+повторяют путь). Память на запись считается по tracemalloc вместе со
+значениями; отдельно замеряются создание, доступ к полям и выгрузка в JSON.
+
+    python -m benchmarks.bench_records --records 200000 --rows-per-file 50
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.records import ParsedRecord, as_dict
+
+CREDITORS = ('VALB', 'OZON', 'WILDB', 'MFO01')
+
+def record_values(count, rows_per_file):
+    """Значения полей записей; строки пути и кредитора создаются заново для каждой записи"""
+    for i in range(count):
+        file_no = i // rows_per_file
+        creditor = ''.join(CREDITORS[file_no % len(CREDITORS)])
+        yield {
+            'date': f"{1 + i % 28:02d}.{1 + i % 12:02d}.2024",
+            'number_ip': str(10**10 + i),
+            'fio': 'Петров Петр Петрович',
+            'file': os.path.join('сеть', 'asf01', 'files', 'юристы', creditor, str(10**10 + file_no), 'реестр.xlsx'),
+            'creditor': creditor,
+        }
+
+def build(kind, count, rows_per_file):
+    """(записи, секунд на создание, байт на запись)"""
+    make = dict if kind == 'dict' else ParsedRecord
+    values = list(record_values(count, rows_per_file))
+    started = time.perf_counter()
+    records = [make(row) for row in values]
+    elapsed = time.perf_counter() - started
+    del records
+    # Память — отдельным проходом: tracemalloc сильно замедляет создание
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [make(row) for row in record_values(count, rows_per_file)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return records, elapsed, used / count
+
+def access(records):
+    """Типичный доступ этапов: get полей и проверка наличия"""
+    started = time.perf_counter()
+    filled = 0
+    for doc in records:
+        if doc.get('number_ip') and doc.get('fio') and 'file' in doc:
+            filled += 1
+    return time.perf_counter() - started
+
+def export(records):
+    started = time.perf_counter()
+    text = json.dumps(records, ensure_ascii=False, default=as_dict)
+    return time.perf_counter() - started, len(text)
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк представления записей')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--rows-per-file', type=int, default=50,
+                        help='Записей на один файл (строки реестра повторяют путь)')
+    args = parser.parse_args()
+
+    print(f"Записей: {args.records}, записей на файл: {args.rows_per_file}")
+    results = {}
+    for kind in ('dict', 'ParsedRecord'):
+        records, build_s, per_record = build(kind, args.records, args.rows_per_file)
+        access_s = access(records)
+        export_s, size = export(records)
+        results[kind] = (per_record, size)
+        print(f"{kind:14s} {per_record:8.0f} Б/запись  создание {build_s:6.3f} с  "
+              f"доступ {access_s:6.3f} с  JSON {export_s:6.3f} с")
+        del records
+    assert results['dict'][1] == results['ParsedRecord'][1], "JSON выгрузки различается"
+    print(f"Экономия памяти: {(1 - results['ParsedRecord'][0] / results['dict'][0]) * 100:.0f}%")
+
+if __name__ == '__main__':
+    main()
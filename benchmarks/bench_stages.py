@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк этапов пайплайна на синтетическом корпусе (benchmarks/corpus.py).
+
+Каждый этап запускается в отдельном процессе по очереди на общей рабочей
+папке (выход этапа — вход следующего), поэтому пиковый RSS относится
+к одному этапу. Импорт модулей этапа в замер не входит.
+Результаты сравниваются с сохранённым baseline.json.
+
+    python -m benchmarks.bench_stages --contracts 10 --rows 100
+    python -m benchmarks.bench_stages --save-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.corpus import CORPUS_DEFAULTS, EXPORT_DATE, generate_corpus
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+STATE_DIR = '_bench'
+
+def peak_rss_mb():
+    """Пиковый RSS текущего процесса, МБ (None, если узнать нельзя)"""
+    # VmHWM сбрасывается при exec, ru_maxrss в Linux наследуется от родителя
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _save_state(name, data):
+    from modules.records import as_dict
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(os.path.join(STATE_DIR, f"{name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=as_dict)
+
+def _load_state(name):
+    with open(os.path.join(STATE_DIR, f"{name}.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+def _manifest():
+    with open('manifest.json', encoding='utf-8') as f:
+        return json.load(f)
+
+# Этап: подготовка (без замера) -> функция, возвращающая (файлов, строк)
+
+def stage_process_email():
+    import email
+    from modules.mail_parser import process_email
+    from modules.config import load_configs
+
+    filters = load_configs()['mail_filters.yaml']['filters']
+    by_sender = {f['from']: f for f in filters}
+    messages = []
+    for name in sorted(os.listdir('mail')):
+        with open(os.path.join('mail', name), 'rb') as f:
+            messages.append(email.message_from_bytes(f.read()))
+
+    def run():
+        saved = 0
+        for msg in messages:
+            mail_filter = by_sender[msg['From']]
+            saved += process_email(msg, mail_filter['creditor_id'], mail_filter['folder'], msg['Subject'])
+        return len(messages), saved
+    return run
+
+def stage_unpack_archives():
+    from modules.archive_handler import unpack_archives
+
+    def run():
+        extracted = unpack_archives(input_dir='incoming', output_dir='data/in')
+        return len(extracted), _manifest()['registry_rows']
+    return run
+
+def stage_preprocess_excels():
+    from modules.excel_processor import preprocess_excels
+
+    def run():
+        preprocess_excels(input_dir='data/in', output_dir='data/in')
+        registries = sum(1 for _, _, files in os.walk('data/in') for name in files
+                         if name.endswith('.xlsx') and not name.endswith('_original.xlsx'))
+        return registries, _manifest()['registry_rows']
+    return run
+
+def stage_collect_files():
+    from modules.config import load_configs
+    from modules.filewalker import collect_files
+    configs = load_configs()
+
+    def run():
+        files = collect_files(configs)
+        _save_state('collected', files)
+        return len(files), 0
+    return run
+
+def stage_process_files():
+    from modules.config import load_configs
+    from modules.parser import process_files
+    configs = load_configs()
+    files = _load_state('collected')
+
+    def run():
+        parsed = process_files(files, configs)
+        _save_state('parsed', parsed)
+        return len(files), len(parsed)
+    return run
+
+def stage_export():
+    from modules.exporter import export_to_json
+    parsed = _load_state('parsed')
+
+    def run():
+        export_to_json(parsed, {})
+        return 1, len(parsed)
+    return run
+
+def stage_aggregate_jsons():
+    from modules.aggregate_exports import aggregate_jsons, get_files_for_date
+
+    def run():
+        files = get_files_for_date(EXPORT_DATE)
+        aggregated = aggregate_jsons(EXPORT_DATE)
+        return len(files), len(aggregated)
+    return run
+
+STAGES = {
+    'process_email': stage_process_email,
+    'unpack_archives': stage_unpack_archives,
+    'preprocess_excels': stage_preprocess_excels,
+    'collect_files': stage_collect_files,
+    'process_files': stage_process_files,
+    'export': stage_export,
+    'aggregate_jsons': stage_aggregate_jsons,
+}
+
+def run_stage(name, workdir):
+    """Выполняет один этап в текущем процессе; результат — словарь метрик"""
+    os.chdir(workdir)
+    with contextlib.redirect_stdout(sys.stderr):
+        run = STAGES[name]()
+        started = time.perf_counter()
+        files, rows = run()
+        elapsed = time.perf_counter() - started
+    return {
+        'stage': name, 'seconds': round(elapsed, 4), 'files': files, 'rows': rows,
+        'files_per_s': round(files / elapsed, 1) if elapsed else None,
+        'rows_per_s': round(rows / elapsed, 1) if elapsed and rows else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def run_all(workdir, stages=None):
+    """Прогоняет этапы по порядку, каждый в отдельном процессе"""
+    results = {}
+    for name in stages or STAGES:
+        proc = subprocess.run([sys.executable, '-m', 'benchmarks.bench_stages', '--run-stage', name,
+                               '--workdir', workdir], cwd=ROOT, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"Этап {name} завершился с ошибкой:\n{proc.stderr[-2000:]}")
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+    return results
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare(results, baseline, max_regression):
+    """Строки отчёта и список этапов, где files/s упал больше чем на max_regression"""
+    lines, regressions = [], []
+    for name, result in results.items():
+        base = (baseline or {}).get('stages', {}).get(name)
+        delta = ''
+        if base and base.get('files_per_s') and result['files_per_s']:
+            ratio = result['files_per_s'] / base['files_per_s']
+            delta = f"{(ratio - 1) * 100:+6.1f}%"
+            if ratio < 1 - max_regression:
+                regressions.append(name)
+                delta += ' !'
+        rows_per_s = f"{result['rows_per_s']:10.0f}" if result['rows_per_s'] else f"{'-':>10s}"
+        lines.append(f"{name:18s} {result['seconds']:8.3f} с  {result['files']:6d} ф  "
+                     f"{result['files_per_s'] or 0:9.1f} ф/с  {rows_per_s} стр/с  "
+                     f"RSS {result['peak_rss_mb'] or 0:7.1f} МБ  {delta}")
+    return lines, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк этапов пайплайна')
+    parser.add_argument('--run-stage', choices=list(STAGES), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help='Папка корпуса (по умолчанию — временная)')
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES))
+    parser.add_argument('--save-baseline', action='store_true', help='Записать результаты в baseline.json')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Допустимое падение files/s относительно baseline (доля)')
+    for name, default in CORPUS_DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage, args.workdir)))
+        return 0
+
+    params = {name: getattr(args, name) for name in CORPUS_DEFAULTS}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workdir = args.workdir or os.path.join(tmp_dir, 'corpus')
+        started = time.perf_counter()
+        manifest = generate_corpus(workdir, **params)
+        print(f"Корпус: {manifest['share_files'] + manifest['archive_files']} файлов, "
+              f"{manifest['registry_rows']} строк реестров, {manifest['export_records']} записей выгрузок "
+              f"({time.perf_counter() - started:.1f} с)"
+              + (" — rar не найден, архивы только zip" if manifest['rar_skipped'] else ""))
+        results = run_all(workdir, args.stages)
+
+    baseline = load_baseline()
+    if baseline and baseline.get('params') != params:
+        print("Параметры корпуса отличаются от baseline — сравнение не выполняется")
+        baseline = None
+    lines, regressions = compare(results, baseline, args.max_regression)
+    print('\n'.join(lines))
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'params': params, 'stages': results}, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранён: {BASELINE_PATH}")
+    if regressions:
+        print(f"Регрессия производительности: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк старта main.py по `python -X importtime`.
+
+Показывает время импорта main и полного прогона лёгких режимов
+(--only-aggregation, пустой цикл без почты) в чистой рабочей папке,
+а также тяжёлые зависимости, которые успели загрузиться.
+
+    python -m benchmarks.bench_startup --top 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Не должны загружаться, пока этап, которому они нужны, не запущен
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'pdfplumber', 'pypdfium2', 'paramiko',
+                 'imaplib', 'docx', 'PIL', 'pytesseract', 'requests', 'rarfile')
+
+SCENARIOS = [
+    ('import main', ['-c', 'import main']),
+    ('--only-aggregation --no-ftp', [os.path.join(ROOT, 'main.py'), '--only-aggregation', '--no-ftp']),
+    ('--skip-mail --no-ftp', [os.path.join(ROOT, 'main.py'), '--skip-mail', '--no-ftp']),
+]
+
+def import_profile(args, cwd=ROOT):
+    """
+    Запускает python -X importtime с аргументами args.
+    Возвращает (секунды на весь процесс, {модуль: (собственное, накопленное) мкс}, код выхода).
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+        except (IndexError, ValueError):
+            continue
+    return elapsed, modules, result.returncode
+
+def heavy_imports(modules):
+    """Тяжёлые пакеты верхнего уровня среди загруженных модулей"""
+    return sorted(name for name in modules if name in HEAVY_MODULES)
+
+def make_workdir(tmp_dir):
+    """Чистая рабочая папка с конфигами: пустой цикл без входных файлов"""
+    shutil.copytree(os.path.join(ROOT, 'config'), os.path.join(tmp_dir, 'config'))
+    for folder in ('logs', 'exports', 'incoming', 'data/in'):
+        os.makedirs(os.path.join(tmp_dir, folder), exist_ok=True)
+    return tmp_dir
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк старта main.py')
+    parser.add_argument('--top', type=int, default=10, help='Сколько самых медленных импортов показать')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workdir = make_workdir(tmp_dir)
+        for name, cmd in SCENARIOS:
+            timings, modules, code = [], {}, 0
+            for _ in range(args.runs):
+                elapsed, modules, code = import_profile(cmd, cwd=workdir)
+                timings.append(elapsed)
+            print(f"{name:30s} {min(timings):7.3f} с  модулей: {len(modules):4d}  код: {code}  "
+                  f"тяжёлые: {', '.join(heavy_imports(modules)) or '-'}")
+            slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+            for module, (self_us, cumulative_us) in slowest:
+                print(f"    {self_us / 1000:7.1f} мс  {cumulative_us / 1000:7.1f} мс  {module}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Детерминированный генератор синтетического корпуса для бенчмарков.
+
+При одинаковых параметрах и seed содержимое корпуса одно и то же
+(отпечаток fingerprint в manifest.json); байты xlsx/zip могут отличаться
+только служебными датами внутри контейнеров.
+
+Структура корпуса:
+    config/                 конфиги репозитория, маршруты указывают на share/
+    mail/<n>.eml            письма кредиторов с zip-вложением
+    incoming/*.zip, *.rar   архивы с папками договоров (rar — если есть утилита rar)
+    share/<кредитор>/<договор>/  реестр, текстовый PDF, PDF-скан, PNG-скан
+    exports/export_<дата>_<n>.json  выгрузки для агрегации
+
+    python -m benchmarks.corpus /tmp/corpus --contracts 20 --rows 200
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import shutil
+import hashlib
+import zipfile
+import argparse
+import subprocess
+from email.message import EmailMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORPUS_DEFAULTS = {
+    'creditors': 2,
+    'contracts': 10,       # папок договоров на кредитора
+    'rows': 100,           # строк в реестре договора
+    'pdf_pages': 3,        # страниц в текстовом PDF и PDF-скане
+    'emails': 4,
+    'exports': 20,         # JSON-выгрузок для агрегации
+    'export_records': 200,
+    'seed': 42,
+}
+
+EXPORT_DATE = '20240115'
+ZIP_DATE = (2024, 1, 15, 0, 0, 0)
+
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов']
+FIRST_NAMES = ['Иван', 'Петр', 'Сергей', 'Алексей', 'Дмитрий', 'Андрей', 'Николай', 'Михаил']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевич', 'Алексеевич', 'Дмитриевич', 'Андреевич']
+CITIES = ['Москва', 'Казань', 'Самара', 'Тверь', 'Пермь', 'Омск']
+
+
+def _fio(rnd):
+    return f"{rnd.choice(LAST_NAMES)} {rnd.choice(FIRST_NAMES)} {rnd.choice(PATRONYMICS)}"
+
+def _date(rnd, year_from=1960, year_to=2024):
+    return f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.{rnd.randint(year_from, year_to)}"
+
+def registry_rows(rnd, count):
+    """Строки реестра в столбцах input_fields.yaml"""
+    rows = []
+    for i in range(count):
+        amount = rnd.randint(5, 300) * 1000
+        principal = rnd.randint(amount // 2, amount)
+        interest = rnd.randint(0, amount // 2)
+        penalty = rnd.randint(0, amount // 10)
+        rows.append([
+            i + 1, _fio(rnd), str(rnd.randint(10**11, 10**12 - 1)), f"7{rnd.randint(10**9, 10**10 - 1)}",
+            f"user{rnd.randint(1, 10**6)}@mail.ru", f"г. {rnd.choice(CITIES)}, ул. Ленина, д. {rnd.randint(1, 200)}",
+            str(rnd.randint(10**9, 10**10 - 1)), _date(rnd, 2019, 2024), amount,
+            principal + interest + penalty, principal, interest, penalty, rnd.randint(1, 900),
+        ])
+    return rows
+
+def write_registry(path, columns, rows):
+    """Реестр договора (.xlsx) в потоковом режиме openpyxl"""
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(columns)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_text_pdf(path, pages):
+    """Минимальный PDF с текстовым слоем (Helvetica, только ASCII): pages — список списков строк"""
+    objects = []
+    page_ids = []
+    font_id = 3
+    for lines in pages:
+        stream_lines = ['BT', '/F1 11 Tf', '14 TL', '50 800 Td']
+        stream_lines += [f"({_pdf_escape(line)}) '" for line in lines]
+        stream_lines.append('ET')
+        stream = '\n'.join(stream_lines).encode('latin-1')
+        content_id = 4 + len(objects)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_id = 4 + len(objects)
+        objects.append((f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                        f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>").encode())
+        page_ids.append(page_id)
+
+    kids = ' '.join(f"{pid} 0 R" for pid in page_ids)
+    head = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(head + objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+    with open(path, 'wb') as f:
+        f.write(out.getvalue())
+
+def _scan_image(lines, size=(620, 877)):
+    """Растр «скана»: текст на белом фоне без текстового слоя"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    # Растровый шрифт: FreeType-шрифт по умолчанию рисует на порядок медленнее
+    font = ImageFont.load_default_imagefont() if hasattr(ImageFont, 'load_default_imagefont') else None
+    img = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(lines):
+        draw.text((40, 40 + 18 * i), line, fill=0, font=font)
+    return img
+
+def write_scan_pdf(path, pages):
+    images = [_scan_image(lines).convert('RGB') for lines in pages]
+    images[0].save(path, 'PDF', resolution=75.0, save_all=True, append_images=images[1:])
+
+def write_scan_png(path, lines):
+    _scan_image(lines).save(path, 'PNG')
+
+def contract_documents(rnd, contract_no, pages):
+    """Текст договора по страницам (ASCII: стандартный шрифт PDF без кириллицы)"""
+    result = []
+    for page in range(pages):
+        lines = [f"Loan agreement No {contract_no}, page {page + 1}",
+                 f"Date: {_date(rnd, 2019, 2024)}",
+                 f"Borrower passport {rnd.randint(10, 99)} {rnd.randint(10, 99)} {rnd.randint(10**5, 10**6 - 1)}",
+                 f"Department code {rnd.randint(100, 999)}-{rnd.randint(100, 999)}",
+                 f"Amount: {rnd.randint(5, 300) * 1000} RUB, term {rnd.randint(7, 365)} days"]
+        lines += [f"Clause {page + 1}.{i}: " + ' '.join(rnd.choice(['terms', 'loan', 'payment', 'interest', 'debtor'])
+                                                       for _ in range(10)) for i in range(1, 25)]
+        result.append(lines)
+    return result
+
+def write_contract_folder(folder, rnd, contract_no, rows, pages, columns):
+    """Папка договора: реестр, текстовый PDF, PDF-скан и PNG-скан. Возвращает (файлов, строк)"""
+    os.makedirs(folder, exist_ok=True)
+    write_registry(os.path.join(folder, 'реестр.xlsx'), columns, registry_rows(rnd, rows))
+    text_pages = contract_documents(rnd, contract_no, pages)
+    write_text_pdf(os.path.join(folder, 'договор.pdf'), text_pages)
+    write_scan_pdf(os.path.join(folder, 'скан_договора.pdf'), text_pages)
+    write_scan_png(os.path.join(folder, 'паспорт.png'), text_pages[0][:6])
+    return 4, rows
+
+def _zip_folder(zip_path, folder):
+    """Zip с фиксированными датами записей"""
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                info = zipfile.ZipInfo(os.path.relpath(full, folder).replace(os.sep, '/'), ZIP_DATE)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(full, 'rb') as f:
+                    zf.writestr(info, f.read())
+
+def _rar_folder(rar_path, folder):
+    """RAR через утилиту rar (создавать RAR умеет только она); False, если её нет"""
+    if not shutil.which('rar'):
+        return False
+    subprocess.run(['rar', 'a', '-r', '-idq', '-ep1', os.path.abspath(rar_path), '.'],
+                   cwd=folder, check=True)
+    return True
+
+def write_config(root, creditors):
+    """Копия config/ с маршрутами на share/ корпуса"""
+    config_dir = os.path.join(root, 'config')
+    shutil.copytree(os.path.join(ROOT, 'config'), config_dir, dirs_exist_ok=True)
+    with open(os.path.join(config_dir, 'creditors_to_process.csv'), 'w', encoding='utf-8', newline='') as f:
+        f.write('creditor,link,status,description\n')
+        for creditor in creditors:
+            f.write(f"{creditor},{os.path.join('share', creditor)},к обработке,синтетический\n")
+    with open(os.path.join(config_dir, 'paths.json'), 'w', encoding='utf-8') as f:
+        json.dump({creditor: os.path.join('share', creditor) for creditor in creditors}, f, ensure_ascii=False)
+    return config_dir
+
+def write_email(path, rnd, mail_filter, attachment_path):
+    msg = EmailMessage()
+    msg['From'] = mail_filter['from']
+    msg['To'] = 'registry@company.ru'
+    msg['Subject'] = f"Реестр {mail_filter['name']} {_date(rnd, 2024, 2024)}"
+    msg.set_content('Реестр во вложении.')
+    with open(attachment_path, 'rb') as f:
+        msg.add_attachment(f.read(), maintype='application', subtype='zip',
+                           filename=os.path.basename(attachment_path))
+    with open(path, 'wb') as f:
+        f.write(bytes(msg))
+
+def write_exports(root, rnd, count, records, creditors):
+    """Выгрузки exporter за EXPORT_DATE; ~10% записей повторяются между файлами"""
+    exports_dir = os.path.join(root, 'exports')
+    os.makedirs(exports_dir, exist_ok=True)
+    total = 0
+    for n in range(count):
+        items = []
+        for i in range(records):
+            number = rnd.randint(10**9, 10**9 + count * records * 9 // 10)
+            items.append({'date': _date(rnd, 2019, 2024), 'number_ip': str(number), 'fio': _fio(rnd),
+                          'file': f"share/{rnd.choice(creditors)}/{number}/договор.pdf",
+                          'creditor': rnd.choice(creditors)})
+        with open(os.path.join(exports_dir, f"export_{EXPORT_DATE}_{n:04d}.json"), 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False, indent=2)
+        total += len(items)
+    return total
+
+def generate_corpus(root, **params):
+    """Генерирует корпус в папке root; возвращает манифест (он же root/manifest.json)"""
+    params = dict(CORPUS_DEFAULTS, **params)
+    rnd = random.Random(params['seed'])
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+    os.makedirs(root, exist_ok=True)
+
+    sys.path.insert(0, ROOT)
+    from modules.config import load_config_file
+    columns = load_config_file(os.path.join(ROOT, 'config', 'input_fields.yaml'))['input_fields']
+    mail_filters = load_config_file(os.path.join(ROOT, 'config', 'mail_filters.yaml'))['filters']
+
+    creditors = [f"CRED{i:02d}" for i in range(params['creditors'])]
+    write_config(root, creditors)
+    manifest = {'params': params, 'creditors': creditors, 'archives': [], 'rar_skipped': False,
+                'registry_rows': 0, 'share_files': 0, 'archive_files': 0, 'emails': 0}
+
+    # Папки договоров на шаре кредиторов (collect_files / process_files)
+    for creditor in creditors:
+        for c in range(params['contracts']):
+            contract_no = str(10**9 + rnd.randint(0, 10**8))
+            files, _ = write_contract_folder(os.path.join(root, 'share', creditor, contract_no), rnd,
+                                             contract_no, params['rows'], params['pdf_pages'], columns)
+            manifest['share_files'] += files
+            fingerprint.update(contract_no.encode())
+
+    # Архивы входящих реестров: по архиву на кредитора, каждый третий — rar, если можно
+    staging = os.path.join(root, '_staging')
+    incoming = os.path.join(root, 'incoming')
+    os.makedirs(incoming, exist_ok=True)
+    for n, creditor in enumerate(creditors):
+        folder = os.path.join(staging, creditor)
+        for c in range(params['contracts']):
+            contract_no = str(2 * 10**9 + rnd.randint(0, 10**8))
+            files, rows = write_contract_folder(os.path.join(folder, contract_no), rnd, contract_no,
+                                                params['rows'], params['pdf_pages'], columns)
+            manifest['archive_files'] += files
+            manifest['registry_rows'] += rows
+            fingerprint.update(contract_no.encode())
+        archive = os.path.join(incoming, f"{creditor}_реестр.rar" if n % 3 == 2 else f"{creditor}_реестр.zip")
+        if archive.endswith('.rar') and not _rar_folder(archive, folder):
+            manifest['rar_skipped'] = True
+            archive = archive[:-4] + '.zip'
+        if archive.endswith('.zip'):
+            _zip_folder(archive, folder)
+        manifest['archives'].append(os.path.relpath(archive, root))
+
+    # Письма кредиторов с архивом во вложении
+    mail_dir = os.path.join(root, 'mail')
+    os.makedirs(mail_dir, exist_ok=True)
+    first_archive = os.path.join(root, manifest['archives'][0])
+    for n in range(params['emails']):
+        write_email(os.path.join(mail_dir, f"{n:04d}.eml"), rnd, mail_filters[n % len(mail_filters)], first_archive)
+        manifest['emails'] += 1
+    shutil.rmtree(staging, ignore_errors=True)
+
+    manifest['export_records'] = write_exports(root, rnd, params['exports'], params['export_records'], creditors)
+    fingerprint.update(str(rnd.random()).encode())
+    manifest['fingerprint'] = fingerprint.hexdigest()
+    with open(os.path.join(root, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетического корпуса')
+    parser.add_argument('root')
+    for name, default in CORPUS_DEFAULTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = vars(parser.parse_args())
+    root = args.pop('root')
+    manifest = generate_corpus(root, **args)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
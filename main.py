@@ -4,21 +4,13 @@ import argparse
 from datetime import datetime
 import logging
 
-from modules.mail_parser import process_incoming_mail
-from modules.archive_handler import unpack_archives
-from modules.excel_processor import preprocess_excels
-from modules.route_selector import select_route
-from modules.config import load_configs
-from modules.validator import validate_all_configs
-from modules.state_manager import log_event, check_pause_flag, init_journals, close_journals
-from modules.filewalker import collect_files
-from modules.parser import process_files
-from modules.data_enrichment import enrich_data
-from modules.ai_client import analyze_with_ai
-from modules.exporter import export_to_json
-from modules.aggregate_exports import aggregate_jsons, save_aggregate
-from modules.ftp_client import send_file_to_ftp, wait_for_ack_file
-from modules.telegram_notifier import send_notification
+# Модули этапов импортируются внутри main() перед запуском этапа: pause.flag,
+# --only-aggregation и пустые циклы cron не тянут pandas, openpyxl, imaplib и т.п.
+from modules.state_manager import (log_event, check_pause_flag, init_journals, close_journals,
+                                  log_ftp_status, load_ftp_statuses)
+from modules.telegram_notifier import send_notification, start_dispatcher, stop_dispatcher
+from modules.metrics import stage_timer, ResourceSampler
+from modules import metrics
 
 def setup_logging():
     # Настройка логирования
@@ -45,13 +37,225 @@ def parse_arguments():
                        help='Не выполнять отправку на FTP')
     parser.add_argument('--only-aggregation', action='store_true',
                        help='Выполнить только агрегацию и передачу')
+    parser.add_argument('--full-export', action='store_true',
+                       help='Передать в 1С полные выгрузки вместо разностных (delta_settings.yaml)')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='STAGES',
+                       help='Профилировать этапы cProfile (через запятую или all; '
+                            'по умолчанию excel_processor,parser,aggregate) в logs/profiles/<run-id>/')
+    parser.add_argument('--profile-memory', action='store_true',
+                       help='С --profile: снимки tracemalloc и топ мест выделения памяти')
     return parser.parse_args()
 
+def deliver_exports(creditor_files, configs=None):
+    """
+    Передаёт выгрузки кредиторов на SFTP параллельно и ждёт квитанций 1С.
+    Статус каждого кредитора пишется в ftp_status.json; выгрузка, уже принятая 1С
+    в том же виде, повторно не отправляется. Возвращает код завершения.
+    """
+    from modules.ftp_client import (send_files_to_ftp, AckWatcher, close_sftp_sessions, file_digest,
+                                    load_ftp_settings, ACK_TIMEOUT, ACK_POLL_INTERVAL)
+    from modules.delta_export import commit_delivery
+
+    last_statuses = load_ftp_statuses()
+    to_send = {}
+    for creditor, local_path in creditor_files.items():
+        file_name = os.path.basename(local_path)
+        digest = file_digest(local_path).hex()
+        last = last_statuses.get(file_name, {})
+        if last.get('status') == 'accepted' and last.get('sha256') == digest:
+            log_ftp_status(file_name, creditor, "duplicate", "Уже принят 1С, повторно не отправляется")
+            continue
+        to_send[local_path] = (creditor, digest)
+
+    def on_sent(local_path, remote_path):
+        creditor, digest = to_send[local_path]
+        log_ftp_status(os.path.basename(local_path), creditor, "success", "Успешно передан на SFTP",
+                       remote_path=remote_path, sha256=digest)
+        ack_watcher.add(remote_path)
+
+    # Квитанции ждём в фоне, пока передаются файлы остальных кредиторов
+    ftp_cfg = load_ftp_settings()
+    ack_watcher = AckWatcher(timeout=float(ftp_cfg.get('ack_timeout', ACK_TIMEOUT)),
+                             poll_interval=float(ftp_cfg.get('poll_interval', ACK_POLL_INTERVAL))).start()
+    try:
+        sent = send_files_to_ftp(list(to_send), on_sent=on_sent)
+    finally:
+        acks = ack_watcher.finish()
+        close_sftp_sessions()
+
+    exit_code = 0
+    for local_path, (remote_path, error) in sent.items():
+        creditor, digest = to_send[local_path]
+        file_name = os.path.basename(local_path)
+        if error is not None:
+            log_ftp_status(file_name, creditor, "error", str(error), sha256=digest)
+            log_event(stage="ftp_send", status="error", creditor=creditor, file=local_path, error_msg=str(error))
+            logging.error(f"Ошибка отправки выгрузки {creditor} на SFTP: {error}")
+            send_notification(f"Ошибка передачи выгрузки для {creditor} на SFTP!", error=str(error),
+                              creditor=creditor, stage="ftp_send")
+            exit_code = 3
+            continue
+
+        log_event(stage="ftp_send", status="success", creditor=creditor, file=local_path, remote_path=remote_path)
+        ack_status, ack_info = acks[remote_path]
+        ftp_status = {"success": "accepted", "fail": "rejected"}.get(ack_status, ack_status)
+        log_ftp_status(file_name, creditor, ftp_status, ack_info, remote_path=remote_path, sha256=digest)
+        log_event(stage="ftp_ack", status=ack_status, creditor=creditor, file=local_path, ack_info=ack_info)
+        if ack_status == "success":
+            logging.info(f"Выгрузка {creditor} принята 1С, получена квитанция")
+            # Принятое 1С — база для следующей разностной выгрузки
+            commit_delivery(creditor, file_name, configs)
+        else:
+            logging.error(f"Ошибка при получении квитанции от 1С для {creditor}: {ack_info}")
+            send_notification(f"Ошибка при получении квитанции от 1С для {creditor}!", info=ack_info,
+                              creditor=creditor, stage="ftp_ack")
+            exit_code = exit_code or 4
+
+    if to_send and exit_code == 0:
+        send_notification("Выгрузка завершена успешно! Файлы приняты 1С.")
+    return exit_code
+
+def run_processing(args, configs):
+    """Этапы от почты до JSON-выгрузки (пропускаются при --only-aggregation)"""
+    # Несколько хостов на одной шаре делят работу арендами (cluster_settings.yaml)
+    from modules.leases import open_coordinator
+    coordinator = open_coordinator(configs)
+    try:
+        _run_processing(args, configs, coordinator)
+    finally:
+        if coordinator is not None:
+            coordinator.close()
+
+def _run_processing(args, configs, coordinator):
+    # Обработка почты (если не пропущена); почтовый ящик разбирает один хост
+    if not args.skip_mail:
+        if coordinator is not None and not coordinator.acquire("stage:mail"):
+            logging.info("Почту разбирает другой хост — этап пропущен")
+        else:
+            logging.info("Проверка новых писем и загрузка вложений...")
+            from modules.mail_parser import process_incoming_mail
+            with stage_timer("mail_parser"):
+                process_incoming_mail(configs)
+            if coordinator is not None:
+                coordinator.release("stage:mail")
+
+    # Распаковка архивов
+    logging.info("Распаковка архивов...")
+    from modules.archive_handler import unpack_archives
+    with stage_timer("archive_handler"):
+        unpack_archives(input_dir="incoming", output_dir="data/in")
+
+    # Документы шары все этапы — от дополнения Excel до OCR — читают из локальной
+    # копии (share_cache_settings.yaml): каждый файл тянется по сети один раз
+    from modules.share_cache import open_share_cache, close_share_cache
+    open_share_cache(configs)
+    try:
+        enriched_results = _read_documents(args, configs, coordinator)
+    finally:
+        close_share_cache()
+
+    # AI-анализ
+    logging.info("Анализ и дополнение полей через AI...")
+    from modules.ai_client import analyze_with_ai
+    with stage_timer("ai_client"):
+        ai_results = analyze_with_ai(enriched_results, configs)
+    log_event(stage="ai_client", status="ok", count=len(ai_results))
+
+    # Экспорт в JSON
+    logging.info("Формирование JSON-выгрузок...")
+    from modules.exporter import export_to_json
+    with stage_timer("exporter"):
+        export_path = export_to_json(ai_results, configs)
+    log_event(stage="exporter", status="ok", file=export_path)
+
+    if coordinator is not None:
+        coordinator.complete(doc['file'] for doc in ai_results)
+
+def _read_documents(args, configs, coordinator):
+    """Этапы, читающие документы: подготовка и дополнение Excel, сбор, парсинг, OCR"""
+    # Предобработка Excel-файлов
+    logging.info("Подготовка Excel-реестров...")
+    from modules.excel_processor import preprocess_excels
+    with stage_timer("excel_processor"):
+        preprocess_excels(input_dir="data/in", output_dir="data/in")
+
+    # Дополнение пустых ячеек Excel из документов папки договора
+    logging.info("Дополнение Excel-реестров из документов договоров...")
+    from modules.data_enrichment import enrich_data, enrich_excels
+    with stage_timer("enrich_excels"):
+        enrich_excels(input_dir="data/in", configs=configs)
+
+    # Сбор файлов для обработки
+    logging.info("Сбор новых файлов для обработки...")
+    from modules.filewalker import collect_files
+    with stage_timer("filewalker"):
+        files_to_process = collect_files(configs)
+
+    # Маршрутизация (с --debug-routing — отчёт logs/routing_debug.json)
+    logging.info("Маршрутизация файлов...")
+    from modules.route_selector import select_route
+    with stage_timer("route_selector"):
+        files_to_process = select_route(files_to_process, configs, debug=args.debug_routing)
+    
+    log_event(stage="filewalker", status="ok", count=len(files_to_process))
+
+    # Файлы, ждущие повтора после временного сбоя или окончательно не разобранные, — не сейчас
+    from modules.retry_queue import open_retry_queue
+    retry_queue = open_retry_queue(configs)
+    files_to_process = retry_queue.filter(files_to_process)
+
+    # Берём в аренду папки договоров, не занятые другими хостами
+    if coordinator is not None:
+        files_to_process = coordinator.claim(files_to_process)
+
+    # Очередь: срочные форматы и малые файлы раньше, кредиторы по кругу (scheduler_settings.yaml)
+    from modules.scheduler import schedule_files
+    with stage_timer("scheduler"):
+        files_to_process, deferred = schedule_files(files_to_process, configs)
+    if deferred:
+        logging.info(f"Отложено до следующего цикла: {len(deferred)} файлов")
+
+    # Парсинг файлов
+    logging.info(f"Парсинг {len(files_to_process)} файлов...")
+    from modules.parser import process_files
+    with stage_timer("parser", files=len(files_to_process)):
+        parsed_results = process_files(files_to_process, configs, retry_queue)
+    log_event(stage="parser", status="ok", count=len(parsed_results))
+
+    # Обогащение данных (OCR/AI)
+    logging.info("Обогащение данных (OCR/AI)...")
+    with stage_timer("data_enrichment"):
+        enriched_results = enrich_data(parsed_results, configs, retry_queue)
+    log_event(stage="data_enrichment", status="ok", count=len(enriched_results))
+    return enriched_results
+
 def main():
     # Основная функция оркестратора
     args = parse_arguments()
     setup_logging()
-    
+
+    # Метрики этапов: process_log.json и logs/metrics/ip_processor.prom
+    if args.profile is not None:
+        from modules.profiler import start_run, parse_stages
+        run = start_run(parse_stages(args.profile), memory=args.profile_memory)
+        logging.info(f"Профилирование этапов, артефакты: {run.dir}")
+    sampler = ResourceSampler().start()
+    try:
+        exit_code = run_pipeline(args)
+    finally:
+        sampler.stop()
+        if args.profile is not None:
+            from modules.profiler import finish_run
+            finish_run()
+        stop_dispatcher()
+    try:
+        metrics.flush(exit_code)
+    except Exception as ex:
+        logging.warning(f"Метрики не сохранены: {ex}")
+    return exit_code
+
+def run_pipeline(args):
+    """Все этапы запуска; возвращает код завершения"""
     try:
         logging.info("Запуск системы автоматизации обработки реестров")
         
@@ -67,7 +271,12 @@ def main():
 
         # Загрузка конфигурации
         logging.info("Загрузка справочников и конфигов...")
-        configs = load_configs()
+        from modules.config import load_configs
+        from modules.validator import validate_all_configs
+        with stage_timer("config"):
+            configs = load_configs()
+        # Уведомления уходят в Telegram из фонового потока (telegram_settings.yaml)
+        start_dispatcher(configs)
         validation_ok, errors = validate_all_configs(configs)
         if not validation_ok:
             log_event(stage="init", status="critical_error", error_msg=str(errors))
@@ -75,83 +284,29 @@ def main():
             close_journals()
             return 1
 
-        # Обработка почты (если не пропущена)
-        if not args.skip_mail:
-            logging.info("Проверка новых писем и загрузка вложений...")
-            process_incoming_mail(configs)
-
-        # Распаковка архивов
-        logging.info("Распаковка архивов...")
-        unpack_archives(input_dir="incoming", output_dir="data/in")
-
-        # Предобработка Excel-файлов
-        logging.info("Подготовка Excel-реестров...")
-        preprocess_excels(input_dir="data/in", output_dir="data/in")
-
-        # Сбор файлов для обработки
-        logging.info("Сбор новых файлов для обработки...")
-        files_to_process = collect_files(configs)
-
-        # Маршрутизация
-        if args.debug_routing:
-            logging.info("Маршрутизация файлов...")
-            files_to_process = select_route(files_to_process, configs)
-        
-        log_event(stage="filewalker", status="ok", count=len(files_to_process))
-
-        # Парсинг файлов
-        logging.info(f"Парсинг {len(files_to_process)} файлов...")
-        parsed_results = process_files(files_to_process, configs)
-        log_event(stage="parser", status="ok", count=len(parsed_results))
-
-        # Обогащение данных (OCR/AI)
-        logging.info("Обогащение данных (OCR/AI)...")
-        enriched_results = enrich_data(parsed_results, configs)
-        log_event(stage="data_enrichment", status="ok", count=len(enriched_results))
-
-        # AI-анализ
-        logging.info("Анализ и дополнение полей через AI...")
-        ai_results = analyze_with_ai(enriched_results, configs)
-        log_event(stage="ai_client", status="ok", count=len(ai_results))
-
-        # Экспорт в JSON
-        logging.info("Формирование JSON-выгрузок...")
-        export_path = export_to_json(ai_results, configs)
-        log_event(stage="exporter", status="ok", file=export_path)
+        if not args.only_aggregation:
+            run_processing(args, configs)
 
-        # Агрегация выгрузок
+        # Агрегация выгрузок (общий архив за сутки и файлы по кредиторам)
         logging.info("Агрегация всех выгрузок за сутки...")
+        from modules.aggregate_exports import aggregate_jsons_by_creditor, save_aggregate, save_creditor_aggregates
         date_str = datetime.now().strftime('%Y%m%d')
-        aggregated = aggregate_jsons(date_str)
-        agg_path = save_aggregate(aggregated, date_str)
-        log_event(stage="aggregate", status="ok", file=agg_path)
+        with stage_timer("aggregate"):
+            partitions = aggregate_jsons_by_creditor(date_str)
+            agg_path = save_aggregate([doc for docs in partitions.values() for doc in docs], date_str)
+            creditor_files = save_creditor_aggregates(partitions, date_str)
+        log_event(stage="aggregate", status="ok", file=agg_path, creditors=list(creditor_files))
 
-        # Передача на FTP (если не отключена)
+        # Передача на FTP (если не отключена): разности относительно принятого 1С или полные выгрузки
         if not args.no_ftp:
-            logging.info("Передача итогового файла на SFTP/FTP...")
-            try:
-                remote_path = send_file_to_ftp(agg_path)
-                log_event(stage="ftp_send", status="success", file=agg_path, remote_path=remote_path)
-                
-                # Ожидание подтверждения от 1С
-                logging.info("Ожидание квитанции от 1С...")
-                ack_status, ack_info = wait_for_ack_file(remote_path)
-                log_event(stage="ftp_ack", status=ack_status, file=agg_path, ack_info=ack_info)
-                
-                if ack_status == "success":
-                    logging.info("Файл принят 1С, получена квитанция")
-                    send_notification("Выгрузка завершена успешно! Файл принят 1С.")
-                else:
-                    logging.error(f"Ошибка при получении квитанции от 1С: {ack_info}")
-                    send_notification("Ошибка при получении квитанции от 1С!", info=ack_info)
-                    return 4
-                    
-            except Exception as e:
-                log_event(stage="ftp_send", status="error", file=agg_path, error_msg=str(e))
-                logging.error(f"Ошибка отправки файла на SFTP: {e}")
+            from modules.delta_export import prepare_deliveries
+            deliveries = prepare_deliveries(partitions, creditor_files, date_str, configs, full=args.full_export)
+            logging.info("Передача выгрузок по кредиторам на SFTP/FTP...")
+            with stage_timer("ftp_send", files=len(deliveries)):
+                exit_code = deliver_exports(deliveries, configs)
+            if exit_code:
                 close_journals()
-                send_notification("Ошибка передачи файла на SFTP!", error=str(e))
-                return 3
+                return exit_code
 
         # Завершение
         close_journals()
@@ -1,56 +1,135 @@
 # -*- coding: utf-8 -*-
 """
 Модуль агрегации экспортов.
+
+Записи за сутки читаются из столбцовых пачек выгрузок (columnar.py), JSON
+формируется только в итоговых файлах.
 """
 
 import os
 import json
 from datetime import datetime
 from .state_manager import log_event
+from .columnar import open_export, key_array, first_occurrences
 
 EXPORTS_DIR = "exports"
 DATE_FMT = "%Y%m%d"
+ARCHIVE_PREFIX = "IP_ARXIVE_"
+CREDITOR_PREFIX = "выгрузка_"
+UNKNOWN_CREDITOR = "UNKNOWN"
 
 def get_files_for_date(date_str):
     """Находит все JSON-файлы с выгрузками за указанную дату"""
     files = []
     if os.path.exists(EXPORTS_DIR):
         for fname in os.listdir(EXPORTS_DIR):
+            # Итоговые файлы агрегации сами не агрегируются
+            if fname.startswith((ARCHIVE_PREFIX, CREDITOR_PREFIX)):
+                continue
             if fname.endswith('.json') and date_str in fname:
                 files.append(os.path.join(EXPORTS_DIR, fname))
     return files
 
-def aggregate_jsons(date_str):
-    """Агрегирует все выгрузки за сутки"""
-    files = get_files_for_date(date_str)
-    seen_keys = set()
-    aggregated = []
-    
-    for fpath in files:
+def _open_batches(date_str):
+    batches = []
+    for fpath in get_files_for_date(date_str):
         try:
-            with open(fpath, encoding='utf-8') as f:
-                items = json.load(f)
-            for doc in items:
-                # Используем кортеж (номер, дата) как ключ для уникальности
-                key = (doc.get('number_ip'), doc.get('date'))
-                if key in seen_keys:
-                    continue
-                seen_keys.add(key)
-                aggregated.append(doc)
+            batches.append(open_export(fpath))
         except Exception as ex:
             log_event(stage="aggregate", status="error", file=fpath, error=str(ex))
-            continue
-    
-    return aggregated
+    return batches
+
+def _key_columns(batches):
+    """Столбцы number_ip, date, creditor всех пачек подряд и маска первых вхождений (number_ip, date)"""
+    number_ip = key_array([v for batch in batches for v in batch.column('number_ip')])
+    dates = key_array([v for batch in batches for v in batch.column('date')])
+    creditors = key_array([v for batch in batches for v in batch.column('creditor')])
+    creditors[[not c for c in creditors]] = UNKNOWN_CREDITOR
+    return creditors, first_occurrences(number_ip, dates)
+
+def _load_unique(date_str):
+    """
+    Уникальные по (number_ip, date) записи за сутки в порядке файлов:
+    ключи читаются столбцами из пачек, дубли отсекаются по массивам.
+    Возвращает (записи, кредиторы записей, всего строк).
+    """
+    batches = _open_batches(date_str)
+    if not batches:
+        return [], [], 0
+    import numpy as np
+    try:
+        creditors, keep = _key_columns(batches)
+        docs, start = [], 0
+        for batch in batches:
+            rows = np.flatnonzero(keep[start:start + batch.length])
+            if len(rows):
+                docs.extend(batch.records(rows.tolist()))
+            start += batch.length
+    finally:
+        for batch in batches:
+            batch.close()
+    return docs, creditors[keep], len(keep)
+
+def daily_stats(date_str):
+    """Статистика за сутки без сборки записей: всего, уникальных, дублей, по кредиторам"""
+    import pandas as pd
+    batches = _open_batches(date_str)
+    try:
+        creditors, keep = _key_columns(batches)
+    finally:
+        for batch in batches:
+            batch.close()
+    frame = pd.DataFrame({'creditor': creditors, 'unique': keep})
+    by_creditor = frame.groupby('creditor', sort=True)['unique'].agg(['size', 'sum'])
+    return {
+        'records': int(len(keep)), 'unique': int(keep.sum()), 'duplicates': int(len(keep) - keep.sum()),
+        'by_creditor': {str(c): {'records': int(row['size']), 'unique': int(row['sum'])}
+                        for c, row in by_creditor.iterrows()},
+    }
+
+def aggregate_jsons(date_str):
+    """Агрегирует все выгрузки за сутки"""
+    return _load_unique(date_str)[0]
+
+def aggregate_jsons_by_creditor(date_str):
+    """Агрегирует выгрузки за сутки, раскладывая записи по кредиторам (по столбцу creditor)"""
+    docs, creditors, total = _load_unique(date_str)
+    partitions = {}
+    if docs:
+        import numpy as np
+        import pandas as pd
+        codes, names = pd.factorize(creditors)
+        # Одна устойчивая сортировка и разрез по границам групп: порядок записей внутри кредитора сохраняется
+        order = np.argsort(codes, kind='stable')
+        bounds = np.cumsum(np.bincount(codes, minlength=len(names)))[:-1]
+        for creditor, rows in zip(names, np.split(order, bounds)):
+            partitions[creditor] = [docs[i] for i in rows]
+    log_event(stage="aggregate", status="stats", date=date_str, records=total, unique=len(docs),
+              duplicates=total - len(docs), by_creditor={c: len(d) for c, d in partitions.items()})
+    return partitions
+
+def _dump(records, out_path):
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
 
 def save_aggregate(aggregated, date_str):
     """Сохраняет итоговый агрегированный файл за сутки"""
     os.makedirs(EXPORTS_DIR, exist_ok=True)
-    out_name = f"IP_ARXIVE_{date_str}.json"
+    out_name = f"{ARCHIVE_PREFIX}{date_str}.json"
     out_path = os.path.join(EXPORTS_DIR, out_name)
-    
-    with open(out_path, 'w', encoding='utf-8') as f:
-        json.dump(aggregated, f, ensure_ascii=False, indent=2)
-    
+
+    _dump(aggregated, out_path)
+
     log_event(stage="aggregate", status="ok", file=out_path, count=len(aggregated))
-    return out_path 
\ No newline at end of file
+    return out_path
+
+def save_creditor_aggregates(partitions, date_str):
+    """Сохраняет выгрузку_<дата>_<кредитор>.json по каждому кредитору; {creditor: path}"""
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    paths = {}
+    for creditor, records in partitions.items():
+        out_path = os.path.join(EXPORTS_DIR, f"{CREDITOR_PREFIX}{date_str}_{creditor}.json")
+        _dump(records, out_path)
+        log_event(stage="aggregate", status="ok", file=out_path, creditor=creditor, count=len(records))
+        paths[creditor] = out_path
+    return paths 
\ No newline at end of file
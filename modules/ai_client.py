@@ -1,9 +1,213 @@
 # -*- coding: utf-8 -*-
 """
 Модуль AI-анализа данных.
+
+Записи с незаполненными обязательными полями отправляются во внешний
+LLM (OpenAI-совместимый /chat/completions: DeepSeek, YandexGPT и др.)
+пачками по batch_size, пачки идут параллельно не более concurrency
+одновременно, каждая с таймаутом. В запросе — отрывок текста документа
+(EXCERPT_FIELD записи от парсера/OCR): запись без текста в AI не уходит,
+угадывать номер договора или ФИО по имени файла модели не предлагается.
+Отрывок из записей убирается всегда — в выгрузку он не попадает.
+Одинаковые запросы в пределах запуска отправляются один раз, ответы
+кэшируются на диске по sha256(запрос с отрывком + модель).
+В кэш попадают только ответы, заполнившие хотя бы одно поле: пустой ответ
+или ошибка пачки не закрепляются, и запись уходит в AI в следующем запуске.
 """
 
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from .state_manager import log_event, log_error
+from .records import EXCERPT_FIELD
+
+AI_SETTINGS_DEFAULT = {
+    'enabled': False,
+    'endpoint': 'http://127.0.0.1:8089/v1/chat/completions',
+    'model': 'deepseek-chat',
+    'api_key': '',
+    'batch_size': 20,
+    'concurrency': 4,
+    'timeout': 60,
+    'cache_dir': 'data/ai_cache',
+    'required_fields': ['date', 'number_ip', 'fio'],
+}
+
+SYSTEM_PROMPT = (
+    "Ты помощник по разбору документов по исполнительным производствам. "
+    "Тебе передан JSON {\"items\": {id: {\"known\": {...}, \"missing\": [...], \"file\": ..., \"text\": ...}}}, "
+    "где text — отрывок текста документа. Для каждого id найди в text значения полей из missing. "
+    "Ответь только JSON {\"results\": {id: {поле: значение}}}; если значения в text нет — пустая строка, "
+    "не додумывай."
+)
+
+def load_ai_settings(configs):
+    """Настройки AI из ai_settings.yaml поверх значений по умолчанию"""
+    settings = dict(AI_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('ai_settings.yaml') or {})
+    return settings
+
+def build_prompt(doc, missing):
+    """Запрос по одной записи: известные поля, недостающие поля, имя файла и отрывок текста"""
+    known = {k: v for k, v in doc.items()
+             if v and k not in ('file', 'creditor', EXCERPT_FIELD) and isinstance(v, str)}
+    return {
+        'known': dict(sorted(known.items())),
+        'missing': sorted(missing),
+        'file': os.path.basename(doc.get('file', '')),
+        'text': doc.get(EXCERPT_FIELD, ''),
+    }
+
+def _without_excerpt(doc):
+    if EXCERPT_FIELD not in doc:
+        return doc
+    doc = doc.copy()
+    del doc[EXCERPT_FIELD]
+    return doc
+
+def prompt_key(prompt, model):
+    """Ключ кэша: sha256 канонического JSON запроса и модели"""
+    payload = json.dumps(prompt, ensure_ascii=False, sort_keys=True) + '\n' + model
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+def cache_get(cache_dir, key):
+    path = _cache_path(cache_dir, key)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+    return None
+
+def cache_put(cache_dir, key, fields):
+    path = _cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fields, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _post_batch(session, settings, items):
+    """Один HTTP-запрос с пачкой записей; возвращает {id: {поле: значение}}"""
+    headers = {'Content-Type': 'application/json'}
+    if settings.get('api_key'):
+        headers['Authorization'] = f"Bearer {settings['api_key']}"
+    body = {
+        'model': settings['model'],
+        'messages': [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': json.dumps({'items': items}, ensure_ascii=False)},
+        ],
+        'response_format': {'type': 'json_object'},
+        'temperature': 0,
+    }
+    response = session.post(settings['endpoint'], json=body, headers=headers,
+                            timeout=float(settings['timeout']))
+    response.raise_for_status()
+    content = response.json()['choices'][0]['message']['content']
+    return json.loads(content).get('results', {})
+
+async def _run_batches(settings, batches):
+    """Параллельные запросы пачек с ограничением concurrency и таймаутом на пачку"""
+    import requests
+
+    concurrency = max(1, int(settings['concurrency']))
+    semaphore = asyncio.Semaphore(concurrency)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    async def _one(items):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(_post_batch, session, settings, items),
+                    timeout=float(settings['timeout']))
+            except Exception as ex:
+                log_error(stage="ai_client", error_msg=f"{type(ex).__name__}: {ex}", batch_size=len(items))
+                return {}
+
+    try:
+        results = await asyncio.gather(*(_one(items) for items in batches))
+    finally:
+        session.close()
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
 def analyze_with_ai(enriched_results, configs):
     """AI-анализ и дополнение данных"""
-    # Заглушка - возвращает данные без изменений
-    return enriched_results 
\ No newline at end of file
+    settings = load_ai_settings(configs)
+    if not settings.get('enabled'):
+        return [_without_excerpt(doc) for doc in enriched_results]
+
+    model = settings['model']
+    cache_dir = settings['cache_dir']
+    required = settings['required_fields']
+
+    # Записи с полным набором полей в AI не уходят; одинаковые запросы — один раз
+    doc_keys = {}
+    prompts = {}
+    answers = {}
+    no_text = 0
+    for i, doc in enumerate(enriched_results):
+        missing = [field for field in required if not doc.get(field)]
+        if not missing:
+            continue
+        if not doc.get(EXCERPT_FIELD):
+            no_text += 1
+            continue
+        prompt = build_prompt(doc, missing)
+        key = prompt_key(prompt, model)
+        doc_keys[i] = key
+        if key in answers or key in prompts:
+            continue
+        cached = cache_get(cache_dir, key)
+        if cached is not None:
+            answers[key] = cached
+        else:
+            prompts[key] = prompt
+
+    batches = []
+    if prompts:
+        keys = list(prompts)
+        batch_size = max(1, int(settings['batch_size']))
+        batches = [{key: prompts[key] for key in keys[i:i + batch_size]}
+                   for i in range(0, len(keys), batch_size)]
+        fetched = asyncio.run(_run_batches(settings, batches))
+        for key in keys:
+            fields = fetched.get(key)
+            if not isinstance(fields, dict):
+                continue
+            answers[key] = fields
+            if any(fields.get(field) for field in prompts[key]['missing']):
+                cache_put(cache_dir, key, fields)
+
+    filled = 0
+    results = []
+    for i, doc in enumerate(enriched_results):
+        key = doc_keys.get(i)
+        fields = answers.get(key) if key else None
+        doc = _without_excerpt(doc)
+        if fields:
+            doc = doc.copy()
+            for field in required:
+                if not doc.get(field) and fields.get(field):
+                    doc[field] = str(fields[field])
+                    filled += 1
+        results.append(doc)
+
+    unique_prompts = len(set(doc_keys.values()))
+    log_event(stage="ai_client", status="ok", records=len(enriched_results), incomplete=len(doc_keys), no_text=no_text,
+              unique_prompts=unique_prompts, cache_hits=unique_prompts - len(prompts),
+              requests=len(batches), fields_filled=filled)
+    logging.info(f"AI: записей к анализу {len(doc_keys)}, новых запросов {len(prompts)}, заполнено полей {filled}")
+    return results
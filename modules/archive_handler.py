@@ -3,6 +3,7 @@ import shutil
 import zipfile
 import logging
 from .state_manager import log_event, log_error
+from .attachment_store import AttachmentStore, sha256_file
 
 def is_archive(file_path):
     """Проверка - архив или нет"""
@@ -50,8 +51,17 @@ def cleanup_folder(folder, allowed_exts):
     log_event(stage="archive_handler", status="cleanup", folder=folder, removed=removed)
     return removed
 
-def unpack_archives(input_dir="incoming", output_dir="data/in"):
-    # Находит архивы в папке input_dir, распаковывает их в output_dir
+def find_unpacked(store, digest):
+    """Ссылка на уже распакованный архив с тем же содержимым (папка ещё существует) или None"""
+    for ref in store.refs(digest):
+        if ref.get('kind') == 'archive' and ref.get('extract_dir') and os.path.isdir(ref['extract_dir']):
+            return ref
+    return None
+
+def unpack_archives(input_dir="incoming", output_dir="data/in", store=None):
+    # Находит архивы в папке input_dir, распаковывает их в output_dir.
+    # Архив с уже распакованным содержимым (sha256 в AttachmentStore) повторно не распаковывается.
+    store = store or AttachmentStore()
     if not os.path.exists(input_dir):
         log_error(stage="archive_handler", error_msg=f"Входная папка не найдена: {input_dir}")
         return []
@@ -63,11 +73,19 @@ def unpack_archives(input_dir="incoming", output_dir="data/in"):
         for file in files:
             file_path = os.path.join(root, file)
             if is_archive(file_path):
+                digest = sha256_file(file_path)
+                unpacked = find_unpacked(store, digest)
+                if unpacked:
+                    log_event(stage="archive_handler", status="duplicate", archive=file_path,
+                              same_as=unpacked['path'], extract_dir=unpacked['extract_dir'], sha256=digest)
+                    continue
                 # Создаём уникальную рабочую папку для архива
                 extract_dir = os.path.join(output_dir, os.path.splitext(file)[0])
                 os.makedirs(extract_dir, exist_ok=True)
                 extracted = extract_archive(file_path, extract_dir)
                 cleanup_folder(extract_dir, allowed_exts)
+                if extracted:
+                    store.add_ref(digest, file_path, kind='archive', extract_dir=extract_dir)
                 new_files.extend(extracted)
     
     return new_files 
\ No newline at end of file
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище вложений с адресацией по содержимому (sha256).
+
+Каждое уникальное содержимое хранится один раз: objects/<ab>/<sha256>.
+Файлы в папках сессий — жёсткие ссылки на объект (если файловая система
+их не поддерживает — копии). refs/<ab>/<sha256>.json перечисляет все места,
+где встречалось это содержимое; первое из них — оригинал. По нему этапы
+видят «то же, что в сессии X» и не обрабатывают повтор:
+process_email пишет same_as в meta.json, unpack_archives не распаковывает
+уже распакованный архив, collect_files пропускает копии уже обработанных файлов.
+Хранилище лежит на той же шаре, что и папки сессий, — иначе ссылки невозможны.
+
+Файл сессии — та же жёсткая ссылка, что и объект во всех других сессиях,
+поэтому объекты только для чтения (OBJECT_MODE). Менять файл сессии на месте
+нельзя: этап пишет результат в новый файл и подменяет им файл сессии
+(os.replace) — ссылка рвётся только у этого пути, объект не меняется.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import datetime
+from .state_manager import log_event, log_error
+
+STORE_DIR = os.path.join("сеть", "asf01", "files", ".store")
+CHUNK_SIZE = 1 << 20
+OBJECT_MODE = 0o444
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentStore:
+    """Объекты по sha256 и список мест, где встречалось содержимое"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def _refs_path(self, digest):
+        return os.path.join(self.root, 'refs', digest[:2], f"{digest}.json")
+
+    def put(self, data):
+        """Сохраняет содержимое, если его ещё нет; (sha256, было ли новым)"""
+        digest = sha256_bytes(data)
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, OBJECT_MODE)
+        os.replace(tmp_path, path)
+        return digest, True
+
+    def link(self, digest, dest_path):
+        """Кладёт объект в dest_path жёсткой ссылкой (или копией); 'hardlink' / 'copy'"""
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(self.object_path(digest), dest_path)
+            return 'hardlink'
+        except OSError:
+            shutil.copyfile(self.object_path(digest), dest_path)
+            return 'copy'
+
+    def refs(self, digest):
+        try:
+            with open(self._refs_path(digest), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def add_ref(self, digest, path, **info):
+        """Запоминает место с этим содержимым; возвращает оригинал (первую ссылку) или None"""
+        refs = self.refs(digest)
+        original = refs[0] if refs else None
+        if not any(ref.get('path') == path for ref in refs):
+            refs.append(dict(path=path, added=datetime.datetime.now().isoformat(), **info))
+            refs_path = self._refs_path(digest)
+            os.makedirs(os.path.dirname(refs_path), exist_ok=True)
+            tmp_path = f"{refs_path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(refs, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, refs_path)
+        if original is not None and original.get('path') == path:
+            return None
+        return original
+
+    def save_attachment(self, data, dest_path, **info):
+        """
+        Вложение письма: объект в хранилище и ссылка в папке сессии.
+        Возвращает {'sha256', 'link', 'same_as'}; same_as — путь первой копии или None.
+        """
+        digest, _ = self.put(data)
+        try:
+            link = self.link(digest, dest_path)
+        except OSError as ex:
+            log_error(stage="attachment_store", file=dest_path, error_msg=str(ex))
+            with open(dest_path, 'wb') as f:
+                f.write(data)
+            link = 'copy'
+        original = self.add_ref(digest, dest_path, **info)
+        same_as = original['path'] if original else None
+        if same_as:
+            log_event(stage="attachment_store", status="duplicate", file=dest_path, same_as=same_as, sha256=digest)
+        return {'sha256': digest, 'link': link, 'same_as': same_as}
+
+
+def load_session_meta(folder):
+    """meta.json папки сессии: {имя файла: запись}"""
+    try:
+        with open(os.path.join(folder, 'meta.json'), 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {os.path.basename(entry.get('saved_path', '')): entry for entry in entries if isinstance(entry, dict)}
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Столбцовое хранение пачек записей рядом с JSON-выгрузками.
+
+export_to_json кроме exports/export_*.json пишет ту же пачку по столбцам в
+exports/.columnar/<имя выгрузки>.parquet (если установлен pyarrow) или
+.npz (NumPy): значения столбца — один буфер UTF-8 через \\0, наличие
+поля — булева маска. Столбец, все значения которого строки, хранится как
+есть, остальные — JSON-кодом значения. Суточная агрегация читает из пачек
+только нужные столбцы (number_ip, date, creditor), дубли и разбивку по
+кредиторам считает по массивам, а полные записи собирает лишь для
+итоговых файлов. Выгрузки без пачки (старые) читаются из JSON.
+NumPy и pandas загружаются только при работе с пачками.
+"""
+
+import os
+import json
+import uuid
+from .state_manager import log_event, log_error
+
+COLUMNAR_SUBDIR = ".columnar"
+FORMAT_VERSION = 1
+STR, JSON = 'str', 'json'
+ABSENT = object()   # поля нет в записи
+
+
+def has_pyarrow():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def batch_dir(export_path):
+    return os.path.join(os.path.dirname(export_path), COLUMNAR_SUBDIR)
+
+def find_batch(export_path):
+    """Путь пачки выгрузки (.parquet или .npz) или None"""
+    stem = os.path.splitext(os.path.basename(export_path))[0]
+    for ext in ('.parquet', '.npz'):
+        path = os.path.join(batch_dir(export_path), stem + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _columns(records):
+    """{имя: [значение или ABSENT]} в порядке первого появления ключа, {имя: тип}"""
+    columns, kinds = {}, {}
+    for row, record in enumerate(records):
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [ABSENT] * row
+                kinds[key] = STR
+            column.append(value)
+            if kinds[key] is STR and (type(value) is not str or '\0' in value):
+                kinds[key] = JSON
+        for key, column in columns.items():
+            if len(column) <= row:
+                column.append(ABSENT)
+    return columns, kinds
+
+def _encode(value, kind):
+    if value is ABSENT:
+        return None
+    return value if kind == STR else json.dumps(value, ensure_ascii=False)
+
+def _decode(values, kind):
+    if kind == STR:
+        return values
+    return [value if value is ABSENT else json.loads(value) for value in values]
+
+
+def write_batch(records, export_path):
+    """Пишет записи выгрузки пачкой по столбцам; путь пачки"""
+    columns, kinds = _columns(records)
+    directory = batch_dir(export_path)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(export_path))[0]
+    meta = {'version': FORMAT_VERSION, 'names': list(columns), 'kinds': kinds, 'length': len(records)}
+
+    if has_pyarrow():
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = os.path.join(directory, stem + '.parquet')
+        table = pa.table({name: pa.array([_encode(v, kinds[name]) for v in column], type=pa.string())
+                          for name, column in columns.items()},
+                         metadata={b'ip_processor': json.dumps(meta, ensure_ascii=False).encode('utf-8')})
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        pq.write_table(table, tmp_path)
+    else:
+        import numpy as np
+        path = os.path.join(directory, stem + '.npz')
+        arrays = {'meta': np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)}
+        for i, (name, column) in enumerate(columns.items()):
+            encoded = [_encode(v, kinds[name]) for v in column]
+            # Значения через \0 — при чтении один decode и split вместо среза на строку
+            arrays[f'd{i}'] = np.frombuffer('\0'.join('' if v is None else v for v in encoded).encode('utf-8'),
+                                            dtype=np.uint8)
+            arrays[f'm{i}'] = np.fromiter((v is not None for v in encoded), dtype=bool, count=len(encoded))
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+class BatchReader:
+    """Пачка на диске: столбцы читаются по одному и по требованию"""
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            self._file = pq.ParquetFile(path)
+            meta = json.loads(self._file.schema_arrow.metadata[b'ip_processor'])
+        else:
+            import numpy as np
+            self._file = np.load(path)
+            meta = json.loads(self._file['meta'].tobytes())
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия пачки: {meta.get('version')}")
+        self.names, self.kinds, self.length = meta['names'], meta['kinds'], meta['length']
+
+    def column(self, name):
+        """Значения столбца по строкам; ABSENT — поля в записи нет"""
+        if name not in self.kinds:
+            return [ABSENT] * self.length
+        if self.path.endswith('.parquet'):
+            values = [ABSENT if v is None else v
+                      for v in self._file.read(columns=[name]).column(name).to_pylist()]
+        else:
+            import numpy as np
+            i = self.names.index(name)
+            values = self._file[f'd{i}'].tobytes().decode('utf-8').split('\0') if self.length else []
+            mask = self._file[f'm{i}']
+            if not mask.all():
+                for j in np.flatnonzero(~mask).tolist():
+                    values[j] = ABSENT
+        return _decode(values, self.kinds[name])
+
+    def records(self, rows=None):
+        """Полные записи (только строки rows, если заданы)"""
+        rows = range(self.length) if rows is None else rows
+        if not self.names:
+            return [{} for _ in rows]
+        columns = [self.column(name) for name in self.names]
+        if len(rows) != self.length:
+            columns = [[values[row] for row in rows] for values in columns]
+        if not any(ABSENT in values for values in columns):
+            return [dict(zip(self.names, row)) for row in zip(*columns)]
+        return [{name: value for name, value in zip(self.names, row) if value is not ABSENT}
+                for row in zip(*columns)]
+
+    def close(self):
+        if not self.path.endswith('.parquet'):
+            self._file.close()
+
+
+class JsonBatch:
+    """Выгрузка без пачки: записи из JSON с тем же интерфейсом, что у BatchReader"""
+
+    def __init__(self, items):
+        self.items = items
+        self.length = len(items)
+
+    def column(self, name):
+        return [item.get(name, ABSENT) for item in self.items]
+
+    def records(self, rows=None):
+        return self.items if rows is None else [self.items[row] for row in rows]
+
+    def close(self):
+        pass
+
+
+def open_export(export_path):
+    """Пачка выгрузки: столбцовая, если есть, иначе JSON"""
+    path = find_batch(export_path)
+    if path is not None:
+        try:
+            return BatchReader(path)
+        except Exception as ex:
+            log_error(stage="aggregate", file=path, error_msg=f"Пачка не прочитана, берём JSON: {ex}")
+    with open(export_path, encoding='utf-8') as f:
+        return JsonBatch(json.load(f))
+
+
+def key_array(values):
+    """Столбец-ключ: объектный массив, отсутствующее поле — None"""
+    import numpy as np
+    array = np.empty(len(values), dtype=object)
+    array[:] = [None if v is ABSENT else v for v in values]
+    return array
+
+def first_occurrences(*keys):
+    """Маска первых вхождений составного ключа (векторно, через коды factorize)"""
+    import numpy as np
+    import pandas as pd
+    if not len(keys[0]):
+        return np.zeros(0, dtype=bool)
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        codes, uniques = pd.factorize(key, use_na_sentinel=True)
+        combined = combined * (len(uniques) + 1) + (codes + 1)
+    _, first = np.unique(combined, return_index=True)
+    mask = np.zeros(len(combined), dtype=bool)
+    mask[first] = True
+    return mask
+
+def safe_write_batch(records, export_path):
+    """write_batch без падения выгрузки: агрегация при ошибке прочитает JSON"""
+    try:
+        path = write_batch(records, export_path)
+    except Exception as ex:
+        log_error(stage="exporter", file=export_path, error_msg=f"Пачка не записана: {ex}")
+        return None
+    log_event(stage="exporter", status="ok", file=path, count=len(records), format=os.path.splitext(path)[1][1:])
+    return path
@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
 """
 Загрузка конфигов и справочников системы.
+
+Все файлы config/ читаются через load_config_file: разобранное значение
+хранится в памяти процесса и в снимке на диске (SNAPSHOT_PATH) вместе с
+mtime, размером и sha256 файла. Пока mtime и размер не менялись, файл не
+открывается вовсе (кроме только что изменённых); если изменились, но
+содержимое то же — не разбирается.
+CSV-справочники загружаются списками словарей (строка файла -> dict).
+В том же снимке хранятся оценки шаблонов regex_guard: каждый шаблон
+оценивается (и предупреждает о медленном) один раз, а не в каждом запуске.
+Значения общие для всех вызывающих — изменять их нельзя.
 """
 
+import io
 import os
-import pandas as pd
-import yaml
+import re
+import csv
 import json
+import time
+import pickle
+import hashlib
 import logging
+import threading
+from .regex_guard import guard, known_profiles, restore_profiles
 
 CONFIG_LIST_CSV = [
     'formats.csv',
@@ -23,53 +39,170 @@ CONFIG_LIST_YAML = [
     'enrichment_fields.yaml',
     'validators.yaml',
     'ftp_settings.yaml',
-    'mail_settings.yaml'
+    'mail_settings.yaml',
+    'mail_filters.yaml',
+    'ocr_settings.yaml',
+    'document_types.yaml',
+    'ai_settings.yaml',
+    'cluster_settings.yaml',
+    'telegram_settings.yaml',
+    'scheduler_settings.yaml',
+    'retry_settings.yaml',
+    'delta_settings.yaml',
+    'share_cache_settings.yaml'
 ]
 
 CONFIG_LIST_JSON = [
     'paths.json'
 ]
 
-def load_configs(config_dir='config'):
-    """Загружает все конфигурационные файлы"""
-    configs = {}
-    
-    # Загрузка CSV-справочников
-    for fname in CONFIG_LIST_CSV:
-        path = os.path.join(config_dir, fname)
-        if os.path.exists(path):
-            try:
-                configs[fname] = pd.read_csv(path, encoding='utf-8')
-            except Exception as ex:
-                logging.error(f'Ошибка чтения {fname}: {ex}')
-                configs[fname] = None
-        else:
-            configs[fname] = None
+SNAPSHOT_PATH = 'data/config_cache/snapshot.pickle'
+# Меняется при изменении формата снимка, разбора файлов или оценки шаблонов
+SNAPSHOT_VERSION = 2
+# Файлам моложе этого окна stat не доверяем: правка в тот же тик mtime
+# с тем же размером иначе осталась бы незамеченной — сверяем sha256
+RACY_WINDOW_NS = 2 * 10**9
 
-    # Загрузка YAML-конфигов
-    for fname in CONFIG_LIST_YAML:
-        path = os.path.join(config_dir, fname)
-        if os.path.exists(path):
-            try:
-                with open(path, encoding='utf-8') as f:
-                    configs[fname] = yaml.safe_load(f)
-            except Exception as ex:
-                logging.error(f'Ошибка чтения {fname}: {ex}')
-                configs[fname] = None
+_LOCK = threading.RLock()
+_FILES = {}  # абсолютный путь -> {'mtime', 'size', 'sha256', 'value'}
+_STATE = {'snapshot_loaded': False, 'dirty': False}
+_PATTERNS = {}
+_EMPTY = {}
+
+def _parse(path, data):
+    """Разбор содержимого файла по расширению"""
+    text = data.decode('utf-8-sig')
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        return [dict(row) for row in csv.DictReader(io.StringIO(text, newline=''))]
+    if ext == '.json':
+        return json.loads(text)
+    import yaml
+    return yaml.safe_load(text)
+
+def _load_snapshot(snapshot_path):
+    """Подхватывает снимок с диска один раз за процесс"""
+    if _STATE['snapshot_loaded']:
+        return
+    _STATE['snapshot_loaded'] = True
+    if not os.path.exists(snapshot_path):
+        return
+    try:
+        with open(snapshot_path, 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot.get('version') == SNAPSHOT_VERSION:
+            for key, entry in snapshot.get('files', {}).items():
+                _FILES.setdefault(key, entry)
+            restore_profiles(snapshot.get('regex_profiles'))
+    except Exception as ex:
+        logging.warning(f'Снимок конфигов {snapshot_path} не прочитан: {ex}')
+
+def save_snapshot(snapshot_path=SNAPSHOT_PATH):
+    """Сохраняет снимок на диск, если с прошлого сохранения что-то изменилось"""
+    with _LOCK:
+        if not _STATE['dirty']:
+            return False
+        try:
+            os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+            tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': SNAPSHOT_VERSION, 'files': _FILES, 'regex_profiles': known_profiles()}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+            _STATE['dirty'] = False
+            return True
+        except Exception as ex:
+            logging.warning(f'Снимок конфигов {snapshot_path} не сохранён: {ex}')
+            return False
+
+def load_config_file(path, snapshot_path=SNAPSHOT_PATH):
+    """
+    Разобранное содержимое конфига (CSV -> список словарей, YAML, JSON).
+    Ошибки чтения и разбора пробрасываются вызывающему.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    with _LOCK:
+        _load_snapshot(snapshot_path)
+        entry = _FILES.get(key)
+        if entry and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size \
+                and time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+            return entry['value']
+
+        with open(key, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry['sha256'] == digest:
+            value = entry['value']
+            if entry['mtime'] == st.st_mtime_ns:
+                return value
         else:
-            configs[fname] = None
+            value = _parse(key, data)
+        _FILES[key] = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha256': digest, 'value': value}
+        _STATE['dirty'] = True
+        return value
+
+def _compile(pattern, flags, source, guarded=False):
+    """guarded — шаблон для текста документов: поиск с окнами и бюджетом (regex_guard)"""
+    try:
+        compiled = re.compile(pattern, flags)
+    except (re.error, TypeError) as ex:
+        logging.error(f'Некорректное регулярное выражение {source}: {ex}')
+        return None
+    return guard(compiled, source) if guarded else compiled
+
+def compile_patterns(configs):
+    """
+    Скомпилированные регулярные выражения конфигов:
+    {'validators': {поле: GuardedPattern}, 'enrichment_fields': {поле: GuardedPattern},
+     'mail_filters': [Pattern | None по порядку фильтров]}.
+    Маски, которые ищутся в тексте документов, обёрнуты regex_guard.
+    Компилируются заново только при смене исходных значений.
+    """
+    validators = configs.get('validators.yaml') or _EMPTY
+    enrichment = (configs.get('enrichment_fields.yaml') or _EMPTY).get('enrichment_fields') or _EMPTY
+    filters = (configs.get('mail_filters.yaml') or _EMPTY).get('filters') or ()
+    key = (id(validators), id(enrichment), id(filters))
+    with _LOCK:
+        if _PATTERNS.get('key') == key:
+            return _PATTERNS['patterns']
+
+        profiled = len(known_profiles())
+        patterns = {'validators': {}, 'enrichment_fields': {}, 'mail_filters': []}
+        for field, rule in validators.items():
+            if isinstance(rule, dict) and rule.get('regex'):
+                compiled = _compile(rule['regex'], 0, f'validators.yaml:{field}', guarded=True)
+                if compiled is not None:
+                    patterns['validators'][field] = compiled
+        for field, pattern in enrichment.items():
+            compiled = _compile(pattern, 0, f'enrichment_fields.yaml:{field}', guarded=True)
+            if compiled is not None:
+                patterns['enrichment_fields'][field] = compiled
+        for i, mail_filter in enumerate(filters):
+            patterns['mail_filters'].append(
+                _compile(mail_filter.get('subject_regexp', ''), re.IGNORECASE, f'mail_filters.yaml:{i}'))
+
+        if len(known_profiles()) != profiled:
+            _STATE['dirty'] = True
+        # Источники держим в кэше, чтобы их id не переиспользовались
+        _PATTERNS.update(key=key, patterns=patterns, sources=(validators, enrichment, filters))
+        return patterns
+
+def load_configs(config_dir='config', snapshot_path=SNAPSHOT_PATH):
+    """Загружает все конфигурационные файлы"""
+    configs = {}
 
-    # Загрузка JSON-конфигов
-    for fname in CONFIG_LIST_JSON:
+    for fname in CONFIG_LIST_CSV + CONFIG_LIST_YAML + CONFIG_LIST_JSON:
         path = os.path.join(config_dir, fname)
         if os.path.exists(path):
             try:
-                with open(path, encoding='utf-8') as f:
-                    configs[fname] = json.load(f)
+                configs[fname] = load_config_file(path, snapshot_path)
             except Exception as ex:
                 logging.error(f'Ошибка чтения {fname}: {ex}')
                 configs[fname] = None
         else:
             configs[fname] = None
 
-    return configs 
\ No newline at end of file
+    configs['patterns'] = compile_patterns(configs)
+    save_snapshot(snapshot_path)
+    return configs
@@ -1,9 +1,298 @@
 # -*- coding: utf-8 -*-
 """
 Модуль обогащения данных (OCR/AI).
+
+enrich_data дополняет распарсенные записи OCR-текстом сканов.
+enrich_excels дописывает пустые ячейки стандартизированных Excel-реестров
+значениями из документов папки договора (enrichment_fields.yaml). Поля, не
+найденные в документах папки, запоминаются в ENRICHMENT_STATE_PATH вместе
+с размером и mtime документов: пока документы и маска поля те же, папка
+за этим полем повторно не читается (и сканы повторно не растрируются).
 """
 
-def enrich_data(parsed_results, configs):
-    """Обогащение данных из распарсенных результатов"""
-    # Заглушка - возвращает данные без изменений
-    return parsed_results 
\ No newline at end of file
+import os
+import json
+import uuid
+from .state_manager import log_event, log_error, log_not_processed
+from .parser import extract_fields_from_text, iter_pdf_pages, iter_docx_blocks, get_document_type, PARSER_FIELDS
+from .ocr_engine import load_ocr_settings, ocr_files, IMAGE_EXTS
+from .excel_processor import save_formatted_excel
+from .config import compile_patterns
+from .records import ParsedRecord, EXCERPT_FIELD, EXCERPT_CHARS, make_excerpt
+from .share_cache import local_path
+
+ENRICHMENT_SOURCE_EXTS = ('pdf', 'txt', 'docx') + IMAGE_EXTS
+ENRICHMENT_STATE_PATH = 'data/enrichment_state.json'
+
+def enrich_data(parsed_results, configs, retry_queue=None):
+    """
+    Обогащение данных из распарсенных результатов.
+    С retry_queue временные сбои OCR повторяются в следующем цикле.
+    """
+    pending = [doc for doc in parsed_results if doc.get('ocr_required')]
+    if not pending:
+        return parsed_results
+
+    # Все сканы за запуск распознаются одним пулом — параллелизм по страницам
+    settings = load_ocr_settings(configs)
+    texts, errors = ocr_files([(doc['file'], doc['ext'], doc.get('ocr_pages')) for doc in pending], settings)
+
+    enriched = []
+    for doc in parsed_results:
+        if not doc.get('ocr_required'):
+            enriched.append(doc)
+            continue
+        file_path = doc['file']
+        if file_path in errors:
+            log_error(stage="data_enrichment", status="error", file=file_path, error_msg=errors[file_path])
+        text = texts.get(file_path, "")
+        # Поля, найденные парсером в текстовом слое, OCR не перезаписывает
+        doc_data = ParsedRecord({field: doc.get(field, "") for field in PARSER_FIELDS})
+        if not text.strip():
+            if not any(doc_data.values()):
+                if retry_queue is not None and file_path in errors:
+                    retry_queue.record_failure({'file': file_path, 'creditor': doc['creditor'], 'ext': doc['ext']},
+                                               errors[file_path], stage="data_enrichment")
+                else:
+                    log_not_processed(file_path, errors.get(file_path, "OCR не распознал текст"))
+                continue
+        else:
+            for field, value in extract_fields_from_text(text, configs).items():
+                if value and not doc_data.get(field):
+                    doc_data[field] = value
+        if not all(doc_data.get(field) for field in PARSER_FIELDS):
+            # Для AI: текстовый слой, прочитанный парсером, и распознанные страницы
+            excerpt = make_excerpt(doc.get(EXCERPT_FIELD, ""), text[:EXCERPT_CHARS])
+            if excerpt:
+                doc_data[EXCERPT_FIELD] = excerpt
+        doc_data['file'] = file_path
+        doc_data['creditor'] = doc['creditor']
+        log_event(stage="data_enrichment", status="ok", file=file_path, creditor=doc['creditor'], result="ocr")
+        if retry_queue is not None:
+            retry_queue.record_success(file_path)
+        enriched.append(doc_data)
+
+    if retry_queue is not None:
+        retry_queue.save()
+    return enriched
+
+def load_enrichment_patterns(configs):
+    """
+    Скомпилированные маски enrichment_fields.yaml: {столбец Excel: regex}.
+    Имя поля переводится в столбец через enrichment_columns (если задан).
+    """
+    cfg = configs.get('enrichment_fields.yaml') or {}
+    columns = cfg.get('enrichment_columns') or {}
+    compiled = (configs.get('patterns') or compile_patterns(configs))['enrichment_fields']
+    patterns = {}
+    for field in (cfg.get('enrichment_fields') or {}):
+        if field in compiled:
+            patterns[columns.get(field, field)] = compiled[field]
+        else:
+            log_error(stage="data_enrichment", field=field, error_msg="Некорректная маска")
+    return patterns
+
+def _search_fields(text, patterns, values, source, found_in):
+    """Ищет в тексте ещё не найденные поля; первое совпадение выигрывает"""
+    for column, regex in patterns.items():
+        if column in values:
+            continue
+        match = regex.search(text)
+        if not match:
+            continue
+        value = (match.group(1) if regex.groups else match.group(0)).strip()
+        if value:
+            values[column] = value
+            found_in[column] = source
+
+def extract_folder_values(folder_path, patterns, configs, settings):
+    """
+    Значения полей из документов папки договора, каждый документ читается один раз.
+    Сначала текст DOCX, txt и текстовые слои PDF; OCR сканов и страниц без текста —
+    только если после этого остались ненайденные поля.
+    Возвращает ({столбец: значение}, {столбец: файл-источник}).
+    """
+    values, found_in = {}, {}
+    ocr_candidates = []
+    for fname in sorted(os.listdir(folder_path)):
+        ext = os.path.splitext(fname)[-1][1:].lower()
+        path = os.path.join(folder_path, fname)
+        if ext not in ENRICHMENT_SOURCE_EXTS or not os.path.isfile(path):
+            continue
+        try:
+            if ext == 'txt':
+                with open(local_path(path), 'r', encoding='utf-8') as f:
+                    _search_fields(f.read(), patterns, values, fname, found_in)
+            elif ext == 'docx':
+                for block in iter_docx_blocks(path):
+                    _search_fields(block, patterns, values, fname, found_in)
+                    if len(values) == len(patterns):
+                        break
+            elif ext == 'pdf':
+                image_pages = []
+                max_pages = get_document_type(path, configs).get('max_pages')
+                for index, text, has_text_layer in iter_pdf_pages(path, max_pages):
+                    if has_text_layer:
+                        _search_fields(text, patterns, values, fname, found_in)
+                    else:
+                        image_pages.append(index)
+                if image_pages:
+                    ocr_candidates.append((path, ext, image_pages))
+            else:
+                ocr_candidates.append((path, ext))
+        except Exception as ex:
+            log_error(stage="data_enrichment", file=path, error_msg=str(ex))
+        if len(values) == len(patterns):
+            return values, found_in
+
+    if ocr_candidates and len(values) < len(patterns):
+        texts, errors = ocr_files(ocr_candidates, settings)
+        for path, error in errors.items():
+            log_error(stage="data_enrichment", file=path, error_msg=error)
+        for candidate in ocr_candidates:
+            text = texts.get(candidate[0])
+            if text:
+                _search_fields(text, patterns, values, os.path.basename(candidate[0]), found_in)
+    return values, found_in
+
+def source_fingerprint(folder_path):
+    """Документы папки, из которых берутся значения: [[имя, размер, mtime], ...]"""
+    fingerprint = []
+    for entry in os.scandir(folder_path):
+        ext = os.path.splitext(entry.name)[-1][1:].lower()
+        if ext in ENRICHMENT_SOURCE_EXTS and entry.is_file():
+            st = entry.stat()
+            fingerprint.append([entry.name, st.st_size, st.st_mtime_ns])
+    return sorted(fingerprint)
+
+
+class EnrichmentState:
+    """Ненайденные поля папок: {папка: {'sources': отпечаток документов, 'not_found': {столбец: маска}}}"""
+
+    def __init__(self, path=ENRICHMENT_STATE_PATH):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.folders = json.load(f)
+        except (OSError, ValueError):
+            self.folders = {}
+        self.dirty = False
+
+    def searched(self, folder_path, fingerprint, patterns):
+        """Столбцы, которые уже искали в неизменённых документах той же маской и не нашли"""
+        entry = self.folders.get(os.path.abspath(folder_path))
+        if not entry or entry['sources'] != fingerprint:
+            return set()
+        return {col for col, pattern in entry['not_found'].items()
+                if col in patterns and patterns[col].pattern == pattern}
+
+    def record(self, folder_path, fingerprint, patterns, not_found):
+        key = os.path.abspath(folder_path)
+        entry = self.folders.get(key)
+        if not entry or entry['sources'] != fingerprint:
+            entry = self.folders[key] = {'sources': fingerprint, 'not_found': {}}
+        entry['not_found'].update({col: patterns[col].pattern for col in not_found})
+        self.dirty = True
+
+    def save(self):
+        # Папки, которых больше нет, забываются
+        for key in [key for key in self.folders if not os.path.isdir(key)]:
+            del self.folders[key]
+            self.dirty = True
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.folders, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+def enrich_contract_folder(folder_path, configs, patterns=None, settings=None, state=None):
+    """
+    Дополняет пустые ячейки Excel договора значениями из документов папки.
+    Все найденные значения пишутся одной векторной операцией над DataFrame.
+    С state поля, уже не найденные в тех же документах, не ищутся повторно.
+    Возвращает {столбец: (пустых ячеек, заполнено)} или None, если Excel нет.
+    """
+    import pandas as pd
+
+    contract_number = os.path.basename(folder_path)
+    excel_path = os.path.join(folder_path, f"{contract_number}.xlsx")
+    if not os.path.exists(excel_path):
+        return None
+    if patterns is None:
+        patterns = load_enrichment_patterns(configs)
+    if settings is None:
+        settings = load_ocr_settings(configs)
+
+    df = pd.read_excel(excel_path, dtype=object)
+    columns = [col for col in patterns if col in df.columns]
+    if not columns:
+        return {}
+    empty = df[columns].isna() | (df[columns].astype(str).apply(lambda col: col.str.strip()) == "")
+    missing = empty.sum()
+    need = [col for col in columns if missing[col]]
+    fingerprint = source_fingerprint(folder_path) if state is not None and need else None
+    if fingerprint is not None:
+        searched = state.searched(folder_path, fingerprint, patterns)
+        need = [col for col in need if col not in searched]
+    if not need:
+        return {col: (int(missing[col]), 0) for col in columns}
+
+    values, found_in = extract_folder_values(folder_path, {col: patterns[col] for col in need},
+                                             configs, settings)
+    filled = [col for col in need if col in values]
+    if filled:
+        df[filled] = df[filled].astype(object).mask(empty[filled], pd.Series(values)[filled], axis=1)
+        save_formatted_excel(df, excel_path, contract_number)
+        log_event(stage="data_enrichment", contract=contract_number, action="filled",
+                  fields={col: found_in[col] for col in filled})
+
+    not_found = [col for col in need if col not in values]
+    if not_found:
+        log_event(stage="data_enrichment", contract=contract_number, action="not_found", fields=not_found)
+        if fingerprint is not None:
+            state.record(folder_path, fingerprint, patterns, not_found)
+
+    return {col: (int(missing[col]), int(missing[col]) if col in values else 0) for col in columns}
+
+def enrich_excels(input_dir, configs, state_path=ENRICHMENT_STATE_PATH):
+    """
+    Проход дополнения по всем папкам договоров. Логирует и возвращает
+    долю заполненных пустых ячеек по каждому полю: {столбец: (пустых, заполнено)}.
+    Битый или занятый Excel одной папки пропускается, остальные дополняются.
+    Ненайденные поля запоминаются в state_path.
+    """
+    if not os.path.exists(input_dir):
+        log_error(stage="data_enrichment", error_msg=f"Входная папка не найдена: {input_dir}")
+        return {}
+
+    patterns = load_enrichment_patterns(configs)
+    settings = load_ocr_settings(configs)
+    state = EnrichmentState(state_path)
+    totals = {}
+    folders = errors = 0
+    for root, dirs, files in os.walk(input_dir):
+        for dir_name in dirs:
+            folder_path = os.path.join(root, dir_name)
+            try:
+                stats = enrich_contract_folder(folder_path, configs, patterns, settings, state)
+            except Exception as ex:
+                errors += 1
+                log_error(stage="data_enrichment", file=os.path.join(folder_path, f"{dir_name}.xlsx"),
+                          error_msg=f"{type(ex).__name__}: {ex}")
+                continue
+            if stats is None:
+                continue
+            folders += 1
+            for col, (missing, filled) in stats.items():
+                total_missing, total_filled = totals.get(col, (0, 0))
+                totals[col] = (total_missing + missing, total_filled + filled)
+
+    state.save()
+    fill_rates = {col: f"{filled}/{missing} ({filled / missing:.0%})"
+                  for col, (missing, filled) in totals.items() if missing}
+    log_event(stage="data_enrichment", action="fill_rates", folders=folders, errors=errors, fill_rates=fill_rates)
+    return totals
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Разностные выгрузки в 1С.
+
+Для каждого кредитора хранится состояние того, что 1С уже приняла
+(квитанция .ok): хэш содержимого записей по номеру договора. Новая
+суточная выгрузка сравнивается с ним, и на SFTP уходит только разность —
+выгрузка_<дата>_<кредитор>_delta_<время>.json с манифестом и списками added,
+changed (все записи договора целиком) и removed (договоры, пропавшие из
+выгрузки той же даты). Договор, который 1С уже получила в том же виде,
+повторно не отправляется. Запись без номера договора учитывается отдельно
+по хэшу своего содержимого и уходит в added, только пока 1С её не приняла. Состояние обновляется только после квитанции:
+пока разность не принята, следующая считается от того же состояния.
+Полная выгрузка — с --full-export, при enabled: false и для кредитора без
+принятого состояния.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+from datetime import datetime, timedelta
+from .state_manager import log_event
+
+DELTA_SETTINGS_DEFAULT = {
+    'enabled': False,
+    'state_dir': 'data/delta',
+    # Ключ договора — первое непустое: поле записи или folder (папка договора в пути file)
+    'key_fields': ['contract_no', 'contract', 'folder', 'number_ip'],
+    # Договоры, которые не приходили дольше, забываются (и при появлении уйдут как added)
+    'retention_days': 90,
+}
+DELTA_SUFFIX = "_delta"
+FORMAT = "ip_delta/1"
+# Ключ состояния для записи без номера договора: префикс + хэш записи
+UNKEYED_PREFIX = "record:"
+
+
+def load_delta_settings(configs):
+    """Настройки разностных выгрузок из delta_settings.yaml поверх значений по умолчанию"""
+    settings = dict(DELTA_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('delta_settings.yaml') or {})
+    return settings
+
+def record_key(doc, key_fields):
+    """Номер договора записи или None"""
+    for field in key_fields:
+        if field == 'folder':
+            file_path = doc.get('file')
+            value = os.path.basename(os.path.dirname(file_path.replace('\\', '/'))) if file_path else None
+        else:
+            value = doc.get(field)
+        if value not in (None, ''):
+            return str(value)
+    return None
+
+def record_hash(doc):
+    payload = json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def contract_hashes(records, key_fields):
+    """
+    ({договор: хэш всех его записей}, {договор: записи}, ключи записей без договора).
+    Запись без договора — отдельный «договор» с ключом UNKEYED_PREFIX + её хэш.
+    """
+    groups, unkeyed = {}, set()
+    for doc in records:
+        key = record_key(doc, key_fields)
+        if key is None:
+            key = UNKEYED_PREFIX + record_hash(doc)
+            unkeyed.add(key)
+        groups.setdefault(key, []).append(doc)
+    hashes = {key: hashlib.sha256(''.join(sorted(record_hash(d) for d in docs)).encode()).hexdigest()[:32]
+              for key, docs in groups.items()}
+    return hashes, groups, unkeyed
+
+def _write_json(path, data, indent=None):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class DeltaState:
+    """Что 1С приняла от кредитора: {договор: [хэш, дата]} и договоры каждой даты"""
+
+    def __init__(self, state_dir, creditor):
+        self.dir = os.path.join(state_dir, creditor)
+        self.path = os.path.join(self.dir, 'acked.json')
+        data = _read_json(self.path, {})
+        self.contracts = data.get('contracts', {})
+        self.by_date = data.get('by_date', {})
+        self.files = data.get('files', [])
+
+    @property
+    def empty(self):
+        return not self.contracts and not self.by_date
+
+    def pending_path(self, file_name):
+        return os.path.join(self.dir, 'pending', f"{file_name}.json")
+
+    def diff(self, hashes, date_str):
+        """(added, changed, removed) — ключи договоров"""
+        added = sorted(key for key in hashes if key not in self.contracts)
+        changed = sorted(key for key, digest in hashes.items()
+                         if key in self.contracts and self.contracts[key][0] != digest)
+        # Пропавшую запись без договора 1С сопоставить не с чем — в removed её нет
+        removed = sorted(key for key in set(self.by_date.get(date_str, ())) - set(hashes)
+                         if not key.startswith(UNKEYED_PREFIX))
+        return added, changed, removed
+
+    def stale_pending(self, pending):
+        """Файлы pending/, которые заменяет принятая выгрузка: той же или более ранней даты и созданные до неё"""
+        directory = os.path.dirname(self.pending_path(pending['file']))
+        current = self.pending_path(pending['file'])
+        created = os.path.getmtime(current)
+        stale = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path == current or not name.endswith('.json'):
+                continue
+            other = _read_json(path, None)
+            if other is None or (other.get('date', '') <= pending['date'] and os.path.getmtime(path) <= created):
+                stale.append(path)
+        return stale
+
+    def apply(self, pending, retention_days):
+        date_str = pending['date']
+        for key in pending['removed']:
+            self.contracts.pop(key, None)
+        for key, digest in pending['hashes'].items():
+            self.contracts[key] = [digest, date_str]
+        self.by_date[date_str] = sorted(pending['hashes'])
+        self.files = (self.files + [pending['file']])[-20:]
+        if retention_days:
+            cutoff = (datetime.strptime(date_str, '%Y%m%d') - timedelta(days=int(retention_days))).strftime('%Y%m%d')
+            self.contracts = {k: v for k, v in self.contracts.items() if v[1] >= cutoff}
+            self.by_date = {d: keys for d, keys in self.by_date.items() if d >= cutoff}
+
+    def save(self):
+        _write_json(self.path, {'contracts': self.contracts, 'by_date': self.by_date, 'files': self.files})
+
+
+def build_delta(records, creditor, date_str, settings, full=False):
+    """
+    Выгрузка кредитора за дату относительно принятого состояния.
+    Возвращает (содержимое файла, ожидающее квитанции состояние).
+    Полная выгрузка (full или нет состояния) — список записей, как раньше.
+    """
+    state = DeltaState(settings['state_dir'], creditor)
+    hashes, groups, unkeyed = contract_hashes(records, settings['key_fields'])
+    pending = {'date': date_str, 'hashes': hashes, 'removed': []}
+    if full or state.empty:
+        return list(records), dict(pending, mode='full')
+
+    added, changed, removed = state.diff(hashes, date_str)
+    pending['removed'] = removed
+    added_unkeyed = sum(1 for key in added if key in unkeyed)
+    manifest = {
+        'format': FORMAT, 'mode': 'delta', 'creditor': creditor, 'date': date_str,
+        'base': state.files[-1] if state.files else None,
+        'key_fields': settings['key_fields'],
+        'counts': {'added': len(added), 'changed': len(changed), 'removed': len(removed),
+                   'unchanged': len(hashes) - len(added) - len(changed), 'unkeyed': added_unkeyed,
+                   'records_total': len(records)},
+        'created': datetime.now().isoformat(),
+    }
+    content = {
+        'manifest': manifest,
+        'added': [doc for key in added for doc in groups[key]],
+        'changed': [doc for key in changed for doc in groups[key]],
+        'removed': [{'key': key} for key in removed],
+    }
+    return content, dict(pending, mode='delta')
+
+def prepare_deliveries(partitions, creditor_files, date_str, configs, full=False):
+    """
+    Файлы для передачи в 1С по кредиторам: {кредитор: путь}.
+    creditor_files — полные выгрузки save_creditor_aggregates. В разностном режиме
+    вместо них — выгрузка_<дата>_<кредитор>_delta_<время>.json; кредитор без
+    изменений пропускается.
+    """
+    settings = load_delta_settings(configs)
+    full = full or not settings.get('enabled')
+    paths = {}
+    for creditor, records in partitions.items():
+        full_path = creditor_files[creditor]
+        content, pending = build_delta(records, creditor, date_str, settings, full)
+        if pending['mode'] == 'full':
+            out_path = full_path
+        else:
+            counts = content['manifest']['counts']
+            if not (counts['added'] or counts['changed'] or counts['removed']):
+                log_event(stage="delta_export", status="unchanged", creditor=creditor, date=date_str,
+                          records=counts['records_total'])
+                continue
+            # Время в имени: разность каждого цикла — отдельный файл со своей квитанцией
+            out_path = f"{os.path.splitext(full_path)[0]}{DELTA_SUFFIX}_{datetime.now():%H%M%S}.json"
+            _write_json(out_path, content, indent=2)
+            log_event(stage="delta_export", status="ok", file=out_path, creditor=creditor,
+                      full_size=os.path.getsize(full_path), delta_size=os.path.getsize(out_path), **counts)
+        pending['file'] = os.path.basename(out_path)
+        _write_json(DeltaState(settings['state_dir'], creditor).pending_path(pending['file']), pending)
+        paths[creditor] = out_path
+    return paths
+
+def commit_delivery(creditor, file_name, configs=None):
+    """Квитанция 1С получена: принятая выгрузка становится состоянием кредитора"""
+    settings = load_delta_settings(configs)
+    state = DeltaState(settings['state_dir'], creditor)
+    pending_path = state.pending_path(file_name)
+    pending = _read_json(pending_path, None)
+    if pending is None:
+        return False
+    state.apply(pending, settings.get('retention_days'))
+    state.save()
+    # Более ранние выгрузки без квитанции устарели: следующая разность считается от нового состояния
+    stale = state.stale_pending(pending)
+    for path in stale:
+        os.remove(path)
+    os.remove(pending_path)
+    log_event(stage="delta_export", status="acked", creditor=creditor, file=file_name, mode=pending.get('mode'),
+              contracts=len(state.contracts), stale_pending=len(stale))
+    return True
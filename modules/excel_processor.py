@@ -4,23 +4,42 @@
 """
 
 import os
-import pandas as pd
-import openpyxl
 import logging
-import yaml
-from openpyxl.styles import Alignment
+from .config import load_config_file
 from .state_manager import log_event, log_error
 
 def load_yaml_list(filepath, key):
-    """Загрузка эталонов из YAML"""
+    """Загрузка эталонов из YAML (через кэш конфигов)"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
-            return data[key]
+        return load_config_file(filepath)[key]
     except Exception as e:
         logging.error(f"Ошибка загрузки {filepath}: {e}")
         return []
 
+def save_formatted_excel(df, excel_path, contract_number=""):
+    """Сохраняет таблицу в Excel с шириной столбцов по содержимому и переносом строк"""
+    import openpyxl
+    from openpyxl.styles import Alignment
+
+    temp_path = excel_path.replace(".xlsx", "_temp.xlsx")
+    df.to_excel(temp_path, index=False)
+
+    try:
+        wb = openpyxl.load_workbook(temp_path)
+        ws = wb.active
+        for col in ws.columns:
+            max_len = max(len(str(cell.value)) if cell.value else 0 for cell in col)
+            col_letter = col[0].column_letter
+            ws.column_dimensions[col_letter].width = max(10, max_len + 2)
+            for cell in col:
+                cell.alignment = Alignment(wrap_text=True, horizontal="left")
+        # Новый файл вместо записи на месте: excel_path может быть ссылкой на объект хранилища вложений
+        wb.save(temp_path)
+        os.replace(temp_path, excel_path)
+    except Exception as e:
+        log_error(stage="excel_processor", contract=contract_number, 
+                 error_msg=f"Ошибка форматирования: {e}")
+
 def process_contract_folder(folder_path):
     """Обработка папки с договором"""
     contract_number = os.path.basename(folder_path)
@@ -51,6 +70,7 @@ def process_contract_folder(folder_path):
                  action="renamed", new_name=f"{contract_number}.xlsx")
 
     # Чтение структуры
+    import pandas as pd
     try:
         df = pd.read_excel(new_excel_path)
         input_columns_found = list(df.columns)
@@ -100,23 +120,7 @@ def process_contract_folder(folder_path):
     df = df[REQUIRED_FIELDS]
 
     # Сохраняем и форматируем
-    temp_path = new_excel_path.replace(".xlsx", "_temp.xlsx")
-    df.to_excel(temp_path, index=False)
-
-    try:
-        wb = openpyxl.load_workbook(temp_path)
-        ws = wb.active
-        for col in ws.columns:
-            max_len = max(len(str(cell.value)) if cell.value else 0 for cell in col)
-            col_letter = col[0].column_letter
-            ws.column_dimensions[col_letter].width = max(10, max_len + 2)
-            for cell in col:
-                cell.alignment = Alignment(wrap_text=True, horizontal="left")
-        wb.save(new_excel_path)
-        os.remove(temp_path)
-    except Exception as e:
-        log_error(stage="excel_processor", contract=contract_number, 
-                 error_msg=f"Ошибка форматирования: {e}")
+    save_formatted_excel(df, new_excel_path, contract_number)
 
     # Лог финальной структуры
     log_event(stage="excel_processor", contract=contract_number, 
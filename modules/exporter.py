@@ -7,6 +7,8 @@ import os
 import json
 from datetime import datetime
 from .state_manager import log_event
+from .records import as_dict
+from .columnar import safe_write_batch
 
 def export_to_json(ai_results, configs):
     """Экспорт результатов в JSON"""
@@ -23,7 +25,9 @@ def export_to_json(ai_results, configs):
     
     # Сохраняем данные
     with open(export_path, 'w', encoding='utf-8') as f:
-        json.dump(ai_results, f, ensure_ascii=False, indent=2)
+        json.dump(ai_results, f, ensure_ascii=False, indent=2, default=as_dict)
+    # Та же пачка по столбцам — для суточной агрегации без повторного разбора JSON
+    safe_write_batch(ai_results, export_path)
     
     log_event(stage="exporter", status="ok", file=export_path, count=len(ai_results))
     return export_path 
\ No newline at end of file
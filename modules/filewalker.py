@@ -5,20 +5,15 @@
 
 import os
 import json
-import pandas as pd
 from .state_manager import log_event
+from .attachment_store import load_session_meta
 
 def load_creditor_dirs(configs):
     """Загружает список папок для обхода по каждому кредитору"""
     creditor_dirs = []
-    df = configs.get('creditors_to_process.csv')
-    if df is not None:
-        for idx, row in df.iterrows():
-            if str(row.get('status', '')).strip().lower() == 'к обработке':
-                creditor_dirs.append({
-                    'creditor': row['creditor'],
-                    'path': row['link']
-                })
+    for row in configs.get('creditors_to_process.csv') or []:
+        if str(row.get('status') or '').strip().lower() == 'к обработке':
+            creditor_dirs.append({'creditor': row['creditor'], 'path': row['link']})
     return creditor_dirs
 
 def load_processed_files(log_path='logs/process_log.json'):
@@ -42,14 +37,15 @@ def collect_files(configs):
     allowed_exts = set()
     
     # Получаем разрешенные расширения
-    formats_df = configs.get('formats.csv')
-    if formats_df is not None:
-        allowed_exts = set(formats_df['extension'].str.lower())
+    formats = configs.get('formats.csv')
+    if formats is not None:
+        allowed_exts = {str(row['extension']).lower() for row in formats}
     else:
         allowed_exts = {'.xlsx', '.xls', '.pdf', '.docx', '.jpg', '.jpeg', '.png'}
     
     processed_files = load_processed_files()
     creditor_dirs = load_creditor_dirs(configs)
+    copies = {}  # файл -> путь первой копии того же содержимого (meta.json сессии)
 
     # Проходим по всем кредиторам и их папкам
     for cinfo in creditor_dirs:
@@ -61,18 +57,31 @@ def collect_files(configs):
             
         # Рекурсивно ищем файлы нужного формата
         for root, dirs, files in os.walk(base_dir):
+            session_meta = load_session_meta(root) if 'meta.json' in files else {}
             for file in files:
                 ext = os.path.splitext(file)[-1][1:].lower()
                 full_path = os.path.join(root, file)
                 
                 # Фильтруем по формату и по списку уже обработанных
                 if ext in allowed_exts and full_path not in processed_files:
+                    same_as = (session_meta.get(file) or {}).get('same_as')
+                    if same_as:
+                        copies[full_path] = os.path.normpath(same_as)
                     files_for_processing.append({
                         'creditor': creditor,
                         'file': full_path,
                         'ext': ext
                     })
 
+    # Повторно присланные вложения не обрабатываем, если оригинал обработан или в этом же списке
+    duplicates = 0
+    if copies:
+        originals = {os.path.normpath(path) for path in processed_files if path}
+        originals.update(os.path.normpath(f['file']) for f in files_for_processing if f['file'] not in copies)
+        unique = [f for f in files_for_processing if copies.get(f['file']) not in originals]
+        duplicates = len(files_for_processing) - len(unique)
+        files_for_processing = unique
+
     # Логируем результат
-    log_event(stage="filewalker", status="ok", count=len(files_for_processing))
-    return files_for_processing 
\ No newline at end of file
+    log_event(stage="filewalker", status="ok", count=len(files_for_processing), duplicates=duplicates)
+    return files_for_processing
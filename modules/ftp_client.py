@@ -1,26 +1,408 @@
 # -*- coding: utf-8 -*-
 """
 Модуль передачи файлов на FTP/SFTP.
+
+Сессия SFTP открывается один раз на (host, port, user) и переиспользуется
+всеми отправками за запуск. Файл пишется конвейерно во временное имя
+<name>.part, после проверки размера и контрольной суммы атомарно
+переименовывается в итоговое. Прерванная передача продолжается с того
+смещения, до которого дошла предыдущая попытка. Между попытками после
+обрыва связи — пауза retry_delay * 2^(попытка-1), не больше max_retry_delay.
+
+Квитанции 1С (.ok/.err) для всех отправленных файлов ждёт один AckWatcher:
+за опрос он делает по одному listdir на папку, а не на файл, и может
+работать в фоне, пока пайплайн продолжает отправку.
 """
 
 import os
-import yaml
+import time
+import hashlib
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import posixpath
+from .config import load_config_file
 from .state_manager import log_event, log_error
+from .metrics import timed
+
+# Параметры канала SSH по умолчанию (переопределяются в ftp_settings.yaml)
+SFTP_WINDOW_SIZE = 16 * 2**20
+SFTP_MAX_PACKET_SIZE = 2**15
+SFTP_CHUNK_SIZE = 2**15
+SFTP_RETRIES = 3
+SFTP_RETRY_DELAY = 2
+SFTP_MAX_RETRY_DELAY = 60
+SFTP_MAX_WORKERS = 4
+PART_SUFFIX = ".part"
+
+# Опрос квитанций: начинаем часто, без новых квитанций интервал растёт до poll_interval
+ACK_TIMEOUT = 1800
+ACK_POLL_INTERVAL = 10
+ACK_MIN_POLL_INTERVAL = 2
+ACK_BACKOFF = 1.5
+ACK_SESSION_SLOT = "ack"
+
+_SESSIONS = {}
+
+def load_ftp_settings(config_path='config/ftp_settings.yaml'):
+    """Параметры подключения из ftp_settings.yaml (секция ftp)"""
+    return load_config_file(config_path)['ftp']
+
+def get_remote_dir(cfg):
+    """Целевая папка на сервере: base_path/namespace"""
+    return posixpath.join(cfg.get('base_path', '/'), cfg.get('namespace', ''))
+
+def _session_key(cfg, slot):
+    return (cfg['host'], int(cfg.get('port', 22)), cfg['user'], slot)
+
+def get_sftp_session(cfg, slot=0):
+    """Возвращает открытую SFTP-сессию, переподключаясь при обрыве"""
+    import paramiko
+
+    key = _session_key(cfg, slot)
+    session = _SESSIONS.get(key)
+    if session is not None:
+        transport, sftp = session
+        if transport.is_active():
+            return sftp
+        _close_session(key)
+
+    window_size = int(cfg.get('window_size', SFTP_WINDOW_SIZE))
+    max_packet_size = int(cfg.get('max_packet_size', SFTP_MAX_PACKET_SIZE))
+    transport = paramiko.Transport((key[0], key[1]),
+                                   default_window_size=window_size,
+                                   default_max_packet_size=max_packet_size)
+    try:
+        transport.set_keepalive(30)
+        transport.connect(username=cfg['user'], password=cfg.get('password'))
+        sftp = paramiko.SFTPClient.from_transport(transport, window_size=window_size,
+                                                  max_packet_size=max_packet_size)
+    except Exception:
+        transport.close()
+        raise
+    _SESSIONS[key] = (transport, sftp)
+    log_event(stage="ftp_client", status="connected", host=key[0], port=key[1], slot=slot)
+    return sftp
+
+def _close_session(key):
+    transport, sftp = _SESSIONS.pop(key)
+    try:
+        sftp.close()
+    finally:
+        transport.close()
+
+def close_sftp_sessions():
+    """Закрывает все открытые SFTP-сессии (вызывается в конце запуска)"""
+    for key in list(_SESSIONS):
+        try:
+            _close_session(key)
+        except Exception as ex:
+            logging.warning(f"Ошибка закрытия SFTP-сессии {key[0]}: {ex}")
+
+def ensure_remote_dir(sftp, remote_dir):
+    """Создаёт недостающие папки пути на сервере"""
+    current = '/' if remote_dir.startswith('/') else ''
+    for part in [p for p in remote_dir.split('/') if p]:
+        current = posixpath.join(current, part)
+        try:
+            sftp.stat(current)
+        except IOError:
+            sftp.mkdir(current)
+
+def file_digest(path, algorithm='sha256', chunk_size=2**20):
+    """Контрольная сумма локального файла"""
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.digest()
+
+def _remote_size(sftp, path):
+    try:
+        return sftp.stat(path).st_size
+    except IOError:
+        return None
+
+def _upload_from_offset(sftp, local_path, tmp_path, offset, chunk_size):
+    """Дописывает локальный файл в tmp_path начиная с offset (конвейерная запись)"""
+    mode = 'r+b' if offset else 'wb'
+    with open(local_path, 'rb') as src, sftp.open(tmp_path, mode) as dst:
+        dst.set_pipelined(True)
+        if offset:
+            src.seek(offset)
+            dst.seek(offset)
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            dst.write(chunk)
+
+def _verify_checksum(sftp, local_path, tmp_path):
+    """Сверяет sha256 файла на сервере с локальным (чтение обратно с упреждением)"""
+    with sftp.open(tmp_path, 'rb') as f:
+        f.prefetch()
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+    return h.digest() == file_digest(local_path)
+
+def _finalize(sftp, tmp_path, remote_path):
+    """Атомарная замена итогового файла временным"""
+    # Квитанции от прошлой отправки этого файла больше не относятся к нему
+    for suffix in (".ok", ".err"):
+        if _remote_size(sftp, remote_path + suffix) is not None:
+            sftp.remove(remote_path + suffix)
+    try:
+        sftp.posix_rename(tmp_path, remote_path)
+    except IOError:
+        # Сервер без posix-rename: rename не перезаписывает существующий файл
+        if _remote_size(sftp, remote_path) is not None:
+            sftp.remove(remote_path)
+        sftp.rename(tmp_path, remote_path)
+
+def _transfer(sftp, local_path, remote_path, chunk_size):
+    """Одна попытка передачи с докачкой; возвращает смещение, с которого начали"""
+    tmp_path = remote_path + PART_SUFFIX
+    local_size = os.path.getsize(local_path)
+
+    offset = _remote_size(sftp, tmp_path) or 0
+    if offset > local_size:
+        offset = 0
+    if offset < local_size or local_size == 0:
+        _upload_from_offset(sftp, local_path, tmp_path, offset, chunk_size)
+
+    remote_size = _remote_size(sftp, tmp_path)
+    if remote_size != local_size:
+        raise IOError(f"Размер файла на сервере ({remote_size}) не совпадает с локальным ({local_size})")
+
+    if not _verify_checksum(sftp, local_path, tmp_path):
+        if offset:
+            # Докачанный хвост лёг на чужое начало — передаём заново целиком
+            log_event(stage="ftp_client", status="warning", remote_file=remote_path,
+                      message="Контрольная сумма после докачки не совпала, полная передача")
+            _upload_from_offset(sftp, local_path, tmp_path, 0, chunk_size)
+            if _verify_checksum(sftp, local_path, tmp_path):
+                _finalize(sftp, tmp_path, remote_path)
+                return offset
+        raise IOError(f"Контрольная сумма файла на сервере не совпадает: {remote_path}")
 
-def send_file_to_ftp(local_path, config_path='config/ftp_settings.yaml'):
+    _finalize(sftp, tmp_path, remote_path)
+    return offset
+
+def retry_delay(cfg, attempt):
+    """Пауза после неудачной попытки attempt: экспоненциальная, не больше max_retry_delay"""
+    return min(float(cfg.get('max_retry_delay', SFTP_MAX_RETRY_DELAY)),
+               float(cfg.get('retry_delay', SFTP_RETRY_DELAY)) * 2 ** (attempt - 1))
+
+def send_file_to_ftp(local_path, config_path='config/ftp_settings.yaml', slot=0):
     """Передача файла на SFTP"""
     if not os.path.exists(local_path):
         log_error(stage="ftp_client", error_msg=f"Файл не найден: {local_path}")
         raise FileNotFoundError(f"Файл не найден: {local_path}")
-    
-    # Заглушка - возвращает путь к файлу на сервере
-    remote_path = f"/mnt/ssd4tb/ftp_server/ip_loans/{os.path.basename(local_path)}"
-    log_event(stage="ftp_client", status="success", local_file=local_path, remote_file=remote_path)
-    return remote_path
+
+    cfg = load_ftp_settings(config_path)
+    remote_dir = get_remote_dir(cfg)
+    remote_path = posixpath.join(remote_dir, os.path.basename(local_path))
+    chunk_size = int(cfg.get('chunk_size', SFTP_CHUNK_SIZE))
+    retries = int(cfg.get('retries', SFTP_RETRIES))
+    key = _session_key(cfg, slot)
+
+    last_error = None
+    for attempt in range(1, retries + 1):
+        try:
+            sftp = get_sftp_session(cfg, slot)
+            ensure_remote_dir(sftp, remote_dir)
+            offset = _transfer(sftp, local_path, remote_path, chunk_size)
+            log_event(stage="ftp_client", status="success", local_file=local_path,
+                      remote_file=remote_path, size=os.path.getsize(local_path),
+                      resumed_from=offset, attempt=attempt)
+            return remote_path
+        except Exception as ex:
+            last_error = ex
+            session = _SESSIONS.get(key)
+            if session is not None and session[0].is_active():
+                # Соединение живо — ошибка не сетевая, повтор не поможет
+                break
+            # Обрыв связи: сессию пересоздаём, .part на сервере остаётся для докачки
+            if session is not None:
+                _close_session(key)
+            if attempt == retries:
+                break
+            delay = retry_delay(cfg, attempt)
+            log_event(stage="ftp_client", status="retry", local_file=local_path,
+                      attempt=attempt, delay=delay, error=str(ex))
+            # Хост «моргает» — не тратим все попытки за миллисекунды
+            time.sleep(delay)
+
+    log_error(stage="ftp_client", file=local_path, remote_file=remote_path, error_msg=str(last_error))
+    raise last_error
+
+def send_files_to_ftp(local_paths, config_path='config/ftp_settings.yaml', max_workers=None, on_sent=None):
+    """
+    Параллельная передача нескольких файлов, у каждого потока своя SFTP-сессия.
+    on_sent(local_path, remote_path) вызывается сразу после передачи каждого файла.
+    Возвращает {local_path: (remote_path, None) | (None, exception)}.
+    """
+    results = {}
+    if not local_paths:
+        return results
+    if max_workers is None:
+        max_workers = int(load_ftp_settings(config_path).get('max_workers', SFTP_MAX_WORKERS))
+
+    def _send(local_path):
+        with timed("upload"):
+            remote_path = send_file_to_ftp(local_path, config_path, slot=threading.current_thread().name)
+        if on_sent is not None:
+            on_sent(local_path, remote_path)
+        return remote_path
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(local_paths))),
+                            thread_name_prefix="sftp") as pool:
+        futures = {pool.submit(_send, path): path for path in local_paths}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = (future.result(), None)
+            except Exception as ex:
+                results[futures[future]] = (None, ex)
+    return results
+
+class AckWatcher:
+    """
+    Ожидание квитанций 1С сразу для многих выгруженных файлов.
+
+    Каждый файл разрешается независимо: .ok -> ("success", ...),
+    .err -> ("fail", текст ошибки), истёк timeout -> ("timeout", ...),
+    сервер недоступен до истечения timeout -> ("error", ...).
+
+    Синхронно: watcher.add(path); watcher.run()
+    В фоне:    watcher.start(); watcher.add(...); ...; results = watcher.finish()
+    """
+
+    def __init__(self, config_path='config/ftp_settings.yaml', timeout=ACK_TIMEOUT, poll_interval=ACK_POLL_INTERVAL,
+                 min_poll_interval=ACK_MIN_POLL_INTERVAL, on_result=None):
+        self.config_path = config_path
+        self.timeout = timeout
+        self.max_poll_interval = max(poll_interval, min_poll_interval)
+        self.min_poll_interval = min_poll_interval
+        self.on_result = on_result
+        self.results = {}
+        self._cfg = None
+        self._pending = {}
+        self._last_error = None
+        self._interval = min_poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    @property
+    def pending(self):
+        with self._lock:
+            return list(self._pending)
+
+    def add(self, remote_path):
+        """Ставит выгруженный файл в ожидание квитанции"""
+        with self._lock:
+            self._pending[remote_path] = time.monotonic() + self.timeout
+        self._interval = self.min_poll_interval
+        self._wakeup.set()
+
+    def _resolve(self, remote_path, status, info):
+        with self._lock:
+            self._pending.pop(remote_path, None)
+            self.results[remote_path] = (status, info)
+        log_event(stage="ftp_ack", status=status, remote_file=remote_path, ack_info=info)
+        if self.on_result is not None:
+            try:
+                self.on_result(remote_path, status, info)
+            except Exception as ex:
+                logging.error(f"Ошибка обработчика квитанции {remote_path}: {ex}")
+
+    def _read_err(self, sftp, err_path):
+        try:
+            with sftp.open(err_path, 'r') as f:
+                return f.read().decode('utf-8', errors='replace').strip()
+        except Exception:
+            return "Ошибка при чтении файла .err"
+
+    def poll(self):
+        """Один опрос сервера; возвращает число полученных квитанций"""
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+
+        by_dir = {}
+        for remote_path in pending:
+            by_dir.setdefault(posixpath.dirname(remote_path), []).append(remote_path)
+
+        resolved = 0
+        now = time.monotonic()
+        try:
+            if self._cfg is None:
+                self._cfg = load_ftp_settings(self.config_path)
+            sftp = get_sftp_session(self._cfg, ACK_SESSION_SLOT)
+            for dir_name, paths in by_dir.items():
+                names = set(sftp.listdir(dir_name))
+                for remote_path in paths:
+                    file_name = posixpath.basename(remote_path)
+                    if file_name + ".ok" in names:
+                        self._resolve(remote_path, "success", "Файл успешно принят 1С (.ok)")
+                    elif file_name + ".err" in names:
+                        self._resolve(remote_path, "fail", self._read_err(sftp, remote_path + ".err"))
+                    elif now >= pending[remote_path]:
+                        self._resolve(remote_path, "timeout",
+                                      f"Время ожидания ack-файла для {file_name} истекло")
+                    else:
+                        continue
+                    resolved += 1
+            self._last_error = None
+        except Exception as ex:
+            # Сессию пересоздадим на следующем опросе; до таймаута файл остаётся в ожидании
+            self._last_error = str(ex)
+            if self._cfg is not None and _session_key(self._cfg, ACK_SESSION_SLOT) in _SESSIONS:
+                _close_session(_session_key(self._cfg, ACK_SESSION_SLOT))
+            log_event(stage="ftp_ack", status="retry", error=self._last_error)
+            for remote_path, deadline in pending.items():
+                if now >= deadline:
+                    self._resolve(remote_path, "error", self._last_error)
+                    resolved += 1
+        return resolved
+
+    def run(self):
+        """Опрашивает сервер, пока есть ожидающие файлы (а в фоне — до finish())"""
+        while True:
+            if self.poll():
+                self._interval = self.min_poll_interval
+            else:
+                self._interval = min(self._interval * ACK_BACKOFF, self.max_poll_interval)
+            with self._lock:
+                done = not self._pending and (self._thread is None or self._closed)
+                next_deadline = min(self._pending.values(), default=None)
+            if done:
+                return self.results
+            wait = self._interval
+            if next_deadline is not None:
+                wait = max(0, min(wait, next_deadline - time.monotonic()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def start(self):
+        """Запускает опрос в фоновом потоке"""
+        self._thread = threading.Thread(target=self.run, name="ack-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def finish(self):
+        """Больше файлов не будет: дожидается всех квитанций и возвращает результаты"""
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self.run()
+        return dict(self.results)
 
 def wait_for_ack_file(remote_path, config_path='config/ftp_settings.yaml', timeout=1800, poll_interval=10):
     """Ожидание подтверждения от 1С"""
-    # Заглушка - возвращает успешный статус
-    log_event(stage="ftp_ack", status="success", remote_file=remote_path)
-    return "success", "Файл успешно принят 1С (.ok)" 
\ No newline at end of file
+    watcher = AckWatcher(config_path=config_path, timeout=timeout, poll_interval=poll_interval)
+    watcher.add(remote_path)
+    return watcher.run()[remote_path]
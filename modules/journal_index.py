@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Индекс журналов process_log.json / error_log.json для быстрых запросов.
+
+Журнал — JSON по строке на событие, только дописывается. Индекс хранит для
+каждой строки байтовое смещение и время события, а для полей file, contract,
+stage, status и creditor — списки смещений по значению. Обновление
+инкрементальное: разбираются только строки, дописанные после прошлого раза
+(журнал читается через mmap). Если журнал обрезан или заменён — индекс
+строится заново. Запрос пересекает списки смещений и читает через mmap
+только совпавшие строки.
+
+    python -m modules.state_manager query --contract 1001 --stage parser --since 2h
+    python -m modules.state_manager index
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import pickle
+import bisect
+import hashlib
+import argparse
+from array import array
+from datetime import datetime, timedelta
+from .state_manager import LOG_DIR
+
+JOURNALS = {'process': 'process_log.json', 'error': 'error_log.json'}
+INDEX_DIR = os.path.join(LOG_DIR, "index")
+INDEX_VERSION = 1
+# folder — папка файла (для документов на шаре это папка договора)
+INDEXED_FIELDS = ('file', 'folder', 'contract', 'stage', 'status', 'creditor')
+# Поля журнала, из которых берётся номер договора
+CONTRACT_FIELDS = ('contract', 'contract_no')
+HEAD_BYTES = 256
+
+
+def _head_digest(mm, size):
+    return hashlib.sha1(mm[:min(size, HEAD_BYTES)]).hexdigest()
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+def _union(*postings):
+    """Объединение отсортированных списков смещений"""
+    merged = set()
+    for offsets in postings:
+        if offsets:
+            merged.update(offsets)
+    return sorted(merged)
+
+def _contains(sorted_offsets, offset):
+    i = bisect.bisect_left(sorted_offsets, offset)
+    return i < len(sorted_offsets) and sorted_offsets[i] == offset
+
+def _field_values(entry):
+    """(поле индекса, значение) одной записи журнала"""
+    for field in ('file', 'stage', 'status', 'creditor'):
+        value = entry.get(field)
+        if isinstance(value, (str, int)) and value != '':
+            yield field, str(value)
+    file_path = entry.get('file')
+    if isinstance(file_path, str) and file_path:
+        folder = os.path.basename(os.path.dirname(file_path.replace('\\', '/')))
+        if folder:
+            yield 'folder', folder
+    for field in CONTRACT_FIELDS:
+        value = entry.get(field)
+        if isinstance(value, (str, int)) and value != '':
+            yield 'contract', str(value)
+
+
+class JournalIndex:
+    """Индекс одного журнала: смещения строк, время и списки смещений по полям"""
+
+    def __init__(self, journal_path, index_path):
+        self.journal_path = journal_path
+        self.index_path = index_path
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+        self.head = None
+        self.offsets = array('Q')
+        self.times = array('d')
+        self.monotonic = True
+        self.postings = {field: {} for field in INDEXED_FIELDS}
+
+    def load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, AttributeError, ValueError):
+            return self
+        if data.get('version') == INDEX_VERSION and data.get('journal') == os.path.abspath(self.journal_path):
+            self.size, self.head = data['size'], data['head']
+            self.offsets, self.times, self.monotonic = data['offsets'], data['times'], data['monotonic']
+            self.postings = data['postings']
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': INDEX_VERSION, 'journal': os.path.abspath(self.journal_path),
+                         'size': self.size, 'head': self.head, 'offsets': self.offsets, 'times': self.times,
+                         'monotonic': self.monotonic, 'postings': self.postings},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+
+    def update(self):
+        """Индексирует дописанные строки; возвращает число новых строк"""
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            self._reset()
+            return 0
+        if size == 0:
+            if self.size:
+                self._reset()
+            return 0
+        with open(self.journal_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            head = _head_digest(mm, self.size) if self.size else None
+            if size < self.size or head != self.head:
+                # Журнал обрезан или заменён — индекс заново
+                self._reset()
+            added = self._scan(mm, size)
+            self.head = _head_digest(mm, self.size)
+        return added
+
+    def _scan(self, mm, size):
+        position = self.size
+        added = 0
+        last_time = self.times[-1] if self.times else 0.0
+        while position < size:
+            end = mm.find(b'\n', position, size)
+            if end < 0:
+                # Строка ещё дописывается — возьмём в следующий раз
+                break
+            line = mm[position:end]
+            if line.strip():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if isinstance(entry, dict):
+                    timestamp = _parse_time(entry.get('datetime'))
+                    if timestamp < last_time:
+                        self.monotonic = False
+                    last_time = max(last_time, timestamp)
+                    self.offsets.append(position)
+                    self.times.append(timestamp)
+                    for field, value in _field_values(entry):
+                        postings = self.postings[field].get(value)
+                        if postings is None:
+                            postings = self.postings[field][value] = array('Q')
+                        if not postings or postings[-1] != position:
+                            postings.append(position)
+                    added += 1
+            position = end + 1
+        self.size = position
+        return added
+
+    def _time_of(self, offset):
+        return self.times[bisect.bisect_left(self.offsets, offset)]
+
+    def match(self, contract=None, file=None, stage=None, status=None, creditor=None, since=None, until=None):
+        """Смещения строк, подходящих под все условия, по возрастанию"""
+        conditions = []   # по условию — отсортированные смещения
+        if contract:
+            # Договор — поле contract/contract_no или папка файла: .../<договор>/документ.pdf
+            conditions.append(_union(self.postings['contract'].get(str(contract)),
+                                     self.postings['folder'].get(str(contract))))
+        if file:
+            exact = self.postings['file'].get(file)
+            if exact is None:
+                exact = _union(*(offsets for value, offsets in self.postings['file'].items() if file in value))
+            conditions.append(exact)
+        for field, value in (('stage', stage), ('status', status), ('creditor', creditor)):
+            if value:
+                conditions.append(self.postings[field].get(value) or ())
+
+        if not conditions:
+            if not (since or until):
+                return list(self.offsets)
+            if self.monotonic:
+                lo = bisect.bisect_left(self.times, since) if since else 0
+                hi = bisect.bisect_right(self.times, until) if until else len(self.times)
+                return list(self.offsets[lo:hi])
+            conditions.append(self.offsets)
+
+        time_filter = bool(since or until)
+        if time_filter and self.monotonic:
+            # Время растёт вместе со смещением: интервал времени — интервал смещений
+            lo = bisect.bisect_left(self.times, since) if since else 0
+            hi = bisect.bisect_right(self.times, until) if until else len(self.times)
+            if lo >= hi:
+                return []
+            first, last = self.offsets[lo], self.offsets[hi - 1]
+            conditions = [offsets[bisect.bisect_left(offsets, first):bisect.bisect_right(offsets, last)]
+                          for offsets in conditions]
+            time_filter = False
+
+        # Пересечение от самого короткого списка: остальные проверяются бинарным поиском
+        conditions.sort(key=len)
+        result = [offset for offset in conditions[0] if all(_contains(other, offset) for other in conditions[1:])]
+        if time_filter:
+            result = [o for o in result
+                      if (not since or self._time_of(o) >= since) and (not until or self._time_of(o) <= until)]
+        return result
+
+    def read(self, offsets):
+        """Строки журнала по смещениям (через mmap, только нужные)"""
+        if not offsets:
+            return []
+        lines = []
+        with open(self.journal_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in offsets:
+                end = mm.find(b'\n', offset)
+                lines.append(mm[offset:end if end >= 0 else len(mm)].decode('utf-8'))
+        return lines
+
+
+def _load_index(journal, log_dir=LOG_DIR):
+    name = JOURNALS.get(journal, journal)
+    index_dir = INDEX_DIR if log_dir == LOG_DIR else os.path.join(log_dir, "index")
+    return JournalIndex(os.path.join(log_dir, name), os.path.join(index_dir, f"{name}.idx")).load()
+
+def open_index(journal, log_dir=LOG_DIR):
+    """Загруженный и обновлённый индекс журнала ('process' или 'error')"""
+    index = _load_index(journal, log_dir)
+    if index.update():
+        index.save()
+    return index
+
+def update_indexes(log_dir=LOG_DIR):
+    """Дописывает в индексы новые строки всех журналов; {журнал: новых строк}"""
+    added = {}
+    for journal in JOURNALS:
+        index = _load_index(journal, log_dir)
+        added[journal] = index.update()
+        if added[journal]:
+            index.save()
+    return added
+
+def query(journals=('process', 'error'), log_dir=LOG_DIR, limit=None, **conditions):
+    """Записи журналов по условиям, по времени: [(журнал, запись)]"""
+    rows = []
+    for journal in journals:
+        index = open_index(journal, log_dir)
+        offsets = index.match(**conditions)
+        if limit:
+            offsets = offsets[-limit:]
+        rows.extend((index._time_of(offset), journal, line) for offset, line in zip(offsets, index.read(offsets)))
+    rows.sort(key=lambda row: row[0])
+    if limit:
+        rows = rows[-limit:]
+    return [(journal, json.loads(line)) for _, journal, line in rows]
+
+def parse_since(value, now=None):
+    """'2h', '30m', '1d' (назад от now) или дата/время ISO -> timestamp"""
+    if not value:
+        return None
+    match = re.fullmatch(r'(\d+)\s*([smhd])', value.strip())
+    if match:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return ((now or datetime.now()) - timedelta(**{unit: int(match.group(1))})).timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m modules.state_manager',
+                                     description='Запросы к журналам logs/*.json по индексу')
+    commands = parser.add_subparsers(dest='command', required=True)
+    q = commands.add_parser('query', help='Найти события')
+    q.add_argument('--contract', help='Номер договора (поле contract/contract_no или папка в пути файла)')
+    q.add_argument('--file', help='Путь файла (точно или подстрока)')
+    q.add_argument('--stage')
+    q.add_argument('--status')
+    q.add_argument('--creditor')
+    q.add_argument('--since', help="Не раньше: '2h', '30m', '1d' или '2024-01-15 10:00'")
+    q.add_argument('--until', help='Не позже (формат как у --since)')
+    q.add_argument('--journal', choices=['process', 'error', 'all'], default='all')
+    q.add_argument('--limit', type=int, help='Только последние N событий')
+    q.add_argument('--log-dir', default=LOG_DIR)
+    i = commands.add_parser('index', help='Обновить индексы журналов')
+    i.add_argument('--log-dir', default=LOG_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'index':
+        for journal, added in update_indexes(args.log_dir).items():
+            print(f"{JOURNALS[journal]}: +{added} строк")
+        return 0
+
+    journals = tuple(JOURNALS) if args.journal == 'all' else (args.journal,)
+    rows = query(journals, args.log_dir, args.limit, contract=args.contract, file=args.file, stage=args.stage,
+                 status=args.status, creditor=args.creditor,
+                 since=parse_since(args.since), until=parse_since(args.until))
+    for journal, entry in rows:
+        print(json.dumps({'journal': journal, **entry}, ensure_ascii=False))
+    return 0 if rows else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Координация нескольких хостов через общую сетевую папку (без внешних сервисов).
+
+Работа делится на единицы — папки договоров (или кредиторов) на шаре.
+Хост берёт единицу, создав файл аренды (lease) с O_EXCL: создать его может
+только один. Пока единица в работе, фоновый heartbeat продлевает аренду;
+аренда упавшего хоста истекает через lease_ttl и забирается другим хостом
+атомарным переименованием. Обработанные файлы единицы записываются в
+done/<ключ>.json рядом с арендами, чтобы другой хост не взял их повторно.
+
+Время истечения пишется по часам хоста, поэтому часы хостов должны быть
+синхронизированы с точностью до clock_skew секунд.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from .state_manager import log_event, log_error
+
+LEASE_SETTINGS_DEFAULT = {
+    'enabled': False,
+    'lease_dir': 'сеть/asf01/.ip_processor/leases',
+    'worker_id': '',
+    'lease_ttl': 300,
+    # Пусто — треть lease_ttl
+    'heartbeat_interval': None,
+    'clock_skew': 30,
+    # contract — папка договора, creditor — весь кредитор
+    'shard_by': 'contract',
+    # Единиц за запуск на хост; пусто — сколько удастся взять
+    'max_units': None,
+}
+DONE_DIR = 'done'
+
+def load_lease_settings(configs):
+    """Настройки координации из cluster_settings.yaml поверх значений по умолчанию"""
+    settings = dict(LEASE_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('cluster_settings.yaml') or {})
+    return settings
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _key_name(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def _read_json(path):
+    """Содержимое файла аренды; None, если файла нет или он недописан"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class LeaseManager:
+    """Аренды одного хоста: захват, продление heartbeat-ом, освобождение"""
+
+    def __init__(self, lease_dir, worker_id=None, ttl=300, heartbeat_interval=None, clock_skew=30):
+        self.lease_dir = lease_dir
+        self.worker_id = worker_id or default_worker_id()
+        self.ttl = float(ttl)
+        self.heartbeat_interval = float(heartbeat_interval or self.ttl / 3)
+        self.clock_skew = float(clock_skew)
+        self.held = {}    # ключ -> токен аренды
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(lease_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.lease_dir, f"{_key_name(key)}.lease")
+
+    def _content(self, key, token, acquired):
+        now = time.time()
+        return {'key': key, 'owner': self.worker_id, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'token': token, 'acquired': acquired, 'renewed': now, 'expires': now + self.ttl}
+
+    def _expired(self, lease, path):
+        if lease is None:
+            # Недописанный или битый файл: считаем по mtime
+            try:
+                return time.time() - os.path.getmtime(path) > self.ttl + self.clock_skew
+            except OSError:
+                return True
+        return float(lease.get('expires', 0)) + self.clock_skew < time.time()
+
+    def _reclaim(self, path, stale):
+        """Забирает истёкшую аренду: переименовать может только один хост"""
+        tomb = f"{path}.{uuid.uuid4().hex[:8]}.stale"
+        try:
+            os.rename(path, tomb)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        moved = _read_json(tomb)
+        if stale is not None and (moved or {}).get('renewed') != stale.get('renewed'):
+            # Владелец успел продлить аренду между чтением и переименованием — возвращаем
+            try:
+                os.link(tomb, path)
+            except OSError:
+                pass
+            os.unlink(tomb)
+            return False
+        os.unlink(tomb)
+        log_event(stage="leases", status="reclaimed", key=(stale or {}).get('key'),
+                  owner=(stale or {}).get('owner'), worker=self.worker_id)
+        return True
+
+    def acquire(self, key):
+        """Берёт аренду ключа; False, если её держит другой живой хост"""
+        path = self._path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                lease = _read_json(path)
+                if not self._expired(lease, path) or not self._reclaim(path, lease):
+                    return False
+                continue
+            token = uuid.uuid4().hex
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._content(key, token, time.time()), f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self.held[key] = token
+                self.lost.discard(key)
+            return True
+        return False
+
+    def renew(self):
+        """Продлевает все аренды; возвращает ключи, аренду которых забрали"""
+        lost = []
+        with self._lock:
+            held = list(self.held.items())
+        for key, token in held:
+            path = self._path(key)
+            lease = _read_json(path)
+            if lease is None or lease.get('token') != token:
+                lost.append(key)
+                continue
+            try:
+                _write_json_atomic(path, self._content(key, token, lease.get('acquired')))
+            except OSError as ex:
+                log_error(stage="leases", key=key, error_msg=f"Аренда не продлена: {ex}")
+        if lost:
+            with self._lock:
+                for key in lost:
+                    self.held.pop(key, None)
+                    self.lost.add(key)
+            log_error(stage="leases", status="lost", keys=lost, worker=self.worker_id,
+                      error_msg="Аренда истекла и забрана другим хостом")
+        return lost
+
+    def release(self, key):
+        with self._lock:
+            token = self.held.pop(key, None)
+        if token is None:
+            return
+        path = self._path(key)
+        lease = _read_json(path)
+        if lease is not None and lease.get('token') == token:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def release_all(self):
+        for key in list(self.held):
+            self.release(key)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                self.renew()
+            except Exception as ex:
+                log_error(stage="leases", error_msg=f"Ошибка heartbeat: {ex}")
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_interval + 1)
+
+
+def work_unit(file_info, creditor_dirs, shard_by='contract'):
+    """
+    Ключ единицы работы файла: 'кредитор' или 'кредитор/папка договора'.
+    Папка договора — первая под самым глубоким из корней кредитора
+    (Реестры/!ОБЩИЙ ПУЛ ВБ/<договор>/, а не весь пул).
+    """
+    creditor = file_info['creditor']
+    if shard_by == 'creditor':
+        return creditor
+    file_path = os.path.abspath(file_info['file'])
+    bases = [os.path.abspath(base_dir).rstrip(os.sep) + os.sep for base_dir in creditor_dirs.get(creditor, ())]
+    for base in sorted(bases, key=len, reverse=True):
+        if file_path.startswith(base):
+            parts = os.path.relpath(file_path, base).split(os.sep)
+            return f"{creditor}/{parts[0] if len(parts) > 1 else ''}"
+    return f"{creditor}/{os.path.basename(os.path.dirname(file_path))}"
+
+def unit_roots(configs):
+    """Корни папок договоров по кредиторам: ссылки creditors_to_process.csv и пулы из paths.json"""
+    from .filewalker import load_creditor_dirs
+    creditor_dirs = {}
+    for cinfo in load_creditor_dirs(configs):
+        creditor_dirs.setdefault(cinfo['creditor'], []).append(cinfo['path'])
+    for creditor, path in (configs.get('paths.json') or {}).items():
+        creditor_dirs.setdefault(str(creditor), []).append(str(path))
+    return creditor_dirs
+
+
+class ShardCoordinator:
+    """Распределение файлов запуска по единицам работы между хостами"""
+
+    def __init__(self, settings, creditor_dirs, manager=None):
+        self.settings = settings
+        self.creditor_dirs = creditor_dirs
+        self.manager = manager or LeaseManager(
+            settings['lease_dir'], settings.get('worker_id') or None, settings['lease_ttl'],
+            settings.get('heartbeat_interval'), settings['clock_skew'])
+        self.done_dir = os.path.join(settings['lease_dir'], DONE_DIR)
+        self.units = {}   # ключ -> файлы, взятые в работу
+        os.makedirs(self.done_dir, exist_ok=True)
+
+    def _done_path(self, key):
+        return os.path.join(self.done_dir, f"{_key_name(key)}.json")
+
+    def load_done(self, key):
+        return set((_read_json(self._done_path(key)) or {}).get('files') or ())
+
+    def _preference(self, key):
+        # Рандеву-хэширование: у каждого хоста свой порядок единиц, меньше столкновений
+        return hashlib.sha1(f"{self.manager.worker_id}\0{key}".encode('utf-8')).hexdigest()
+
+    def claim(self, files):
+        """Файлы единиц, которые удалось взять в аренду; файлы, уже сделанные другими хостами, отбрасываются"""
+        by_unit = {}
+        for file_info in files:
+            by_unit.setdefault(work_unit(file_info, self.creditor_dirs, self.settings['shard_by']), []).append(file_info)
+
+        max_units = self.settings.get('max_units')
+        claimed, busy, done = [], 0, 0
+        for key in sorted(by_unit, key=self._preference):
+            if max_units and len(self.units) >= int(max_units):
+                break
+            if not self.manager.acquire(key):
+                busy += 1
+                continue
+            # Проверяем уже под арендой: другой хост мог закончить единицу только что
+            finished = self.load_done(key)
+            pending = [f for f in by_unit[key] if f['file'] not in finished]
+            done += len(by_unit[key]) - len(pending)
+            if not pending:
+                self.manager.release(key)
+                continue
+            self.units[key] = pending
+            claimed.extend(pending)
+
+        if self.units:
+            self.manager.start()
+        log_event(stage="leases", status="claimed", worker=self.manager.worker_id, units=len(self.units),
+                  files=len(claimed), busy_units=busy, done_elsewhere=done, total_units=len(by_unit))
+        return claimed
+
+    def acquire(self, key):
+        """Эксклюзивная аренда отдельного этапа (например, разбора почты)"""
+        acquired = self.manager.acquire(key)
+        if acquired:
+            self.manager.start()
+        return acquired
+
+    def release(self, key):
+        self.manager.release(key)
+
+    def complete(self, processed_files):
+        """Записывает обработанные файлы единиц в done/ и освобождает их аренды"""
+        processed = set(processed_files)
+        lost = set(self.manager.renew())
+        for key, unit_files in self.units.items():
+            finished = {f['file'] for f in unit_files if f['file'] in processed}
+            if key in lost:
+                log_error(stage="leases", key=key, error_msg="Единица обработана после потери аренды")
+            if finished:
+                _write_json_atomic(self._done_path(key), {
+                    'key': key, 'files': sorted(self.load_done(key) | finished),
+                    'worker': self.manager.worker_id, 'updated': time.time()})
+            self.manager.release(key)
+        self.units = {}
+
+    def close(self):
+        self.manager.stop()
+        self.manager.release_all()
+
+
+def open_coordinator(configs):
+    """ShardCoordinator, если координация включена в cluster_settings.yaml, иначе None"""
+    settings = load_lease_settings(configs)
+    if not settings.get('enabled'):
+        return None
+    coordinator = ShardCoordinator(settings, unit_roots(configs))
+    log_event(stage="leases", status="start", worker=coordinator.manager.worker_id,
+              lease_dir=settings['lease_dir'], shard_by=settings['shard_by'])
+    return coordinator
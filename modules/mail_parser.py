@@ -11,8 +11,9 @@ import email
 import re
 import json
 import datetime
-import yaml
 from email.header import decode_header
+from .config import load_config_file
+from .attachment_store import AttachmentStore
 
 def decode_str(s):
     """Универсальная функция декодирования строк"""
@@ -31,11 +32,12 @@ def load_mail_settings(configs):
     """Настройки подключения из конфигов"""
     return configs.get('mail_settings.yaml', {})
 
-def load_mail_filters():
-    """Загрузка фильтров из mail_filters.yaml"""
+def load_mail_filters(configs=None):
+    """Загрузка фильтров из mail_filters.yaml (через кэш конфигов)"""
     try:
-        with open('config/mail_filters.yaml', 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)['filters']
+        if configs and configs.get('mail_filters.yaml'):
+            return configs['mail_filters.yaml']['filters']
+        return load_config_file('config/mail_filters.yaml')['filters']
     except Exception as e:
         print(f"Ошибка загрузки mail_filters.yaml: {e}")
         return []
@@ -134,8 +136,13 @@ def test_mail_connection(mail_cfg):
     except Exception as e:
         return False, None
 
-def process_email(msg, creditor_id, creditor_folder, subject):
-    """Обработка письма с созданием правильной структуры по ТЗ"""
+def process_email(msg, creditor_id, creditor_folder, subject, store=None):
+    """
+    Обработка письма с созданием правильной структуры по ТЗ.
+    Вложения хранятся один раз в AttachmentStore, в папке сессии — жёсткие ссылки;
+    повторно присланное вложение помечается в meta.json полем same_as.
+    """
+    store = store or AttachmentStore()
     today = datetime.datetime.now().strftime('%d.%m.%Y')
     base_path = os.path.join("сеть", "asf01", "files", "юристы", creditor_folder, "Реестры")
     os.makedirs(base_path, exist_ok=True)
@@ -155,16 +162,21 @@ def process_email(msg, creditor_id, creditor_folder, subject):
             continue
         
         filepath = os.path.join(session_folder, filename)
-        with open(filepath, 'wb') as f:
-            f.write(part.get_payload(decode=True))
+        stored = store.save_attachment(part.get_payload(decode=True) or b'', filepath,
+                                       session=session_folder, creditor=creditor_id)
         attachments.append({
             "creditor_id": creditor_id,
             "email_subject": subject,
             "email_date": datetime.datetime.now().isoformat(),
             "saved_path": filepath,
-            "original_filename": filename
+            "original_filename": filename,
+            "sha256": stored['sha256'],
+            "same_as": stored['same_as']
         })
-        print(f"💾 Сохранено: {filename}")
+        if stored['same_as']:
+            print(f"♻️ Повтор: {filename} — то же, что {stored['same_as']}")
+        else:
+            print(f"💾 Сохранено: {filename}")
     
     # Сохранение метаданных по ТЗ
     meta_path = os.path.join(session_folder, 'meta.json')
@@ -184,7 +196,12 @@ def process_incoming_mail(configs):
     allowed_exts = set(mail_cfg.get('allowed_extensions', ['.xlsx', '.xls', '.zip', '.rar', '.pdf']))
     
     # Загружаем фильтры по ТЗ
-    mail_filters = load_mail_filters()
+    mail_filters = load_mail_filters(configs)
+    subject_patterns = None
+    if configs.get('mail_filters.yaml'):
+        subject_patterns = (configs.get('patterns') or {}).get('mail_filters')
+    if subject_patterns is None:
+        subject_patterns = [re.compile(f['subject_regexp'], re.IGNORECASE) for f in mail_filters]
     
     # Создаем директорию для сохранения
     os.makedirs(save_dir, exist_ok=True)
@@ -234,8 +251,8 @@ def process_incoming_mail(configs):
     
                 # Новая логика фильтрации по ТЗ
                 creditor_found = False
-                for f in mail_filters:
-                    if (re.search(f['subject_regexp'], subject, re.IGNORECASE) and 
+                for f, subject_re in zip(mail_filters, subject_patterns):
+                    if (subject_re is not None and subject_re.search(subject) and 
                         from_addr == f['from']):
                         
                         creditor_id = f['creditor_id']
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики запуска: длительность этапов, задержки по файлам, RSS и CPU.
+
+stage_timer("parser") замеряет этап (время, CPU процесса и дочерних
+процессов, RSS) и пишет итог в process_log.json. observe("parse", секунды)
+копит гистограмму задержек по файлам. Фоновый ResourceSampler раз в
+interval секунд снимает RSS/CPU и запоминает пики по текущему этапу.
+write_prometheus() сохраняет всё в текстовом формате Prometheus для
+textfile collector node_exporter (запись атомарная: tmp + rename).
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from .state_manager import log_event, LOG_DIR
+from .profiler import profile_stage
+
+PROM_FILE = os.path.join(LOG_DIR, "metrics", "ip_processor.prom")
+METRIC_PREFIX = "ip_processor"
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SAMPLE_INTERVAL = 1.0
+
+_LOCK = threading.Lock()
+_STAGES = {}      # этап -> {'seconds', 'cpu_seconds', 'rss_bytes', 'peak_rss_bytes', 'cpu_percent_max'}
+_HISTOGRAMS = {}  # операция -> Histogram
+_CURRENT = {'stage': None}
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными границами (как в Prometheus)"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Оценка квантиля по границам корзин (верхняя граница корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 3), 'max': round(self.max, 3),
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95)}
+
+
+def rss_bytes():
+    """Текущий RSS процесса (пиковый, если текущий узнать нельзя)"""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        return 0
+
+def cpu_seconds():
+    """CPU процесса и завершённых дочерних процессов (пул OCR), user + system"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def observe(operation, seconds):
+    """Задержка одной операции над файлом: parse, ocr, upload"""
+    with _LOCK:
+        histogram = _HISTOGRAMS.get(operation)
+        if histogram is None:
+            histogram = _HISTOGRAMS[operation] = Histogram()
+        histogram.observe(seconds)
+
+@contextmanager
+def timed(operation):
+    """Контекст для observe: with timed("parse"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(operation, time.perf_counter() - started)
+
+@contextmanager
+def stage_timer(stage, **fields):
+    """
+    Замер этапа: время, CPU, RSS; итог — в process_log.json (status="timing").
+    При main.py --profile этап ещё и профилируется (modules.profiler).
+    """
+    started = time.perf_counter()
+    cpu_started = cpu_seconds()
+    with _LOCK:
+        previous = _CURRENT['stage']
+        _CURRENT['stage'] = stage
+        entry = _STAGES.setdefault(stage, {'seconds': 0.0, 'cpu_seconds': 0.0, 'rss_bytes': 0,
+                                           'peak_rss_bytes': 0, 'cpu_percent_max': 0.0})
+    status = "timing"
+    try:
+        with profile_stage(stage):
+            yield entry
+    except BaseException:
+        status = "timing_failed"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        cpu = cpu_seconds() - cpu_started
+        rss = rss_bytes()
+        with _LOCK:
+            _CURRENT['stage'] = previous
+            entry['seconds'] += seconds
+            entry['cpu_seconds'] += cpu
+            entry['rss_bytes'] = rss
+            entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'], rss)
+        log_event(stage=stage, status=status, seconds=round(seconds, 3), cpu_seconds=round(cpu, 3),
+                  rss_mb=round(rss / 2**20, 1), peak_rss_mb=round(entry['peak_rss_bytes'] / 2**20, 1), **fields)
+
+
+class ResourceSampler:
+    """Фоновый сбор RSS/CPU раз в interval секунд; пики относятся к текущему этапу"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, last_wall, last_cpu):
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        cpu_percent = 100.0 * (cpu - last_cpu) / max(wall - last_wall, 1e-6)
+        rss = rss_bytes()
+        with _LOCK:
+            stage = _CURRENT['stage']
+            if stage is not None:
+                entry = _STAGES[stage]
+                entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'], rss)
+                entry['cpu_percent_max'] = max(entry['cpu_percent_max'], round(cpu_percent, 1))
+        self.samples += 1
+        return wall, cpu
+
+    def _run(self):
+        last = (time.perf_counter(), cpu_seconds())
+        while not self._stop.wait(self.interval):
+            last = self._sample(*last)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+
+def snapshot():
+    """Копия накопленных метрик: {'stages': {...}, 'latency': {операция: summary}}"""
+    with _LOCK:
+        return {
+            'stages': {stage: dict(entry) for stage, entry in _STAGES.items()},
+            'latency': {op: histogram.summary() for op, histogram in _HISTOGRAMS.items()},
+        }
+
+def reset():
+    with _LOCK:
+        _STAGES.clear()
+        _HISTOGRAMS.clear()
+        _CURRENT['stage'] = None
+
+def _format_labels(**labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def render_prometheus(exit_code=None):
+    """Метрики в текстовом формате Prometheus 0.0.4"""
+    p = METRIC_PREFIX
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {p}_{name} {help_text}")
+        lines.append(f"# TYPE {p}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{p}_{name}{labels} {value}")
+
+    with _LOCK:
+        stages = sorted(_STAGES.items())
+        metric("stage_duration_seconds", "gauge", "Длительность этапа в последнем запуске",
+               [(_format_labels(stage=s), round(e['seconds'], 6)) for s, e in stages])
+        metric("stage_cpu_seconds", "gauge", "CPU этапа (процесс и дочерние процессы)",
+               [(_format_labels(stage=s), round(e['cpu_seconds'], 6)) for s, e in stages])
+        metric("stage_rss_bytes", "gauge", "RSS по окончании этапа",
+               [(_format_labels(stage=s), e['rss_bytes']) for s, e in stages])
+        metric("stage_peak_rss_bytes", "gauge", "Пиковый RSS во время этапа",
+               [(_format_labels(stage=s), e['peak_rss_bytes']) for s, e in stages])
+        metric("stage_cpu_percent_max", "gauge", "Максимальная загрузка CPU по выборкам",
+               [(_format_labels(stage=s), e['cpu_percent_max']) for s, e in stages])
+
+        lines.append(f"# HELP {p}_file_latency_seconds Задержка обработки одного файла (страницы для ocr)")
+        lines.append(f"# TYPE {p}_file_latency_seconds histogram")
+        for op, histogram in sorted(_HISTOGRAMS.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{p}_file_latency_seconds_bucket{_format_labels(op=op, le=bound)} {cumulative}")
+            lines.append(f"{p}_file_latency_seconds_bucket{_format_labels(op=op, le='+Inf')} {histogram.count}")
+            lines.append(f"{p}_file_latency_seconds_sum{_format_labels(op=op)} {round(histogram.sum, 6)}")
+            lines.append(f"{p}_file_latency_seconds_count{_format_labels(op=op)} {histogram.count}")
+
+    metric("last_run_timestamp_seconds", "gauge", "Время окончания последнего запуска",
+           [("", round(time.time(), 3))])
+    if exit_code is not None:
+        metric("last_run_exit_code", "gauge", "Код завершения последнего запуска", [("", exit_code)])
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path=PROM_FILE, exit_code=None):
+    """Атомарно записывает .prom-файл для textfile collector"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus(exit_code))
+    os.replace(tmp_path, path)
+    return path
+
+def flush(exit_code=None, path=PROM_FILE):
+    """Итог запуска: сводка в process_log.json и .prom-файл"""
+    summary = snapshot()
+    log_event(stage="metrics", status="ok", exit_code=exit_code,
+              stages={s: {'seconds': round(e['seconds'], 3), 'cpu_seconds': round(e['cpu_seconds'], 3),
+                          'peak_rss_mb': round(e['peak_rss_bytes'] / 2**20, 1)}
+                      for s, e in summary['stages'].items()},
+              latency=summary['latency'])
+    return write_prometheus(path, exit_code)
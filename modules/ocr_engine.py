@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+OCR сканов и PDF без текстового слоя (Tesseract).
+
+Страницы растрируются и распознаются в пуле процессов, каждая страница —
+отдельная задача, поэтому многостраничный скан и пачка мелких сканов
+параллелятся одинаково. Перед распознаванием страница выравнивается
+(deskew) и бинаризуется. Текст кэшируется на диске по sha256 растра
+страницы и настроек предобработки: повторно присланный скан Tesseract
+больше не видит, а смена deskew/binarize распознаёт страницу заново.
+"""
+
+import os
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from .metrics import observe
+from .share_cache import local_path
+
+OCR_SETTINGS_DEFAULT = {
+    'lang': 'rus+eng',
+    'dpi': 300,
+    'workers': None,  # по числу ядер
+    'cache_dir': 'data/ocr_cache',
+    'deskew': True,
+    'binarize': True,
+    'max_skew_angle': 5.0,
+}
+
+IMAGE_EXTS = ('jpg', 'jpeg', 'png')
+OCR_EXTS = ('pdf',) + IMAGE_EXTS
+
+# Меняется при изменении предобработки — старый кэш перестаёт совпадать
+PREPROCESS_VERSION = 1
+
+def load_ocr_settings(configs):
+    """Настройки OCR из ocr_settings.yaml поверх значений по умолчанию"""
+    settings = dict(OCR_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('ocr_settings.yaml') or {})
+    return settings
+
+def count_pages(file_path, ext):
+    """Количество страниц (кадров) документа"""
+    if ext == 'pdf':
+        import pdfplumber
+        with pdfplumber.open(file_path) as pdf:
+            return len(pdf.pages)
+    from PIL import Image
+    with Image.open(file_path) as img:
+        return getattr(img, 'n_frames', 1)
+
+def rasterize_page(file_path, ext, page_index, dpi):
+    """Растр одной страницы PDF или кадра изображения (PIL.Image)"""
+    if ext == 'pdf':
+        import pdfplumber
+        with pdfplumber.open(file_path, pages=[page_index + 1]) as pdf:
+            return pdf.pages[0].to_image(resolution=dpi).original.copy()
+    from PIL import Image
+    with Image.open(file_path) as img:
+        img.seek(page_index)
+        return img.convert('RGB')
+
+def page_hash(img, settings):
+    """sha256 растра страницы (размер, режим и пиксели) и настроек предобработки"""
+    h = hashlib.sha256()
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:{PREPROCESS_VERSION}".encode())
+    # Настройки, от которых зависит текст (lang — в имени файла кэша); 5 и 5.0 — одно и то же
+    h.update(f"{bool(settings.get('deskew'))}:{bool(settings.get('binarize'))}:"
+             f"{float(settings.get('max_skew_angle', 5.0))}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+def _cache_path(cache_dir, digest, lang):
+    return os.path.join(cache_dir, digest[:2], f"{digest}_{lang}.txt")
+
+def cache_get(cache_dir, digest, lang):
+    path = _cache_path(cache_dir, digest, lang)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    return None
+
+def cache_put(cache_dir, digest, lang, text):
+    path = _cache_path(cache_dir, digest, lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Запись через временный файл: параллельные процессы не увидят половину текста
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def otsu_threshold(gray):
+    """Порог бинаризации по Оцу по гистограмме серого изображения"""
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    sum_bg, weight_bg = 0.0, 0
+    best_threshold, best_variance = 127, 0.0
+    for i, h in enumerate(hist):
+        weight_bg += h
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += i * h
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_variance, best_threshold = variance, i
+    return best_threshold
+
+def estimate_skew(binary, max_angle=5.0, step=0.5):
+    """Угол наклона строк: максимум дисперсии горизонтальной проекции"""
+    import numpy as np
+
+    # Оценка по уменьшенной копии: для угла хватает ~1000 пикселей по ширине
+    scale = min(1.0, 1000.0 / max(binary.size))
+    small = binary.resize((max(1, int(binary.size[0] * scale)), max(1, int(binary.size[1] * scale))))
+    best_angle, best_score = 0.0, -1.0
+    steps = int(max_angle / step)
+    for k in range(-steps, steps + 1):
+        angle = k * step
+        rotated = small.rotate(angle, expand=False, fillcolor=255)
+        ink = 255 - np.asarray(rotated, dtype=np.float32)
+        score = float(ink.sum(axis=1).var())
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+def preprocess_image(img, settings):
+    """Серый -> бинаризация по Оцу -> выравнивание наклона"""
+    gray = img.convert('L')
+    threshold = otsu_threshold(gray)
+    binary = gray.point(lambda p: 255 if p > threshold else 0)
+    if settings.get('deskew'):
+        angle = estimate_skew(binary, float(settings.get('max_skew_angle', 5.0)))
+        if angle:
+            binary = binary.rotate(angle, expand=True, fillcolor=255)
+            gray = gray.rotate(angle, expand=True, fillcolor=255)
+    return binary if settings.get('binarize') else gray
+
+def _ocr_page_task(task):
+    """
+    Задача пула: растр -> кэш -> предобработка -> Tesseract.
+    Возвращает (file_path, page_index, text, cached, error, секунды).
+    """
+    file_path, ext, page_index, settings = task
+    started = time.perf_counter()
+    result = _ocr_page(file_path, ext, page_index, settings)
+    return result + (time.perf_counter() - started,)
+
+def _ocr_page(file_path, ext, page_index, settings):
+    try:
+        img = rasterize_page(file_path, ext, page_index, int(settings['dpi']))
+        digest = page_hash(img, settings)
+        lang = settings['lang']
+        cached = cache_get(settings['cache_dir'], digest, lang)
+        if cached is not None:
+            return file_path, page_index, cached, True, None
+
+        import pytesseract
+        text = pytesseract.image_to_string(preprocess_image(img, settings), lang=lang)
+        cache_put(settings['cache_dir'], digest, lang, text)
+        return file_path, page_index, text, False, None
+    except Exception as ex:
+        return file_path, page_index, "", False, f"{type(ex).__name__}: {ex}"
+
+def ocr_pages(pages, settings):
+    """
+    Распознаёт набор страниц [(file_path, ext, page_index), ...] в пуле процессов.
+    Возвращает ({(file_path, page_index): text}, {file_path: error}, cache_hits).
+    """
+    if not pages:
+        return {}, {}, 0
+
+    tasks = [(file_path, ext, page_index, settings) for file_path, ext, page_index in pages]
+    workers = settings.get('workers') or os.cpu_count() or 1
+    workers = max(1, min(int(workers), len(tasks)))
+
+    if workers == 1:
+        return _collect(map(_ocr_page_task, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return _collect(pool.map(_ocr_page_task, tasks, chunksize=1))
+
+def _collect(results):
+    texts, errors, cache_hits = {}, {}, 0
+    for file_path, page_index, text, cached, error, seconds in results:
+        observe("ocr", seconds)
+        texts[(file_path, page_index)] = text
+        cache_hits += cached
+        if error:
+            errors.setdefault(file_path, error)
+    return texts, errors, cache_hits
+
+def ocr_files(files, settings):
+    """
+    OCR для списка файлов с параллелизмом по страницам.
+    Элемент списка: (file_path, ext) — все страницы, или (file_path, ext, [индексы страниц]).
+    Возвращает ({file_path: text}, {file_path: error}).
+    """
+    pages, errors = [], {}
+    sources = {}  # локальная копия (share_cache) -> file_path
+    for file_path, ext, *page_indices in files:
+        try:
+            source = local_path(file_path)
+            sources[source] = file_path
+            indices = page_indices[0] if page_indices and page_indices[0] is not None \
+                else range(count_pages(source, ext))
+            pages.extend((source, ext, i) for i in indices)
+        except Exception as ex:
+            errors[file_path] = f"{type(ex).__name__}: {ex}"
+
+    page_texts, page_errors, cache_hits = ocr_pages(pages, settings)
+    errors.update((sources[source], error) for source, error in page_errors.items())
+
+    texts = {}
+    for (source, page_index) in sorted(page_texts, key=lambda k: (sources[k[0]], k[1])):
+        texts.setdefault(sources[source], []).append(page_texts[(source, page_index)])
+    texts = {file_path: "\n".join(parts) for file_path, parts in texts.items()}
+
+    logging.info(f"OCR: файлов {len(files)}, страниц {len(pages)}, из кэша {cache_hits}")
+    return texts, errors
@@ -5,81 +5,306 @@
 
 import os
 import re
+import time
 from .state_manager import log_event, log_error
+from .ocr_engine import OCR_EXTS
+from .config import compile_patterns
+from .regex_guard import guard
+from .share_cache import local_path, prefetch, prefetch_window
+from .metrics import timed
+from .records import ParsedRecord, EXCERPT_FIELD, EXCERPT_CHARS, make_excerpt
+
+# Страница считается имеющей текстовый слой, если на ней столько непробельных символов
+TEXT_LAYER_MIN_CHARS = 20
+PARSER_FIELDS = ['date', 'number_ip', 'fio']
+DEFAULT_DOCUMENT_TYPE = {'name': 'default', 'required_fields': PARSER_FIELDS, 'max_pages': None}
+
+def iter_pdf_pages(file_path, max_pages=None, min_chars=TEXT_LAYER_MIN_CHARS):
+    """Лениво отдаёт страницы PDF: (индекс, текст, есть ли текстовый слой)"""
+    import pdfplumber
+    with pdfplumber.open(local_path(file_path)) as pdf:
+        for index, page in enumerate(pdf.pages):
+            if max_pages and index >= max_pages:
+                break
+            text = page.extract_text() or ""
+            yield index, text, len("".join(text.split())) >= min_chars
+            # Разобранные объекты страницы больше не нужны
+            page.flush_cache()
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+W_P, W_T, W_TC, W_TAB, W_BR, W_CR = (WORD_NS + tag for tag in ('p', 't', 'tc', 'tab', 'br', 'cr'))
+# Абзацев/ячеек DOCX на один прогон регулярок при извлечении полей
+DOCX_CHUNK_BLOCKS = 50
+
+def iter_docx_blocks(file_path):
+    """
+    Лениво отдаёт текст абзацев и ячеек таблиц DOCX в порядке документа.
+    word/document.xml читается потоково (iterparse) прямо из zip, без объектной
+    модели python-docx; разобранные элементы сразу освобождаются.
+    Ячейка таблицы отдаётся целиком (её абзацы через перевод строки).
+    """
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+
+    with zipfile.ZipFile(local_path(file_path)) as archive, archive.open('word/document.xml') as xml:
+        parts = []        # текст текущего абзаца
+        cells = []        # стек открытых ячеек (вложенные таблицы): списки абзацев
+        parents = []      # стек открытых элементов — чтобы чистить разобранное
+        for event, elem in iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                parents.append(elem)
+                if elem.tag == W_TC:
+                    cells.append([])
+                continue
+            parents.pop()
+            tag = elem.tag
+            if tag == W_T:
+                parts.append(elem.text or '')
+            elif tag == W_TAB:
+                parts.append('\t')
+            elif tag in (W_BR, W_CR):
+                parts.append('\n')
+            elif tag == W_P:
+                text = ''.join(parts)
+                parts = []
+                if cells:
+                    cells[-1].append(text)
+                elif text:
+                    yield text
+            elif tag == W_TC:
+                text = '\n'.join(paragraph for paragraph in cells.pop() if paragraph)
+                if cells:
+                    cells[-1].append(text)
+                elif text:
+                    yield text
+            # Разобранный элемент больше не нужен: дерево не растёт с размером документа
+            if parents:
+                parents[-1].remove(elem)
 
 def extract_text(file_path, ext):
     """Извлекает текст из файла по расширению"""
     if ext == "txt":
-        with open(file_path, "r", encoding="utf-8") as f:
+        with open(local_path(file_path), "r", encoding="utf-8") as f:
             return f.read()
     if ext in ("xlsx", "xls"):
         return ""
+    if ext == "docx":
+        return "\n".join(iter_docx_blocks(file_path))
     if ext == "pdf":
         try:
-            import pdfplumber
-            with pdfplumber.open(file_path) as pdf:
-                text = "\n".join([p.extract_text() or "" for p in pdf.pages])
-            return text
+            return "\n".join(text for _, text, _ in iter_pdf_pages(file_path))
         except Exception as ex:
             return ""
     return ""
 
+def get_document_type(file_path, configs):
+    """Тип документа по имени файла из document_types.yaml: обязательные поля и лимит страниц"""
+    cfg = configs.get('document_types.yaml') or {}
+    default = dict(DEFAULT_DOCUMENT_TYPE, **(cfg.get('default') or {}))
+    file_name = os.path.basename(file_path).lower()
+    for name, doc_type in (cfg.get('document_types') or {}).items():
+        if re.search(doc_type.get('match', name), file_name, re.IGNORECASE):
+            return dict(default, name=name, **{k: v for k, v in doc_type.items() if k != 'match'})
+    return default
+
+def _attach_excerpt(doc_data, texts):
+    """Отрывок текста для AI — только если парсер нашёл не все поля"""
+    if not all(doc_data.get(field) for field in PARSER_FIELDS):
+        excerpt = make_excerpt(*texts)
+        if excerpt:
+            doc_data[EXCERPT_FIELD] = excerpt
+
+def _merge_missing(doc_data, found):
+    """Дописывает в doc_data только ещё не найденные поля"""
+    for field, value in found.items():
+        if value and not doc_data.get(field):
+            doc_data[field] = value
+
+def extract_pdf_fields(file_path, configs):
+    """
+    Постраничное извлечение полей из PDF с ранним выходом.
+    Страницы без текстового слоя не разбираются, а возвращаются для OCR.
+    Чтение прекращается, как только найдены все обязательные поля типа документа
+    или исчерпан его лимит страниц.
+    Возвращает (поля, [индексы страниц для OCR], был ли текстовый слой хоть на одной странице).
+    """
+    doc_type = get_document_type(file_path, configs)
+    required = doc_type['required_fields']
+    doc_data = ParsedRecord({field: "" for field in PARSER_FIELDS})
+    ocr_pages = []
+    pages_read = 0
+    has_text = False
+    texts, text_chars = [], 0
+
+    for index, text, has_text_layer in iter_pdf_pages(file_path, doc_type.get('max_pages')):
+        pages_read += 1
+        if not has_text_layer:
+            ocr_pages.append(index)
+            continue
+        has_text = True
+        if text_chars < EXCERPT_CHARS:
+            texts.append(text)
+            text_chars += len(text)
+        _merge_missing(doc_data, extract_fields_from_text(text, configs))
+        if all(doc_data.get(field) for field in required):
+            ocr_pages = []
+            break
+
+    _attach_excerpt(doc_data, texts)
+    log_event(stage="parser", status="pdf_pages", file=file_path, doc_type=doc_type['name'],
+              pages_read=pages_read, ocr_pages=len(ocr_pages))
+    return doc_data, ocr_pages, has_text
+
+def extract_docx_fields(file_path, configs, chunk_blocks=DOCX_CHUNK_BLOCKS):
+    """
+    Извлечение полей из DOCX по мере чтения абзацев и ячеек с ранним выходом:
+    чтение прекращается, как только найдены обязательные поля типа документа.
+    Возвращает (поля, был ли в документе текст).
+    """
+    required = get_document_type(file_path, configs)['required_fields']
+    doc_data = ParsedRecord({field: "" for field in PARSER_FIELDS})
+    chunk, blocks_read, has_text = [], 0, False
+    texts, text_chars = [], 0
+
+    def scan():
+        _merge_missing(doc_data, extract_fields_from_text("\n".join(chunk), configs))
+        chunk.clear()
+        return all(doc_data.get(field) for field in required)
+
+    for block in iter_docx_blocks(file_path):
+        blocks_read += 1
+        has_text = True
+        chunk.append(block)
+        if text_chars < EXCERPT_CHARS:
+            texts.append(block)
+            text_chars += len(block)
+        # Регулярки прогоняются по пачке блоков, а не по каждому абзацу
+        if len(chunk) >= chunk_blocks and scan():
+            break
+    else:
+        if chunk:
+            scan()
+
+    _attach_excerpt(doc_data, texts)
+    log_event(stage="parser", status="docx_blocks", file=file_path, blocks_read=blocks_read)
+    return doc_data, has_text
+
+# Форматы, содержимое которых читают парсер и OCR (реестры Excel парсер не открывает)
+PREFETCH_EXTS = ('txt', 'docx') + OCR_EXTS
+
+DEFAULT_FIELD_PATTERNS = {
+    'date': guard(re.compile(r'\b\d{2}\.\d{2}\.\d{4}\b'), profile=False),
+    'number_ip': guard(re.compile(r'\b\d{8,13}\b'), profile=False),
+    'fio': guard(re.compile(r'[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+'), profile=False),
+}
+
 def extract_fields_from_text(text, configs):
-    """Извлекает поля с помощью регулярных выражений"""
+    """Извлекает поля с помощью регулярных выражений (скомпилированы в config)"""
+    validators = (configs.get('patterns') or compile_patterns(configs))['validators']
     result = {}
-    
-    # Пример извлечения полей
-    validators = configs.get('validators.yaml', {})
-    
-    # Дата
-    date_regex = validators.get('date', {}).get('regex', r'\b\d{2}\.\d{2}\.\d{4}\b')
-    date_match = re.search(date_regex, text)
-    result['date'] = date_match.group(0) if date_match else ""
-
-    # Номер договора
-    number_regex = validators.get('number_ip', {}).get('regex', r'\b\d{8,13}\b')
-    number_match = re.search(number_regex, text)
-    result['number_ip'] = number_match.group(0) if number_match else ""
-
-    # ФИО
-    fio_regex = validators.get('fio', {}).get('regex', r'[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+')
-    fio_match = re.search(fio_regex, text)
-    result['fio'] = fio_match.group(0) if fio_match else ""
-
+    for field, default in DEFAULT_FIELD_PATTERNS.items():
+        match = validators.get(field, default).search(text)
+        result[field] = match.group(0) if match else ""
     return result
 
-def parse_file(file_info, configs):
-    """Парсинг одного файла"""
+def _parse_failed(file_info, error, retry_queue):
+    log_error(stage="parser", status="error", file=file_info['file'], error_msg=str(error))
+    if retry_queue is not None:
+        retry_queue.record_failure(file_info, error, stage="parser")
+    return None
+
+def parse_file(file_info, configs, retry_queue=None):
+    """Парсинг одного файла; неудача учитывается в очереди повторов (если передана)"""
     file_path = file_info['file']
     creditor = file_info['creditor']
     ext = file_info['ext']
 
     try:
         if not os.path.exists(file_path):
-            log_error(stage="parser", status="error", file=file_path, error_msg="File not found")
-            return None
+            return _parse_failed(file_info, "File not found", retry_queue)
+
+        if ext == "pdf":
+            doc_data, ocr_pages, has_text = extract_pdf_fields(file_path, configs)
+            doc_data['file'] = file_path
+            doc_data['creditor'] = creditor
+            if ocr_pages:
+                # Недостающие поля доберёт OCR страниц без текстового слоя (data_enrichment)
+                doc_data.update(ext=ext, ocr_required=True, ocr_pages=ocr_pages)
+                log_event(stage="parser", status="ocr_required", file=file_path, creditor=creditor)
+                return doc_data
+            if not has_text:
+                return _parse_failed(file_info, "Empty text", retry_queue)
+            log_event(stage="parser", status="ok", file=file_path, creditor=creditor, result="parsed")
+            if retry_queue is not None:
+                retry_queue.record_success(file_path)
+            return doc_data
+
+        if ext == "docx":
+            doc_data, has_text = extract_docx_fields(file_path, configs)
+            if not has_text:
+                return _parse_failed(file_info, "Empty text", retry_queue)
+            doc_data['file'] = file_path
+            doc_data['creditor'] = creditor
+            log_event(stage="parser", status="ok", file=file_path, creditor=creditor, result="parsed")
+            if retry_queue is not None:
+                retry_queue.record_success(file_path)
+            return doc_data
 
         text = extract_text(file_path, ext)
         if not text:
-            log_error(stage="parser", status="error", file=file_path, error_msg="Empty text")
-            return None
+            if ext in OCR_EXTS:
+                # Скан — распознаётся на этапе data_enrichment
+                log_event(stage="parser", status="ocr_required", file=file_path, creditor=creditor)
+                return ParsedRecord(file=file_path, creditor=creditor, ext=ext, ocr_required=True)
+            return _parse_failed(file_info, "Empty text", retry_queue)
 
-        doc_data = extract_fields_from_text(text, configs)
+        doc_data = ParsedRecord(extract_fields_from_text(text, configs))
+        _attach_excerpt(doc_data, [text[:EXCERPT_CHARS]])
         doc_data['file'] = file_path
         doc_data['creditor'] = creditor
 
         log_event(stage="parser", status="ok", file=file_path, creditor=creditor, result="parsed")
+        if retry_queue is not None:
+            retry_queue.record_success(file_path)
         return doc_data
 
     except Exception as ex:
-        log_error(stage="parser", status="error", file=file_path, error_msg=str(ex))
-        return None
+        return _parse_failed(file_info, ex, retry_queue)
 
-def process_files(files_to_process, configs):
-    """Обработка списка файлов"""
+def process_files(files_to_process, configs, retry_queue=None):
+    """
+    Обработка списка файлов.
+    С retry_queue файлы с временной ошибкой повторяются по мере наступления
+    срока — между файлами основной очереди и после неё (не дольше max_wait_in_run).
+    Следующие файлы очереди заранее копируются с шары в локальный кэш (share_cache).
+    """
     parsed = []
-    for file_info in files_to_process:
-        doc_data = parse_file(file_info, configs)
+    attempted = set()
+    window = prefetch_window()
+
+    def attempt(file_info):
+        attempted.add(file_info['file'])
+        with timed("parse"):
+            doc_data = parse_file(file_info, configs, retry_queue)
         if doc_data:
             parsed.append(doc_data)
-    return parsed 
\ No newline at end of file
+
+    for i, file_info in enumerate(files_to_process):
+        if window:
+            ahead = files_to_process[i + 1:i + 1 + window]
+            prefetch(f['file'] for f in ahead if f['ext'] in PREFETCH_EXTS)
+        attempt(file_info)
+        if retry_queue is not None:
+            for due in retry_queue.due(attempted):
+                attempt(due)
+
+    if retry_queue is not None:
+        deadline = time.time() + float(retry_queue.settings['max_wait_in_run'])
+        next_due = retry_queue.next_due(attempted)
+        while next_due is not None and next_due <= deadline:
+            time.sleep(max(0.0, next_due - time.time()))
+            for due in retry_queue.due(attempted):
+                attempt(due)
+            next_due = retry_queue.next_due(attempted)
+        retry_queue.save()
+    return parsed
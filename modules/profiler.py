@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Профилирование этапов по запросу (main.py --profile).
+
+Выбранные этапы профилируются cProfile, с --profile-memory — ещё и
+tracemalloc. Артефакты кладутся в logs/profiles/<run-id>/:
+    <этап>.pstats     — для pstats/snakeviz
+    <этап>.collapsed  — свёрнутые стеки для flamegraph.pl / speedscope
+    <этап>.txt        — топ функций по накопленному времени
+    <этап>.memory.txt — топ мест выделения памяти (tracemalloc)
+cProfile видит только поток этапа: потоки SFTP и процессы OCR не попадают.
+"""
+
+import os
+import io
+from contextlib import contextmanager
+from datetime import datetime
+from .state_manager import log_event, LOG_DIR
+
+PROFILES_DIR = os.path.join(LOG_DIR, "profiles")
+# Этапы по умолчанию для --profile без списка
+DEFAULT_PROFILE_STAGES = ("excel_processor", "parser", "aggregate")
+# Имена функций этапов -> имена этапов stage_timer
+STAGE_ALIASES = {
+    'preprocess_excels': 'excel_processor',
+    'process_files': 'parser',
+    'aggregate_jsons': 'aggregate',
+    'unpack_archives': 'archive_handler',
+    'collect_files': 'filewalker',
+    'enrich_data': 'data_enrichment',
+    'export_to_json': 'exporter',
+    'deliver_exports': 'ftp_send',
+}
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 15
+TRACEMALLOC_FRAMES = 1
+COLLAPSED_MAX_DEPTH = 64
+# Ветви дешевле этой доли общего времени не разворачиваются, обход ограничен
+COLLAPSED_MIN_SHARE = 0.0005
+COLLAPSED_MAX_VISITS = 200000
+
+_ACTIVE = {'run': None}
+
+
+def parse_stages(spec):
+    """'parser,preprocess_excels' -> {'parser', 'excel_processor'}; 'all' -> None (все этапы)"""
+    if not spec:
+        return set(DEFAULT_PROFILE_STAGES)
+    names = {name.strip() for name in spec.split(',') if name.strip()}
+    if 'all' in names:
+        return None
+    return {STAGE_ALIASES.get(name, name) for name in names}
+
+
+class ProfileRun:
+    """Профилирование одного запуска: папка артефактов и выбранные этапы"""
+
+    def __init__(self, stages=None, memory=False, root=PROFILES_DIR, run_id=None):
+        self.stages = stages
+        self.memory = memory
+        self.run_id = run_id or f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.dir = os.path.join(root, self.run_id)
+        self.artifacts = {}
+        os.makedirs(self.dir, exist_ok=True)
+
+    def wants(self, stage):
+        return self.stages is None or stage in self.stages
+
+    @contextmanager
+    def stage(self, stage):
+        import cProfile
+
+        tracemalloc = None
+        if self.memory:
+            import tracemalloc
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if tracemalloc is not None:
+                # Снимок до выгрузки профиля, чтобы не учитывать память самого профилировщика
+                after = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+            paths = self._dump_profile(stage, profile)
+            if tracemalloc is not None:
+                paths.update(self._dump_memory(stage, before, after, peak))
+            self.artifacts[stage] = paths
+
+    def _dump_profile(self, stage, profile):
+        import pstats
+
+        base = os.path.join(self.dir, stage)
+        profile.dump_stats(f"{base}.pstats")
+        stats = pstats.Stats(profile)
+
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            for stack, micros in collapsed_stacks(stats.stats):
+                f.write(f"{stack} {micros}\n")
+        log_event(stage=stage, status="profile", pstats=f"{base}.pstats",
+                  total_calls=stats.total_calls, total_seconds=round(stats.total_tt, 3))
+        return {'pstats': f"{base}.pstats", 'collapsed': f"{base}.collapsed", 'top': f"{base}.txt"}
+
+    def _dump_memory(self, stage, before, after, peak):
+        import tracemalloc
+        import cProfile
+
+        path = os.path.join(self.dir, f"{stage}.memory.txt")
+        own = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile)]
+        own.append(tracemalloc.Filter(False, __file__))
+        diff = after.filter_traces(own).compare_to(before.filter_traces(own), 'lineno')
+        top = [stat for stat in diff if stat.size_diff > 0][:TOP_ALLOCATIONS]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"peak traced: {peak / 2**20:.1f} MiB\n")
+            for stat in top:
+                f.write(f"{stat.size_diff / 1024:10.1f} KiB {stat.count_diff:8d} blocks  {stat.traceback[0]}\n")
+        log_event(stage=stage, status="profile_memory", file=path, peak_mb=round(peak / 2**20, 1),
+                  top_allocations=[{'site': str(stat.traceback[0]), 'kib': round(stat.size_diff / 1024, 1),
+                                    'blocks': stat.count_diff} for stat in top[:5]])
+        return {'memory': path}
+
+
+def _label(func):
+    filename, line, name = func
+    return f"{os.path.basename(filename)}:{line}:{name}" if line else name
+
+def collapsed_stacks(raw_stats, max_depth=COLLAPSED_MAX_DEPTH, min_share=COLLAPSED_MIN_SHARE,
+                     max_visits=COLLAPSED_MAX_VISITS):
+    """
+    Свёрнутые стеки (формат flamegraph.pl) из графа вызовов cProfile.
+    Собственное время функции делится между стеками пропорционально
+    накопленному времени рёбер caller->callee;
+    стеки восстанавливаются обходом от корней, рекурсия обрезается.
+    Ветви дешевле min_share общего времени отбрасываются, обход
+    ограничен max_visits узлами. Значения — микросекунды.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in raw_stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, value in raw_stats.items() if not value[4]]
+    threshold = sum(value[2] for value in raw_stats.values()) * min_share
+
+    result = {}
+    visits = [0]
+
+    def walk(func, stack, share):
+        visits[0] += 1
+        tt = raw_stats[func][2]
+        frames = stack + [_label(func)]
+        if tt * share > 0:
+            key = ";".join(frames)
+            result[key] = result.get(key, 0) + tt * share
+        if len(frames) >= max_depth or visits[0] >= max_visits:
+            return
+        for child, edge_ct in callees.get(func, ()):
+            child_ct = raw_stats[child][3]
+            if _label(child) in frames or child_ct <= 0 or edge_ct <= 0:
+                continue
+            child_share = share * min(1.0, edge_ct / child_ct)
+            # Дешёвые ветви не разворачиваем — иначе обход экспоненциален
+            if child_share * child_ct >= threshold:
+                walk(child, frames, child_share)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return sorted((stack, int(seconds * 1e6)) for stack, seconds in result.items() if seconds * 1e6 >= 1)
+
+
+def start_run(stages=None, memory=False, root=PROFILES_DIR):
+    """Включает профилирование для текущего запуска"""
+    _ACTIVE['run'] = ProfileRun(stages, memory, root)
+    log_event(stage="profiler", status="start", run_id=_ACTIVE['run'].run_id,
+              stages=sorted(stages) if stages else "all", memory=memory)
+    return _ACTIVE['run']
+
+def finish_run():
+    """Завершает профилирование; возвращает {этап: пути артефактов}"""
+    run = _ACTIVE['run']
+    _ACTIVE['run'] = None
+    if run is None:
+        return {}
+    log_event(stage="profiler", status="done", run_id=run.run_id, dir=run.dir, artifacts=run.artifacts)
+    return run.artifacts
+
+@contextmanager
+def profile_stage(stage):
+    """Профилирует этап, если профилирование включено и этап выбран"""
+    run = _ACTIVE['run']
+    if run is None or not run.wants(stage):
+        yield
+        return
+    with run.stage(stage):
+        yield
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Компактная запись распарсенного документа.
+
+ParsedRecord хранит поля в __slots__ вместо словаря на каждую запись:
+ключи не повторяются в каждом экземпляре, значения кредитора, расширения
+и пути интернируются (одна строка на все записи одного файла/кредитора).
+Запись ведёт себя как словарь (get, [], in, items, dict(record)), так что
+parser -> data_enrichment -> ai_client -> exporter работают без изменений;
+в JSON она попадает через as_dict (json.dump(..., default=as_dict)).
+Поля вне FIELDS (например, добавленные AI) хранятся в extra.
+Там же до AI-этапа едет отрывок текста документа (EXCERPT_FIELD) для
+записей с ненайденными полями; ai_client убирает его перед выгрузкой.
+"""
+
+import sys
+from collections.abc import MutableMapping
+
+# Порядок полей = порядок ключей при выгрузке
+FIELDS = ('date', 'number_ip', 'fio', 'file', 'creditor', 'ext', 'ocr_required', 'ocr_pages')
+_FIELD_SET = frozenset(FIELDS)
+INTERNED_FIELDS = frozenset(('file', 'creditor', 'ext'))
+EXCERPT_FIELD = 'excerpt'
+EXCERPT_CHARS = 2000
+_MISSING = object()
+
+
+class ParsedRecord(MutableMapping):
+    """Запись с фиксированным набором полей в __slots__ и интерфейсом словаря"""
+
+    # Отсутствующий ключ — слот со значением _MISSING
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, data=None, **fields):
+        for name in FIELDS:
+            setattr(self, name, _MISSING)
+        self.extra = None
+        for source in (data, fields):
+            if not source:
+                continue
+            # То же, что self[key] = value, без вызова метода на каждое поле
+            for key, value in source.items():
+                if key in _FIELD_SET:
+                    if key in INTERNED_FIELDS and type(value) is str:
+                        value = sys.intern(value)
+                    setattr(self, key, value)
+                else:
+                    self[key] = value
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is _MISSING:
+                raise KeyError(key)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            if getattr(self, key) is _MISSING:
+                raise KeyError(key)
+            setattr(self, key, _MISSING)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __iter__(self):
+        for name in FIELDS:
+            if getattr(self, name) is not _MISSING:
+                yield name
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for name in FIELDS if getattr(self, name) is not _MISSING) + len(self.extra or ())
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key) is not _MISSING
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def to_dict(self):
+        """Обычный словарь в порядке FIELDS — для JSON и логов"""
+        result = {}
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not _MISSING:
+                result[name] = value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def copy(self):
+        return ParsedRecord(self)
+
+    def __repr__(self):
+        return f"ParsedRecord({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return ParsedRecord, (self.to_dict(),)
+
+
+def make_excerpt(*texts, limit=EXCERPT_CHARS):
+    """Начало текста документа с пробелами, сжатыми до одного, не длиннее limit"""
+    return " ".join(" ".join(text.split()) for text in texts if text)[:limit]
+
+def as_dict(obj):
+    """default для json.dump: ParsedRecord -> dict"""
+    if isinstance(obj, ParsedRecord):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
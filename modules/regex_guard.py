@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Защищённый поиск регулярных выражений конфигов в тексте документов.
+
+Маски validators.yaml и enrichment_fields.yaml прогоняются по тексту PDF/OCR,
+который мы не контролируем; шаблон вида 'паспорт.*?\\d{2}...' на длинном
+шумном тексте работает квадратично и может надолго занять воркер.
+GuardedPattern ищет так, чтобы стоимость не зависела от длины текста:
+
+- шаблон, начинающийся с литерала (якоря), сопоставляется только в окне
+  WINDOW_CHARS от каждого вхождения якоря (str.find — линейно);
+- шаблон без якоря — кусками CHUNK_CHARS (медленный — SLOW_CHUNK_CHARS)
+  с перекрытием OVERLAP_CHARS;
+- совпадение, упёршееся в край окна, перепроверяется в окне вдвое больше
+  (до MAX_WINDOW_CHARS), так что найденное совпадает с re.search по всему
+  тексту, пока совпадение короче окна;
+- на шаблон и текст — бюджет времени TIME_BUDGET и просмотренных символов
+  MAX_SCAN_CHARS; исчерпав бюджет, поиск прекращается (поле не найдено,
+  событие в error_log.json).
+
+При загрузке конфигов каждый шаблон разбирается статически (profile_pattern):
+медленный — с вложенными неограниченными квантификаторами ((\d+\s?)+) или
+с соседними неограниченными, совпадающими на общих символах (\d+\d+,
+[^\w]*(.+?)). Вердикт не зависит от таймера, хранится в снимке конфигов
+по (шаблон, флаги), и предупреждение в лог пишется один раз — когда шаблон
+встретился впервые или изменился.
+"""
+
+import re
+import time
+import logging
+from .state_manager import log_error
+
+try:
+    import re._parser as _sre_parse
+except ImportError:   # Python < 3.11
+    import sre_parse as _sre_parse
+
+WINDOW_CHARS = 1000
+MAX_WINDOW_CHARS = 64 * 1024
+CHUNK_CHARS = 64 * 1024
+# Медленному шаблону без якоря квадратичен и один кусок — режем мельче
+SLOW_CHUNK_CHARS = 4000
+OVERLAP_CHARS = 2000
+TIME_BUDGET = 0.5
+MAX_SCAN_CHARS = 64 * 1024 * 1024
+MIN_ANCHOR_CHARS = 3
+
+# Символы, на которых сравниваются классы соседних квантификаторов
+# (плюс литералы и границы диапазонов самого шаблона)
+SAMPLE_CHARS = '0159aAzZ_аАяЯёЁ \t\n.,;:-+@%()/"№'
+SLOW_REASONS = {
+    'nested': 'вложенные квантификаторы',
+    'adjacent': 'соседние квантификаторы на общих символах',
+}
+
+_PROFILES = {}   # (шаблон, флаги) -> результат profile_pattern; сохраняется в снимке конфигов
+
+
+def literal_prefix(pattern):
+    """Литерал, с которого обязано начинаться любое совпадение ('' — нет такого)"""
+    if pattern.flags & re.IGNORECASE:
+        return ''
+    try:
+        parsed = _sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return ''
+    chars = []
+    for op, value in parsed:
+        name = str(op)
+        if name == 'AT' and not chars:
+            # \b и т.п. в начале шаблона длины не имеют
+            continue
+        if name != 'LITERAL':
+            break
+        chars.append(chr(value))
+    return ''.join(chars)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class GuardedPattern:
+    """Скомпилированный шаблон с поиском по окнам и бюджетом; остальное — как у re.Pattern"""
+
+    def __init__(self, pattern, source=''):
+        self.regex = pattern
+        self.source = source
+        self.anchor = literal_prefix(pattern)
+        if len(self.anchor) < MIN_ANCHOR_CHARS:
+            self.anchor = ''
+        self.chunk = CHUNK_CHARS
+        self.profile = None
+
+    def __getattr__(self, name):
+        # pattern, groups, flags, match, fullmatch... — от исходного шаблона
+        return getattr(self.regex, name)
+
+    def __repr__(self):
+        return f"GuardedPattern({self.regex.pattern!r}, anchor={self.anchor!r})"
+
+    def _match_at(self, text, start, budget, anchored):
+        """Совпадение, начинающееся в start (anchored) или первое в окне от start"""
+        length = len(text)
+        window = WINDOW_CHARS if anchored else self.chunk + OVERLAP_CHARS
+        while True:
+            end = min(length, start + window)
+            budget.spend(end - start)
+            match = (self.regex.match if anchored else self.regex.search)(text, start, end)
+            # Совпадение у края окна могло быть обрезано окном — проверяем в окне побольше
+            if match is None or match.end() < end or end == length or window >= MAX_WINDOW_CHARS:
+                return match
+            window *= 2
+
+    def search(self, text, pos=0, endpos=None):
+        """Как re.Pattern.search; None и при исчерпании бюджета"""
+        if endpos is not None:
+            text = text[:endpos]
+        if len(text) - pos <= WINDOW_CHARS:
+            return self.regex.search(text, pos)
+        budget = _Budget()
+        try:
+            if self.anchor:
+                start = text.find(self.anchor, pos)
+                while start >= 0:
+                    match = self._match_at(text, start, budget, anchored=True)
+                    if match is not None:
+                        return match
+                    start = text.find(self.anchor, start + 1)
+                return None
+            start = pos
+            while start < len(text):
+                match = self._match_at(text, start, budget, anchored=False)
+                if match is not None:
+                    return match
+                start += self.chunk
+            return None
+        except BudgetExceeded as ex:
+            log_error(stage="regex_guard", status="budget_exceeded", pattern=self.source or self.regex.pattern,
+                      text_chars=len(text), error_msg=str(ex))
+            return None
+
+
+class _Budget:
+    """Бюджет одного поиска: время и просмотренные символы"""
+
+    __slots__ = ('deadline', 'chars')
+
+    def __init__(self):
+        self.deadline = time.perf_counter() + TIME_BUDGET
+        self.chars = 0
+
+    def spend(self, chars):
+        self.chars += chars
+        if self.chars > MAX_SCAN_CHARS:
+            raise BudgetExceeded(f"просмотрено больше {MAX_SCAN_CHARS} символов")
+        if time.perf_counter() > self.deadline:
+            raise BudgetExceeded(f"поиск дольше {TIME_BUDGET} с")
+
+
+_CATEGORIES = {
+    'CATEGORY_DIGIT': str.isdecimal, 'CATEGORY_NOT_DIGIT': lambda ch: not ch.isdecimal(),
+    'CATEGORY_SPACE': str.isspace, 'CATEGORY_NOT_SPACE': lambda ch: not ch.isspace(),
+    'CATEGORY_WORD': lambda ch: ch.isalnum() or ch == '_',
+    'CATEGORY_NOT_WORD': lambda ch: not (ch.isalnum() or ch == '_'),
+}
+
+
+class _Shape:
+    """Статический разбор шаблона: вложенные и соседние перекрывающиеся квантификаторы"""
+
+    def __init__(self, pattern):
+        self.flags = pattern.flags
+        self.parsed = _sre_parse.parse(pattern.pattern, pattern.flags)
+        chars = set(SAMPLE_CHARS)
+        self._collect_chars(self.parsed, chars)
+        self.samples = sorted(chars)
+
+    def _collect_chars(self, items, chars):
+        for op, value in items:
+            name = str(op)
+            if name in ('LITERAL', 'NOT_LITERAL'):
+                chars.add(chr(value))
+            elif name == 'RANGE':
+                chars.update((chr(value[0]), chr(value[1])))
+            elif name == 'IN':
+                self._collect_chars(value, chars)
+            for child in self._children(name, value):
+                self._collect_chars(child, chars)
+
+    @staticmethod
+    def _children(name, value):
+        if name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+            return [value[2]]
+        if name == 'SUBPATTERN':
+            return [value[3]]
+        if name in ('ASSERT', 'ASSERT_NOT'):
+            return [value[1]]
+        if name == 'ATOMIC_GROUP':
+            return [value]
+        if name == 'BRANCH':
+            return list(value[1])
+        return []
+
+    def _matches(self, op, value, ch):
+        """Совпадает ли одиночный элемент с символом ch"""
+        name = str(op)
+        if self.flags & re.IGNORECASE and name in ('LITERAL', 'NOT_LITERAL', 'IN'):
+            variants = {ch, ch.lower(), ch.upper()}
+        else:
+            variants = {ch}
+        if name == 'LITERAL':
+            return chr(value) in variants
+        if name == 'NOT_LITERAL':
+            return chr(value) not in variants
+        if name == 'ANY':
+            return ch != '\n' or bool(self.flags & re.DOTALL)
+        if name == 'IN':
+            negate = any(str(item_op) == 'NEGATE' for item_op, _ in value)
+            hit = any(self._in_item(item_op, item_value, variants) for item_op, item_value in value)
+            return hit != negate
+        return False
+
+    @staticmethod
+    def _in_item(op, value, variants):
+        name = str(op)
+        if name == 'LITERAL':
+            return chr(value) in variants
+        if name == 'RANGE':
+            return any(value[0] <= ord(ch) <= value[1] for ch in variants)
+        if name == 'CATEGORY':
+            check = _CATEGORIES.get(str(value))
+            # Прочие категории (переводы строк) — считаем совпадающими: вердикт строже
+            return check is None or any(check(ch) for ch in variants)
+        return False
+
+    def chars(self, items):
+        """Символы из образца, которые может поглотить последовательность"""
+        found = set()
+        for op, value in items:
+            name = str(op)
+            if name in ('LITERAL', 'NOT_LITERAL', 'ANY', 'IN'):
+                found.update(ch for ch in self.samples if self._matches(op, value, ch))
+            elif name not in ('ASSERT', 'ASSERT_NOT'):
+                for child in self._children(name, value):
+                    found |= self.chars(child)
+        return found
+
+    @staticmethod
+    def _unbounded(name, value):
+        return name in ('MAX_REPEAT', 'MIN_REPEAT') and value[1] == _sre_parse.MAXREPEAT
+
+    def _has_unbounded(self, items):
+        for op, value in items:
+            name = str(op)
+            if self._unbounded(name, value):
+                return True
+            if any(self._has_unbounded(child) for child in self._children(name, value)):
+                return True
+        return False
+
+    def check(self, items, open_repeats=()):
+        """
+        (причина медленности 'nested' / 'adjacent' или None, open_repeats после items).
+        open_repeats — символы неограниченных квантификаторов, вплотную за которыми
+        может идти следующий элемент.
+        """
+        open_repeats = list(open_repeats)
+        for op, value in items:
+            name = str(op)
+            if name in ('AT', 'ASSERT', 'ASSERT_NOT'):
+                continue
+            if self._unbounded(name, value):
+                body = value[2]
+                if self._has_unbounded(body):
+                    return 'nested', []
+                reason, _ = self.check(body)
+                if reason:
+                    return reason, []
+                chars = self.chars(body)
+                if any(chars & previous for previous in open_repeats):
+                    return 'adjacent', []
+                open_repeats = (open_repeats if value[0] == 0 else []) + [chars]
+            elif name in ('MAX_REPEAT', 'MIN_REPEAT') and value[0] == 0:
+                # Необязательный элемент (\s?) соседство не разрывает
+                reason, _ = self.check(value[2])
+                if reason:
+                    return reason, []
+            elif name == 'SUBPATTERN':
+                reason, open_repeats = self.check(value[3], open_repeats)
+                if reason:
+                    return reason, []
+            elif name == 'BRANCH':
+                after = []
+                for branch in value[1]:
+                    reason, branch_open = self.check(branch, open_repeats)
+                    if reason:
+                        return reason, []
+                    after.extend(branch_open)
+                open_repeats = after
+            else:
+                for child in self._children(name, value):
+                    reason, _ = self.check(child)
+                    if reason:
+                        return reason, []
+                open_repeats = []
+        return None, open_repeats
+
+
+def profile_pattern(pattern):
+    """
+    Статическая оценка шаблона: {'slow': bool, 'reason': 'nested' | 'adjacent' | ''}.
+    Результат кэшируется по (шаблон, флаги) и попадает в снимок конфигов.
+    """
+    regex = pattern.regex if isinstance(pattern, GuardedPattern) else pattern
+    key = (regex.pattern, regex.flags)
+    if key in _PROFILES:
+        return _PROFILES[key]
+    try:
+        shape = _Shape(regex)
+        reason, _ = shape.check(shape.parsed)
+    except Exception:
+        reason = None
+    result = {'slow': reason is not None, 'reason': reason or ''}
+    _PROFILES[key] = result
+    return result
+
+def known_profiles():
+    """Все оценки шаблонов процесса — для снимка конфигов"""
+    return dict(_PROFILES)
+
+def restore_profiles(profiles):
+    """Оценки из снимка конфигов: шаблоны из них повторно не оцениваются и не предупреждают"""
+    for key, result in (profiles or {}).items():
+        _PROFILES.setdefault(key, result)
+
+def guard(pattern, source='', profile=True):
+    """GuardedPattern для шаблона; с profile — оценка и предупреждение о медленном (один раз на шаблон)"""
+    guarded = GuardedPattern(pattern, source)
+    if profile:
+        new = (pattern.pattern, pattern.flags) not in _PROFILES
+        guarded.profile = profile_pattern(pattern)
+        if guarded.profile['slow']:
+            guarded.chunk = SLOW_CHUNK_CHARS
+            if new:
+                logging.warning(f"Медленное регулярное выражение {source}: {pattern.pattern!r} "
+                                f"({SLOW_REASONS[guarded.profile['reason']]}); якорь: {guarded.anchor or 'нет'}")
+    return guarded
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Очередь повторов для файлов, не разобранных из-за временных сбоев.
+
+Ошибка классифицируется: временная (файл занят или недоступен на шаре,
+таймаут, сбой сети или OCR) повторяется с экспоненциальной паузой,
+постоянная (файл битый, пустой, неподдерживаемый) — никогда. После
+max_retries повторов (первая попытка не в счёт) или при постоянной ошибке файл уходит в
+not_processed.json и больше не берётся, пока не изменится сам файл
+(размер или mtime). Очередь хранится в data/retry_queue.json: повтор,
+не успевший в текущий запуск, берётся в следующем цикле. В запуске повторы
+выполняются между файлами основной очереди, по мере наступления их срока
+(куча сроков — без перебора всей очереди после каждого файла). Записи
+удалённых файлов и давно не разобранных (failed_retention_days) при
+загрузке забываются. Файл очереди пишется раз на пачку (save).
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+import uuid
+import errno
+from .state_manager import log_event, log_not_processed
+
+RETRY_SETTINGS_DEFAULT = {
+    'queue_path': 'data/retry_queue.json',
+    # По ТЗ — до 3 повторов временных сбоев чтения и OCR (сверх первой попытки)
+    'max_retries': 3,
+    'base_delay': 5,
+    'max_delay': 3600,
+    # Сколько после основной очереди ждать повторов, срок которых наступает, сек
+    'max_wait_in_run': 60,
+    # Сколько помнить окончательно не разобранный файл, сут
+    'failed_retention_days': 30,
+}
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+TRANSIENT_ERRNOS = {errno.EACCES, errno.EAGAIN, errno.EBUSY, errno.EIO, errno.ETIMEDOUT, errno.ENETDOWN,
+                    errno.ENETUNREACH, errno.ECONNRESET, errno.ECONNABORTED, errno.EHOSTUNREACH,
+                    errno.ESTALE, errno.EINTR, errno.ENOSPC, errno.EMFILE}
+TRANSIENT_TYPES = {'TimeoutError', 'TimeoutExpired', 'ConnectionError', 'ConnectionResetError',
+                   'BrokenPipeError', 'PermissionError', 'BlockingIOError', 'InterruptedError',
+                   'MemoryError', 'ImportError', 'ModuleNotFoundError', 'TesseractNotFoundError'}
+PERMANENT_TYPES = {'FileNotFoundError', 'IsADirectoryError', 'NotADirectoryError', 'UnicodeDecodeError',
+                   'ValueError', 'KeyError', 'BadZipFile', 'PDFSyntaxError', 'PdfminerException',
+                   'PSEOF', 'UnidentifiedImageError', 'DecompressionBombError', 'InvalidFileException'}
+TRANSIENT_MESSAGE = re.compile(r'timed? ?out|temporar|busy|locked|try again|connection|unavailable|'
+                               r'таймаут|занят|недоступ', re.IGNORECASE)
+PERMANENT_MESSAGE = re.compile(r'^(empty text|file not found)|not a zip|corrupt|unsupported|encrypted|'
+                               r'повреж|не поддерж', re.IGNORECASE)
+
+
+def load_retry_settings(configs):
+    """Настройки повторов из retry_settings.yaml поверх значений по умолчанию"""
+    settings = dict(RETRY_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('retry_settings.yaml') or {})
+    return settings
+
+def classify_error(error):
+    """'transient' или 'permanent' для исключения или строки ошибки ('Тип: текст')"""
+    if isinstance(error, BaseException):
+        name, message = type(error).__name__, str(error)
+        if isinstance(error, OSError) and error.errno is not None and not isinstance(error, FileNotFoundError):
+            return TRANSIENT if error.errno in TRANSIENT_ERRNOS else PERMANENT
+        if isinstance(error, (TimeoutError, ConnectionError)):
+            return TRANSIENT
+    else:
+        message = str(error or '')
+        name = message.split(':', 1)[0].strip() if ':' in message else ''
+    if name in TRANSIENT_TYPES:
+        return TRANSIENT
+    if name in PERMANENT_TYPES or PERMANENT_MESSAGE.search(message):
+        return PERMANENT
+    if TRANSIENT_MESSAGE.search(message):
+        return TRANSIENT
+    # Неизвестная ошибка — повторяем, но не больше max_retries раз
+    return TRANSIENT
+
+def _fingerprint(path):
+    try:
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime]
+    except OSError:
+        return None
+
+
+class RetryQueue:
+    """Файлы с неудачными попытками: класс ошибки, число попыток, срок повтора"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.path = settings['queue_path']
+        self.entries = {}   # файл -> запись
+        self.heap = []      # (срок повтора, файл) для повторов, запланированных в этом запуске
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.prune()
+        return self
+
+    def prune(self, now=None):
+        """Забывает записи удалённых файлов и не разобранных дольше failed_retention_days"""
+        now = time.time() if now is None else now
+        cutoff = now - float(self.settings.get('failed_retention_days') or 0) * 86400
+        stale = [path for path, entry in self.entries.items()
+                 if not os.path.exists(path) or
+                 (entry.get('state') == 'failed' and cutoff < now and
+                  entry.get('failed_at', entry.get('first_failed', now)) < cutoff)]
+        for path in stale:
+            del self.entries[path]
+        if stale:
+            self.dirty = True
+            log_event(stage="retry_queue", status="pruned", count=len(stale))
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def delay(self, attempts):
+        return min(float(self.settings['max_delay']), float(self.settings['base_delay']) * 2 ** (attempts - 1))
+
+    def record_failure(self, file_info, error, stage="parser"):
+        """
+        Учитывает неудачную попытку. Возвращает 'retry' (повтор запланирован)
+        или 'failed' (постоянная ошибка либо попытки исчерпаны — файл в not_processed).
+        На диск попадает при save() — в конце пачки.
+        """
+        file_path = file_info['file']
+        error_class = classify_error(error)
+        error_text = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        entry = self.entries.get(file_path) or {'attempts': 0, 'first_failed': time.time()}
+        entry.update(file_info={k: v for k, v in file_info.items() if isinstance(v, (str, int, float, type(None)))},
+                     attempts=entry['attempts'] + 1, error_class=error_class, error=error_text, stage=stage,
+                     fingerprint=_fingerprint(file_path))
+        self.entries[file_path] = entry
+        self.dirty = True
+        return self._schedule(file_path, entry, error_class, error_text)
+
+    def _schedule(self, file_path, entry, error_class, error_text):
+        # attempts — число неудачных попыток, включая первую; повторов уже было attempts - 1
+        if error_class == TRANSIENT and entry['attempts'] <= int(self.settings['max_retries']):
+            entry.update(state='pending', next_attempt=time.time() + self.delay(entry['attempts']))
+            heapq.heappush(self.heap, (entry['next_attempt'], file_path))
+            log_event(stage="retry_queue", status="scheduled", file=file_path, attempts=entry['attempts'],
+                      error_class=error_class, next_attempt=entry['next_attempt'], error_msg=error_text)
+            return 'retry'
+        entry.update(state='failed', next_attempt=None, failed_at=time.time())
+        reason = error_text if error_class == PERMANENT else \
+            f"{error_text} (попыток: {entry['attempts']})"
+        log_not_processed(file_path, reason)
+        log_event(stage="retry_queue", status="failed", file=file_path, attempts=entry['attempts'],
+                  error_class=error_class, error_msg=error_text)
+        return 'failed'
+
+    def record_success(self, file_path):
+        if self.entries.pop(file_path, None) is not None:
+            self.dirty = True
+            log_event(stage="retry_queue", status="recovered", file=file_path)
+
+    def filter(self, files, now=None):
+        """Файлы запуска без ждущих повтора и окончательно не разобранных (если файл не менялся)"""
+        now = time.time() if now is None else now
+        kept, waiting, failed = [], 0, 0
+        for file_info in files:
+            entry = self.entries.get(file_info['file'])
+            if entry is not None and entry.get('fingerprint') != _fingerprint(file_info['file']):
+                # Файл заменили — начинаем заново
+                del self.entries[file_info['file']]
+                self.dirty = True
+                entry = None
+            if entry is None:
+                kept.append(file_info)
+            elif entry['state'] == 'failed':
+                failed += 1
+            elif entry['next_attempt'] > now:
+                waiting += 1
+            else:
+                kept.append(file_info)
+        if waiting or failed:
+            log_event(stage="retry_queue", status="filtered", waiting=waiting, failed=failed)
+        self.save()
+        return kept
+
+    def _current(self, item, files):
+        """Элемент кучи ещё в силе: файл ждёт повтора именно к этому сроку и есть в files"""
+        entry = self.entries.get(item[1])
+        return entry is not None and entry.get('state') == 'pending' and \
+            entry['next_attempt'] == item[0] and item[1] in files
+
+    def due(self, files, now=None):
+        """Файлы из files, ждущие повтора, срок которого наступил: [file_info]"""
+        now = time.time() if now is None else now
+        result = []
+        while self.heap and self.heap[0][0] <= now:
+            item = heapq.heappop(self.heap)
+            if self._current(item, files):
+                result.append(dict(self.entries[item[1]]['file_info'], file=item[1]))
+        return result
+
+    def next_due(self, files):
+        """Ближайший срок повтора среди files (time.time()) или None"""
+        while self.heap and not self._current(self.heap[0], files):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+
+def open_retry_queue(configs):
+    return RetryQueue(load_retry_settings(configs))
@@ -1,9 +1,132 @@
 # -*- coding: utf-8 -*-
 """
 Модуль маршрутизации файлов по кредиторам.
+
+creditors_to_process.csv и paths.json компилируются один раз в префиксное
+дерево по компонентам пути, formats.csv — в таблицу правил по расширению.
+Маршрут файла определяется спуском по дереву за O(глубины пути):
+выигрывает самое глубокое совпавшее правило.
 """
 
-def select_route(files_to_process, configs):
+import os
+import json
+from .state_manager import log_event, LOG_DIR
+
+ROUTING_DEBUG_LOG = "routing_debug.json"
+ACTIVE_STATUS = 'к обработке'
+
+
+def _split_path(path):
+    """Компоненты абсолютного нормализованного пути"""
+    return [part for part in os.path.normcase(os.path.abspath(path)).split(os.sep) if part]
+
+
+class RoutingTable:
+    """Скомпилированные правила: дерево префиксов путей и правила форматов"""
+
+    def __init__(self):
+        self.root = {}
+        self.formats = {}
+        self.rules = 0
+        self.conflicts = []
+
+    def add_path_rule(self, path, creditor, rule):
+        node = self.root
+        for part in _split_path(path):
+            node = node.setdefault(part, {})
+        existing = node.get(None)
+        if existing and existing[0] != creditor:
+            self.conflicts.append({'path': path, 'kept': existing[1], 'ignored': rule})
+            return
+        if not existing:
+            node[None] = (creditor, rule)
+            self.rules += 1
+
+    def add_format_rule(self, ext, priority, rule):
+        self.formats[ext.lower().lstrip('.')] = (priority, rule)
+
+    def route(self, path):
+        """(creditor, rule) самого глубокого правила по пути или (None, None)"""
+        node = self.root
+        match = (None, None)
+        for part in _split_path(path):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                match = node[None]
+        return match
+
+    def format_rule(self, ext):
+        """(priority, rule) по расширению или (None, None)"""
+        return self.formats.get(ext.lower().lstrip('.'), (None, None))
+
+
+def compile_routes(configs):
+    """Компилирует справочники маршрутизации в RoutingTable"""
+    table = RoutingTable()
+
+    for row_no, row in enumerate(configs.get('creditors_to_process.csv') or []):
+        if str(row.get('status') or '').strip().lower() == ACTIVE_STATUS:
+            table.add_path_rule(str(row['link']), str(row['creditor']), f"creditors_to_process.csv:{row_no + 2}")
+
+    for creditor, path in (configs.get('paths.json') or {}).items():
+        table.add_path_rule(str(path), str(creditor), f"paths.json:{creditor}")
+
+    for row_no, row in enumerate(configs.get('formats.csv') or []):
+        rule = f"formats.csv:{row_no + 2}"
+        try:
+            priority = int(row.get('priority'))
+        except (TypeError, ValueError):
+            # Пустой или нечисловой приоритет — формат остаётся, приоритет по умолчанию планировщика
+            priority = None
+            log_event(stage="route_selector", status="warning", message="Некорректный приоритет формата",
+                      rule=rule, priority=row.get('priority'))
+        table.add_format_rule(str(row['extension']), priority, rule)
+
+    for conflict in table.conflicts:
+        log_event(stage="route_selector", status="warning", message="Конфликт маршрутов", **conflict)
+    return table
+
+
+_COMPILED = {}
+
+def get_routing_table(configs):
+    """Таблица маршрутов, скомпилированная один раз на набор конфигов"""
+    cached = _COMPILED.get('table')
+    if cached is None or _COMPILED.get('configs') is not configs:
+        cached = compile_routes(configs)
+        _COMPILED.update(configs=configs, table=cached)
+    return cached
+
+
+def select_route(files_to_process, configs, debug=False):
     """Определяет маршрут обработки для каждого файла"""
-    # Заглушка - возвращает файлы без изменений
-    return files_to_process 
\ No newline at end of file
+    table = get_routing_table(configs)
+    routed = []
+    stats = {}
+    debug_file = None
+    if debug:
+        debug_file = open(os.path.join(LOG_DIR, ROUTING_DEBUG_LOG), 'w', encoding='utf-8')
+
+    try:
+        for file_info in files_to_process:
+            creditor, rule = table.route(file_info['file'])
+            priority, format_rule = table.format_rule(file_info.get('ext', ''))
+            if creditor is None:
+                # Файл вне известных путей — остаётся за кредитором папки обхода
+                creditor, rule = file_info.get('creditor'), 'fallback'
+            file_info = dict(file_info, creditor=creditor, route=rule, priority=priority)
+            routed.append(file_info)
+            stats[rule] = stats.get(rule, 0) + 1
+            if debug_file is not None:
+                debug_file.write(json.dumps({
+                    'file': file_info['file'], 'creditor': creditor,
+                    'path_rule': rule, 'format_rule': format_rule, 'priority': priority,
+                }, ensure_ascii=False) + '\n')
+    finally:
+        if debug_file is not None:
+            debug_file.close()
+
+    log_event(stage="route_selector", status="ok", count=len(routed), rules=table.rules, matched=stats)
+    return routed
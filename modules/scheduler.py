@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик очереди файлов: приоритет формата, размер, возраст и
+справедливость между кредиторами.
+
+Порядок внутри кредитора — по приоритету формата из formats.csv (меньше —
+раньше), затем малые файлы раньше больших, затем старые раньше новых.
+Файл, ждущий дольше age_boost_hours, поднимается на ступень приоритета
+за каждый такой интервал — большие пачки не голодают вечно.
+Между кредиторами — по кругу в пределах одной ступени приоритета; в любом
+окне из fairness_window файлов один кредитор занимает не больше своей доли
+max_share (если другим кредиторам нечего отдавать, ограничение снимается).
+Кредиторы лежат в двух кучах (доля окна не выбрана / выбрана) по ключу
+(ступень, давность обслуживания, ключ первого файла): на файл очереди
+перекладываются только обслуженный кредитор и покинувший окно, O(log C).
+С max_files_per_run / max_bytes_per_run запуск берёт только начало очереди,
+остальное — в следующих циклах: срочные реестры не ждут чужих сканов.
+"""
+
+import os
+import math
+import time
+import heapq
+from collections import deque
+from .state_manager import log_event
+
+SCHEDULER_SETTINGS_DEFAULT = {
+    'enabled': True,
+    # Приоритет файлов, расширения которых нет в formats.csv
+    'default_priority': 100,
+    # Файлы не больше этого размера идут раньше больших той же ступени, байт
+    'small_file_bytes': 5 * 1024 * 1024,
+    # Ожидание, за которое файл поднимается на ступень приоритета, ч; пусто — без подъёма
+    'age_boost_hours': 24,
+    'fairness_window': 20,
+    # Доля окна на одного кредитора; creditor_shares — свои доли отдельным кредиторам
+    'max_share': 0.5,
+    'creditor_shares': {},
+    # Ограничения запуска; пусто — все файлы
+    'max_files_per_run': None,
+    'max_bytes_per_run': None,
+}
+
+
+def load_scheduler_settings(configs):
+    """Настройки планировщика из scheduler_settings.yaml поверх значений по умолчанию"""
+    settings = dict(SCHEDULER_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('scheduler_settings.yaml') or {})
+    return settings
+
+def _stat(path):
+    """(размер, mtime) файла; отсутствующий файл — нулевой и самый новый"""
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return 0, float('inf')
+
+def file_key(file_info, settings, now=None):
+    """Ключ порядка файла внутри кредитора: (ступень, не малый, размер, mtime)"""
+    now = time.time() if now is None else now
+    size, mtime = _stat(file_info['file'])
+    priority = file_info.get('priority')
+    tier = int(settings['default_priority'] if priority is None else priority)
+    boost_hours = settings.get('age_boost_hours')
+    if boost_hours and mtime < now:
+        tier -= int((now - mtime) / 3600 / float(boost_hours))
+    return (tier, size > int(settings['small_file_bytes']), size, mtime)
+
+
+def schedule_files(files, configs, now=None):
+    """
+    Файлы в порядке обработки (с учётом ограничений запуска).
+    Возвращает (очередь запуска, отложенные файлы).
+    """
+    settings = load_scheduler_settings(configs)
+    if not settings.get('enabled') or not files:
+        return list(files), []
+
+    queues = {}
+    for file_info in files:
+        key = file_key(file_info, settings, now)
+        queues.setdefault(file_info.get('creditor'), []).append((key, file_info))
+    for creditor in queues:
+        queues[creditor] = deque(sorted(queues[creditor], key=lambda item: item[0]))
+
+    window_size = max(1, int(settings['fairness_window']))
+    shares = settings.get('creditor_shares') or {}
+    caps = {creditor: max(1, math.ceil(float(shares.get(creditor, settings['max_share'])) * window_size))
+            for creditor in queues}
+    max_files = settings.get('max_files_per_run')
+    max_bytes = settings.get('max_bytes_per_run')
+
+    ordered, window, in_window = [], deque(), dict.fromkeys(queues, 0)
+    last_served = dict.fromkeys(queues, -1)
+    total_bytes = 0
+    # Кучи кредиторов: True — доля окна не выбрана, False — выбрана.
+    # Элемент устаревает при перекладывании кредитора: current[кредитор] != seq
+    heaps, current, counter = {True: [], False: []}, {}, [0]
+
+    def push(creditor):
+        counter[0] += 1
+        current[creditor] = counter[0]
+        key = queues[creditor][0][0]
+        # Лучшая ступень приоритета; внутри неё — кредитор, обслуженный давнее всех
+        heapq.heappush(heaps[in_window[creditor] < caps[creditor]],
+                       (key[0], last_served[creditor], key, counter[0], creditor))
+
+    def top(heap):
+        while heap and current.get(heap[0][4]) != heap[0][3]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    for creditor in queues:
+        push(creditor)
+    while queues:
+        # Если доли выбрали все, ограничение снимается
+        heap = heaps[True] if top(heaps[True]) is not None else heaps[False]
+        creditor = top(heap)[4]
+        key, file_info = queues[creditor][0]
+        size = key[2]
+        if max_files and len(ordered) >= int(max_files):
+            break
+        if max_bytes and ordered and total_bytes + size > int(max_bytes):
+            break
+        heapq.heappop(heap)
+        queues[creditor].popleft()
+        if not queues[creditor]:
+            del queues[creditor]
+            del current[creditor]
+        ordered.append(file_info)
+        total_bytes += size
+        last_served[creditor] = len(ordered)
+        window.append(creditor)
+        in_window[creditor] += 1
+        if len(window) > window_size:
+            left = window.popleft()
+            in_window[left] -= 1
+            # Покинувший окно кредитор снова может получить файл — в кучу невыбравших долю
+            if left != creditor and left in queues and in_window[left] == caps[left] - 1:
+                push(left)
+        if creditor in queues:
+            push(creditor)
+
+    deferred = [file_info for queue in queues.values() for _, file_info in queue]
+    per_creditor = {}
+    for file_info in ordered:
+        per_creditor[file_info.get('creditor')] = per_creditor.get(file_info.get('creditor'), 0) + 1
+    log_event(stage="scheduler", status="ok", count=len(ordered), deferred=len(deferred),
+              bytes=total_bytes, creditors=per_creditor)
+    return ordered, deferred
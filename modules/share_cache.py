@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный кэш файлов сетевой шары (сеть/asf01/files/...).
+
+Парсер, дополнение и OCR читают один и тот же PDF; без кэша каждый этап
+тянет его по SMB заново. Через local_path файл под одним из корней roots
+копируется в cache_dir на локальный диск один раз за запуск: первое
+обращение сверяет размер и mtime источника с копией (одна операция stat
+по сети), дальше в запуске отдаётся локальная копия без обращения к шаре.
+Копия, совпавшая с источником, переживает запуск.
+
+process_files заранее (prefetch) копирует следующие файлы очереди в
+фоновом потоке — последовательно, пока парсер занят текущим; заранее
+копируется не больше prefetch_bytes (и max_bytes). Размер кэша ограничен
+max_bytes: вытесняются давно не читанные копии (LRU), а если предел
+держат копии, ждущие чтения, — событие over_limit в process_log.json.
+При ошибке копирования этап читает файл прямо с шары.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .state_manager import log_event, log_error
+
+SHARE_CACHE_SETTINGS_DEFAULT = {
+    'enabled': True,
+    # Кэшируются только файлы под этими папками
+    'roots': ['сеть/'],
+    'cache_dir': 'data/share_cache',
+    'max_bytes': 2 * 1024 ** 3,
+    # Файлы крупнее читаются прямо с шары
+    'max_file_bytes': 512 * 1024 ** 2,
+    # Сколько следующих файлов очереди и байт копировать заранее
+    'prefetch_files': 8,
+    'prefetch_bytes': 256 * 1024 ** 2,
+}
+INDEX_NAME = 'index.json'
+
+_ACTIVE = {'cache': None}
+
+
+def load_share_cache_settings(configs):
+    """Настройки кэша из share_cache_settings.yaml поверх значений по умолчанию"""
+    settings = dict(SHARE_CACHE_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('share_cache_settings.yaml') or {})
+    return settings
+
+
+class ShareCache:
+    """Копии файлов шары: {источник: {'local', 'size', 'mtime', 'used'}} в index.json"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.dir = settings['cache_dir']
+        self.roots = [os.path.join(os.path.abspath(root), '') for root in settings['roots']]
+        self.index_path = os.path.join(self.dir, INDEX_NAME)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.lock = threading.Lock()
+        self.validated = set()   # источники, сверенные в этом запуске
+        self.pending = {}        # источник -> Future фоновой копии
+        self.ahead = {}          # поставлено в prefetch и ещё не прочитано: источник -> байт
+        self.executor = None
+        self.stats = {'hits': 0, 'reused': 0, 'copied': 0, 'bytes_copied': 0, 'prefetched': 0,
+                      'evicted': 0, 'over_limit': 0, 'direct': 0}
+
+    def covers(self, path):
+        return any(os.path.abspath(path).startswith(root) for root in self.roots)
+
+    def _local_name(self, path):
+        # Имя файла сохраняется: тип документа определяется по нему
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]
+        return os.path.join(self.dir, digest[:2], digest, os.path.basename(path))
+
+    def _fetch(self, path, stat_name):
+        """Сверяет копию с источником и при расхождении копирует; путь копии или None"""
+        st = os.stat(path)
+        if st.st_size > self.max_file_bytes():
+            return None
+        with self.lock:
+            entry = self.index.get(path)
+            if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns \
+                    and os.path.exists(entry['local']):
+                self.stats['reused'] += 1
+                return entry['local']
+
+        local = self._local_name(path)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        tmp_path = f"{local}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, local)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self.lock:
+            self.index[path] = {'local': local, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'used': time.time()}
+            self.stats[stat_name] += 1
+            self.stats['bytes_copied'] += st.st_size
+        self._evict(keep=path)
+        return local
+
+    def max_file_bytes(self):
+        return min(int(self.settings['max_file_bytes']), int(self.settings['max_bytes']))
+
+    def _fetch_ahead(self, path):
+        try:
+            local = self._fetch(path, 'prefetched')
+        except BaseException:
+            with self.lock:
+                self.ahead.pop(path, None)
+            raise
+        if local is None:
+            with self.lock:
+                self.ahead.pop(path, None)
+        return local
+
+    def get(self, path):
+        """Локальная копия файла шары (или сам path, если кэш к нему не относится)"""
+        if not self.covers(path):
+            return path
+        future = self.pending.pop(path, None)
+        try:
+            if future is not None:
+                local = future.result()
+            else:
+                with self.lock:
+                    entry = self.index.get(path) if path in self.validated else None
+                if entry is not None and os.path.exists(entry['local']):
+                    local = entry['local']
+                    self.stats['hits'] += 1
+                else:
+                    local = self._fetch(path, 'copied')
+        except Exception as ex:
+            log_error(stage="share_cache", file=path, error_msg=f"Читаем с шары: {type(ex).__name__}: {ex}")
+            local = None
+        with self.lock:
+            self.ahead.pop(path, None)
+            entry = self.index.get(path) if local is not None else None
+            # Копию могли вытеснить, пока её не забрали
+            if entry is None:
+                self.stats['direct'] += 1
+                return path
+            self.validated.add(path)
+            entry['used'] = time.time()
+        return local
+
+    def prefetch(self, paths):
+        """
+        Ставит в фоновое копирование следующие файлы очереди paths (не больше
+        prefetch_files ждущих чтения и prefetch_bytes байт, причём всё заранее
+        скопированное обязано помещаться в max_bytes — его LRU не вытесняет).
+        """
+        paths = list(paths)
+        window = set(paths)
+        # Скопированное заранее, но так и не прочитанное (файл пропал из очереди) — отпускаем
+        for path in [p for p, future in self.pending.items() if future.done() and p not in window]:
+            del self.pending[path]
+            with self.lock:
+                self.ahead.pop(path, None)
+        limit = min(int(self.settings['prefetch_bytes']), int(self.settings['max_bytes']))
+        for path in paths:
+            if len(self.pending) >= int(self.settings['prefetch_files']):
+                break
+            if path in self.pending or path in self.validated or not self.covers(path):
+                continue
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            if size > self.max_file_bytes():
+                continue
+            with self.lock:
+                if sum(self.ahead.values()) + size > limit:
+                    break
+                self.ahead[path] = size
+            if self.executor is None:
+                # Один поток: шару читаем последовательно, а не вразнобой
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='share-prefetch')
+            self.pending[path] = self.executor.submit(self._fetch_ahead, path)
+
+    def _evict(self, keep=None):
+        """Удаляет давно не читанные копии, пока кэш больше max_bytes"""
+        with self.lock:
+            total = sum(entry['size'] for entry in self.index.values())
+            if total <= int(self.settings['max_bytes']):
+                return
+            for path, entry in sorted(self.index.items(), key=lambda item: item[1]['used']):
+                if total <= int(self.settings['max_bytes']):
+                    break
+                # Скопированное заранее ещё понадобится в этом запуске
+                if path == keep or path in self.ahead:
+                    continue
+                try:
+                    os.remove(entry['local'])
+                except OSError:
+                    pass
+                del self.index[path]
+                self.validated.discard(path)
+                total -= entry['size']
+                self.stats['evicted'] += 1
+            if total > int(self.settings['max_bytes']):
+                # Остались только копии, ждущие чтения, — предел превышен, пока их не прочтут
+                self.stats['over_limit'] += 1
+                log_event(stage="share_cache", status="over_limit", bytes=total,
+                          max_bytes=int(self.settings['max_bytes']), ahead=len(self.ahead))
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.index, ensure_ascii=False)
+        tmp_path = f"{self.index_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
+        if self.index or os.path.exists(self.index_path):
+            self.save()
+        with self.lock:
+            size = sum(entry['size'] for entry in self.index.values())
+        log_event(stage="share_cache", status="closed", files=len(self.index), bytes=size, **self.stats)
+        return dict(self.stats)
+
+
+def open_share_cache(configs):
+    """Включает кэш для local_path/prefetch этого процесса (None, если выключен)"""
+    settings = load_share_cache_settings(configs)
+    if not settings.get('enabled'):
+        return None
+    if _ACTIVE['cache'] is None:
+        _ACTIVE['cache'] = ShareCache(settings)
+    return _ACTIVE['cache']
+
+def close_share_cache():
+    """Дожидается фонового копирования и сохраняет индекс; счётчики или None"""
+    cache = _ACTIVE['cache']
+    _ACTIVE['cache'] = None
+    return cache.close() if cache is not None else None
+
+def local_path(path):
+    """Путь, по которому читать файл: локальная копия или сам path"""
+    cache = _ACTIVE['cache']
+    return cache.get(path) if cache is not None else path
+
+def prefetch_window():
+    """Сколько следующих файлов очереди передавать в prefetch (0 — кэш выключен)"""
+    cache = _ACTIVE['cache']
+    return int(cache.settings['prefetch_files']) if cache is not None else 0
+
+def prefetch(paths):
+    cache = _ACTIVE['cache']
+    if cache is not None:
+        cache.prefetch(paths)
@@ -47,18 +47,56 @@ def log_not_processed(file, reason):
     }
     _write_log("not_processed.json", entry)
 
+def log_ftp_status(file, creditor, status, comment, **kwargs):
+    """Фиксирует статус передачи выгрузки кредитора на SFTP и квитанции 1С"""
+    entry = {
+        "datetime": str(datetime.now()),
+        "file": file,
+        "creditor": creditor,
+        "status": status,
+        "comment": comment,
+        **kwargs
+    }
+    _write_log("ftp_status.json", entry)
+
+def load_ftp_statuses():
+    """Последний статус по каждому файлу выгрузки из ftp_status.json"""
+    statuses = {}
+    path = os.path.join(LOG_DIR, "ftp_status.json")
+    if not os.path.exists(path):
+        return statuses
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                statuses[entry["file"]] = entry
+            except Exception:
+                continue
+    return statuses
+
 def check_pause_flag():
     """Проверяет наличие pause.flag для экстренной остановки процесса"""
     return os.path.exists(os.path.join(LOG_DIR, "pause.flag"))
 
 def init_journals():
     """Создаёт пустые журналы при первом запуске (если не существуют)"""
-    for name in ["process_log.json", "error_log.json", "duplicates_log.json", "not_processed.json"]:
+    for name in ["process_log.json", "error_log.json", "duplicates_log.json", "not_processed.json",
+                 "ftp_status.json"]:
         path = os.path.join(LOG_DIR, name)
         if not os.path.exists(path):
             with open(path, 'w', encoding='utf-8') as f:
                 pass
 
 def close_journals():
-    """Заглушка: если нужно что-то сделать при завершении (архив, экспорт)"""
-    pass 
\ No newline at end of file
+    """Завершение запуска: дописывает новые строки журналов в индекс запросов"""
+    try:
+        from .journal_index import update_indexes
+        update_indexes()
+    except Exception as ex:
+        log_error(stage="journal_index", error_msg=str(ex))
+
+if __name__ == "__main__":
+    # python -m modules.state_manager query --contract ... --stage ... --since ...
+    import sys
+    from .journal_index import main
+    sys.exit(main())
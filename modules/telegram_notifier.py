@@ -1,23 +1,268 @@
 # -*- coding: utf-8 -*-
 """
 Модуль уведомлений в Telegram.
+
+send_notification только логирует событие и кладёт сообщение в ограниченную
+очередь — HTTP-запрос к Bot API выполняет фоновый NotificationDispatcher,
+этапы пайплайна его не ждут. Отправка ограничена token bucket (rate сообщений
+в секунду, всплеск до burst), ошибки сети и 5xx повторяются с экспоненциальной
+паузой, на 429 выдерживается retry_after из ответа Telegram.
+Повторы события по одному кредитору и этапу в пределах digest_interval не
+отправляются по одному, а собираются в сводку; события с digest=True
+попадают только в сводку. Без start_dispatcher (или с enabled: false)
+сообщения только логируются. Для проверки без сети — stubs/telegram_server.py.
 """
 
+import time
+import queue
 import logging
-from .state_manager import log_event
+import threading
+from .state_manager import log_event, log_error
+
+TELEGRAM_SETTINGS_DEFAULT = {
+    'enabled': False,
+    'api_url': 'https://api.telegram.org',
+    'token': '',
+    'chat_id': '',
+    # Telegram: не больше ~1 сообщения в секунду в чат, 20 в минуту в группу
+    'rate': 1.0,
+    'burst': 5,
+    'queue_size': 1000,
+    'retries': 5,
+    'backoff': 1.0,
+    'timeout': 10,
+    'digest_interval': 60,
+    # Не дольше ждать отправки очереди при завершении запуска, сек
+    'flush_timeout': 30,
+}
+DIGEST_EXAMPLES = 3
+TELEGRAM_TEXT_LIMIT = 4096
+
+_ACTIVE = {'dispatcher': None}
+
+
+def load_telegram_settings(configs):
+    """Настройки Telegram из telegram_settings.yaml поверх значений по умолчанию"""
+    settings = dict(TELEGRAM_SETTINGS_DEFAULT)
+    settings.update((configs or {}).get('telegram_settings.yaml') or {})
+    return settings
+
+def format_message(message, error=None, info=None):
+    text = message
+    if error:
+        text += f"\nОшибка: {error}"
+    if info:
+        text += f"\n{info}"
+    return text[:TELEGRAM_TEXT_LIMIT]
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Сколько ждать до следующего токена (0 — можно отправлять)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def drain(self):
+        # После 429 запас токенов сервер уже не признаёт
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class NotificationDispatcher:
+    """Фоновая отправка: очередь, ограничение частоты, повторы, сводки"""
 
-def send_notification(message, error=None, info=None):
-    """Отправка уведомления в Telegram"""
-    # Заглушка - логирует сообщение
+    def __init__(self, settings, post=None):
+        self.settings = settings
+        self.queue = queue.Queue(maxsize=int(settings['queue_size']))
+        self.bucket = TokenBucket(settings['rate'], settings['burst'])
+        self.post = post or self._post
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self._digest = {}       # (кредитор, этап) -> {'count', 'examples'}
+        self._last_sent = {}    # (кредитор, этап) -> monotonic отправки
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_digest = time.monotonic() + float(settings['digest_interval'])
+
+    def _post(self, text):
+        """Один вызов sendMessage: (успех, повторять ли, retry_after сервера, ошибка)"""
+        import requests
+
+        url = f"{self.settings['api_url'].rstrip('/')}/bot{self.settings['token']}/sendMessage"
+        try:
+            response = requests.post(url, json={'chat_id': self.settings['chat_id'], 'text': text},
+                                     timeout=float(self.settings['timeout']))
+        except requests.RequestException as ex:
+            return False, True, None, str(ex)
+        if response.status_code == 200:
+            return True, False, None, None
+        retry_after = None
+        try:
+            retry_after = response.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            pass
+        if retry_after is None and response.headers.get('Retry-After', '').isdigit():
+            retry_after = int(response.headers['Retry-After'])
+        retryable = response.status_code == 429 or response.status_code >= 500
+        return False, retryable, retry_after, f"HTTP {response.status_code}: {response.text[:200]}"
+
+    def submit(self, text, creditor=None, stage=None, digest=False):
+        """Ставит сообщение в очередь; повтор по кредитору и этапу уходит в сводку"""
+        key = (creditor, stage)
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_sent.get(key)
+            repeat = creditor is not None or stage is not None
+            if digest or (repeat and last is not None and now - last < float(self.settings['digest_interval'])):
+                entry = self._digest.setdefault(key, {'count': 0, 'examples': []})
+                entry['count'] += 1
+                if len(entry['examples']) < DIGEST_EXAMPLES:
+                    entry['examples'].append(text.splitlines()[0])
+                self.coalesced += 1
+                return True
+            if repeat:
+                self._last_sent[key] = now
+        return self._enqueue(text)
+
+    def _enqueue(self, text):
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            log_error(stage="telegram", status="dropped", message=text[:200],
+                      error_msg="Очередь уведомлений переполнена")
+            return False
+
+    def digest_text(self):
+        """Текст сводки накопленных событий (None, если копить нечего); сводка очищается"""
+        with self._lock:
+            digest, self._digest = self._digest, {}
+        if not digest:
+            return None
+        lines = ["Сводка событий:"]
+        for (creditor, stage), entry in sorted(digest.items(), key=lambda item: str(item[0])):
+            title = " / ".join(part for part in (creditor, stage) if part) or "прочее"
+            lines.append(f"• {title}: {entry['count']}")
+            lines.extend(f"    {example}" for example in entry['examples'])
+        return "\n".join(lines)[:TELEGRAM_TEXT_LIMIT]
+
+    def _flush_digest(self):
+        self._next_digest = time.monotonic() + float(self.settings['digest_interval'])
+        text = self.digest_text()
+        if text:
+            self._enqueue(text)
+
+    def _deliver(self, text):
+        retries = int(self.settings['retries'])
+        error = None
+        for attempt in range(retries + 1):
+            wait = self.bucket.wait_time()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.bucket.wait_time()
+            self.bucket.take()
+            ok, retryable, retry_after, error = self.post(text)
+            if ok:
+                self.sent += 1
+                return True
+            if not retryable or attempt == retries:
+                break
+            if retry_after is not None:
+                self.bucket.drain()
+                pause = float(retry_after)
+            else:
+                pause = float(self.settings['backoff']) * 2 ** attempt
+            time.sleep(pause)
+        self.failed += 1
+        log_error(stage="telegram", status="error", message=text[:200], error_msg=error)
+        return False
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self._next_digest - time.monotonic())
+            try:
+                text = self.queue.get(timeout=min(timeout, 0.5))
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                if time.monotonic() >= self._next_digest:
+                    self._flush_digest()
+                continue
+            try:
+                self._deliver(text)
+            except Exception as ex:
+                log_error(stage="telegram", status="error", error_msg=str(ex))
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Отправляет сводку и остаток очереди (не дольше timeout) и останавливает поток"""
+        self._flush_digest()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=float(self.settings['flush_timeout'] if timeout is None else timeout))
+        return {'sent': self.sent, 'failed': self.failed, 'dropped': self.dropped,
+                'coalesced': self.coalesced, 'pending': self.queue.qsize()}
+
+
+def start_dispatcher(configs, post=None):
+    """Запускает фоновую отправку, если Telegram включён в telegram_settings.yaml"""
+    settings = load_telegram_settings(configs)
+    if not settings.get('enabled') or _ACTIVE['dispatcher'] is not None:
+        return _ACTIVE['dispatcher']
+    _ACTIVE['dispatcher'] = NotificationDispatcher(settings, post).start()
+    return _ACTIVE['dispatcher']
+
+def stop_dispatcher(timeout=None):
+    """Досылает очередь и сводку; возвращает счётчики отправки"""
+    dispatcher = _ACTIVE['dispatcher']
+    _ACTIVE['dispatcher'] = None
+    if dispatcher is None:
+        return None
+    stats = dispatcher.stop(timeout)
+    log_event(stage="telegram", status="stopped", **stats)
+    return stats
+
+def send_notification(message, error=None, info=None, creditor=None, stage=None, digest=False):
+    """Отправка уведомления в Telegram (через очередь, не блокирует вызывающего)"""
     if error:
         log_event(stage="telegram", status="error", message=message, error=error)
     elif info:
         log_event(stage="telegram", status="info", message=message, info=info)
     else:
         log_event(stage="telegram", status="success", message=message)
-    
+
     logging.info(f"Telegram notification: {message}")
     if error:
         logging.error(f"Error: {error}")
     if info:
-        logging.info(f"Info: {info}") 
\ No newline at end of file
+        logging.info(f"Info: {info}")
+
+    dispatcher = _ACTIVE['dispatcher']
+    if dispatcher is not None:
+        dispatcher.submit(format_message(message, error, info), creditor, stage, digest)
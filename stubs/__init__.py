@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Локальные заглушки внешних сервисов для тестов и бенчмарков.
+"""
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная заглушка OpenAI-совместимого /v1/chat/completions для ai_client.
+
+Отвечает детерминированными значениями недостающих полей с заданной
+задержкой на запрос, считает запросы и записи — для тестов и бенчмарков без сети.
+Первые fail_requests запросов получают HTTP 500, записям файлов из
+empty_files возвращаются пустые значения.
+"""
+
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_VALUES = {
+    'date': '01.01.2024',
+    'fio': 'Иванов Иван Иванович',
+}
+
+def fake_value(field, item_id):
+    if field in FAKE_VALUES:
+        return FAKE_VALUES[field]
+    if field == 'number_ip':
+        return str(int(hashlib.sha256(item_id.encode()).hexdigest(), 16))[:11]
+    return f"{field}-{item_id[:8]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server.owner
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        items = json.loads(body['messages'][-1]['content'])['items']
+        with server.lock:
+            server.requests += 1
+            server.items += len(items)
+            failed = server.requests <= server.fail_requests
+        time.sleep(server.latency)
+        if failed:
+            self.send_error(500)
+            return
+
+        results = {item_id: {field: '' if item.get('file') in server.empty_files else fake_value(field, item_id)
+                             for field in item.get('missing', [])}
+                   for item_id, item in items.items()}
+        payload = json.dumps({
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {
+                'role': 'assistant',
+                'content': json.dumps({'results': results}, ensure_ascii=False),
+            }}],
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalAIServer:
+    """
+    AI-заглушка в фоновом потоке.
+
+    Пример:
+        with LocalAIServer(latency=0.2) as server:
+            configs['ai_settings.yaml'] = {'enabled': True, 'endpoint': server.url}
+    """
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0, fail_requests=0, empty_files=()):
+        self.latency = latency
+        self.fail_requests = fail_requests
+        self.empty_files = set(empty_files)
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.items = 0
+        self.lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1/chat/completions"
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Локальный SFTP-сервер на paramiko для проверки ftp_client без сервера 1С.
+
+Корень SFTP отображается на локальную папку: удалённый путь
+/mnt/ssd4tb/ftp_server/ip_loans/x.json попадает в <root>/mnt/ssd4tb/ftp_server/ip_loans/x.json.
+"""
+
+import os
+import socket
+import threading
+import paramiko
+from paramiko import (
+    ServerInterface, SFTPServerInterface, SFTPServer, SFTPAttributes,
+    SFTPHandle, SFTP_OK, AUTH_SUCCESSFUL, AUTH_FAILED, OPEN_SUCCEEDED,
+)
+
+
+class _StubServer(ServerInterface):
+    """Авторизация по логину/паролю из настроек заглушки"""
+
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if username == self.user and password == self.password:
+            return AUTH_SUCCESSFUL
+        return AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+
+class _StubHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class _StubSFTPInterface(SFTPServerInterface):
+    """Файловые операции поверх локальной папки root"""
+
+    def __init__(self, server, *args, root=None, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            result = []
+            for fname in os.listdir(local):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(local, fname)))
+                attr.filename = fname
+                result.append(attr)
+            return result
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags, 0o644)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        try:
+            f = os.fdopen(fd, mode)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        handle = _StubHandle(flags)
+        handle.filename = local
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        new_local = self._local(newpath)
+        if os.path.exists(new_local):
+            return SFTPServer.convert_errno(17)
+        try:
+            os.rename(self._local(oldpath), new_local)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+
+class LocalSFTPServer:
+    """
+    SFTP-заглушка в фоновом потоке.
+
+    Пример:
+        server = LocalSFTPServer('/tmp/sftp_root').start()
+        ... send_file_to_ftp(path, config) с host=127.0.0.1, port=server.port ...
+        server.stop()
+    """
+
+    def __init__(self, root, user="ftpuser", password="securePassword", host="127.0.0.1", port=0):
+        self.root = os.path.abspath(root)
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._sock = None
+        self._thread = None
+        self._transports = []
+        self._stopped = threading.Event()
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen(16)
+        self._sock.settimeout(0.2)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler(
+                "sftp", SFTPServer, _StubSFTPInterface, root=self.root)
+            transport.start_server(server=_StubServer(self.user, self.password))
+            self._transports.append(transport)
+
+    def drop_connections(self):
+        """Рвёт все активные сессии (имитация обрыва связи)"""
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def stop(self):
+        self._stopped.set()
+        self.drop_connections()
+        if self._sock:
+            self._sock.close()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная заглушка Telegram Bot API (/bot<token>/sendMessage) для telegram_notifier.
+
+Запоминает принятые сообщения; первые rate_limited запросов получают
+429 с parameters.retry_after, как настоящий Bot API при превышении лимита.
+"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server.owner
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            limited = server.rate_limited > 0
+            if limited:
+                server.rate_limited -= 1
+            elif self.path.endswith('/sendMessage'):
+                server.messages.append({'chat_id': body.get('chat_id'), 'text': body.get('text'),
+                                        'time': time.monotonic()})
+
+        if limited:
+            status, payload = 429, {'ok': False, 'error_code': 429,
+                                    'description': f"Too Many Requests: retry after {server.retry_after}",
+                                    'parameters': {'retry_after': server.retry_after}}
+        elif not self.path.endswith('/sendMessage'):
+            status, payload = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        else:
+            status, payload = 200, {'ok': True, 'result': {'message_id': len(server.messages)}}
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalTelegramServer:
+    """
+    Заглушка Bot API в фоновом потоке.
+
+    Пример:
+        with LocalTelegramServer(rate_limited=1) as server:
+            configs['telegram_settings.yaml'] = {'enabled': True, 'api_url': server.url, ...}
+    """
+
+    def __init__(self, latency=0.0, rate_limited=0, retry_after=1, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.messages = []
+        self.lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -22,6 +22,9 @@ def test_configs():
         'config/validators.yaml',
         'config/ftp_settings.yaml',
         'config/mail_settings.yaml',
+        'config/ocr_settings.yaml',
+        'config/document_types.yaml',
+        'config/ai_settings.yaml',
         'config/paths.json',
         'config/formats.csv',
         'config/creditors_to_process.csv'
@@ -65,7 +68,23 @@ def test_modules():
         'modules.exporter',
         'modules.aggregate_exports',
         'modules.ftp_client',
-        'modules.telegram_notifier'
+        'modules.telegram_notifier',
+        'modules.ocr_engine',
+        'modules.data_enrichment',
+        'modules.ai_client',
+        'modules.metrics',
+        'modules.profiler',
+        'modules.records',
+        'modules.leases',
+        'stubs.telegram_server',
+        'modules.journal_index',
+        'modules.attachment_store',
+        'modules.scheduler',
+        'modules.retry_queue',
+        'modules.columnar',
+        'modules.delta_export',
+        'modules.regex_guard',
+        'modules.share_cache'
     ]
     
     for module_name in modules:
@@ -130,6 +149,1083 @@ def test_logging():
     except Exception as e:
         print(f"❌ Ошибка логирования: {e}")
 
+def _write_ftp_settings(tmp_dir, port, **extra):
+    """Конфиг SFTP, указывающий на локальную заглушку"""
+    config_path = os.path.join(tmp_dir, 'ftp_settings.yaml')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'ftp': dict({
+            'host': '127.0.0.1', 'port': port, 'user': 'ftpuser', 'password': 'securePassword',
+            'base_path': '/mnt/ssd4tb/ftp_server', 'namespace': 'ip_loans',
+        }, **extra)}, f)
+    return config_path
+
+def test_sftp_transfer():
+    """Тестирование передачи на SFTP-заглушку, в том числе докачки .part"""
+    print("\n=== Тестирование SFTP ===")
+
+    import time
+    import socket
+    import tempfile
+    from stubs.sftp_server import LocalSFTPServer
+    from modules.ftp_client import send_file_to_ftp, close_sftp_sessions, retry_delay
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            LocalSFTPServer(os.path.join(tmp_dir, 'sftp')) as server:
+        config_path = _write_ftp_settings(tmp_dir, server.port, retry_delay=0.05)
+        local_path = os.path.join(tmp_dir, 'выгрузка_20250730_VALB.json')
+        payload = os.urandom(300000)
+        with open(local_path, 'wb') as f:
+            f.write(payload)
+
+        remote_path = send_file_to_ftp(local_path, config_path=config_path)
+        stored = os.path.join(server.root, remote_path.lstrip('/'))
+        with open(stored, 'rb') as f:
+            assert f.read() == payload
+        assert not os.path.exists(stored + '.part')
+
+        # Прерванная передача: на сервере осталась первая половина файла
+        os.remove(stored)
+        with open(stored + '.part', 'wb') as f:
+            f.write(payload[:150000])
+        server.drop_connections()
+        send_file_to_ftp(local_path, config_path=config_path)
+        with open(stored, 'rb') as f:
+            assert f.read() == payload
+        close_sftp_sessions()
+
+        # Недоступный хост: между попытками растущая пауза, после последней — нет
+        cfg = {'retry_delay': 0.1, 'max_retry_delay': 0.3}
+        assert [retry_delay(cfg, attempt) for attempt in (1, 2, 3)] == [0.1, 0.2, 0.3]
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            closed_port = sock.getsockname()[1]
+        os.makedirs(os.path.join(tmp_dir, 'down'))
+        down_path = _write_ftp_settings(os.path.join(tmp_dir, 'down'), closed_port, retries=3, **cfg)
+        started = time.monotonic()
+        try:
+            send_file_to_ftp(local_path, config_path=down_path)
+            failed = False
+        except Exception:
+            failed = True
+        assert failed and 0.3 <= time.monotonic() - started < 1.5
+        print("✅ Передача, докачка и паузы между попытками на SFTP работают")
+
+def test_ack_watcher():
+    """Тестирование ожидания квитанций 1С сразу для нескольких файлов"""
+    print("\n=== Тестирование квитанций 1С ===")
+
+    import tempfile
+    import threading
+    from stubs.sftp_server import LocalSFTPServer
+    from modules.ftp_client import AckWatcher, close_sftp_sessions
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            LocalSFTPServer(os.path.join(tmp_dir, 'sftp')) as server:
+        config_path = _write_ftp_settings(tmp_dir, server.port)
+        remote_dir = os.path.join(server.root, 'mnt/ssd4tb/ftp_server/ip_loans')
+        os.makedirs(remote_dir)
+        names = ['выгрузка_20250730_VALB.json', 'выгрузка_20250730_OZON.json', 'выгрузка_20250730_LOST.json']
+
+        def answer_1c():
+            open(os.path.join(remote_dir, names[0] + '.ok'), 'w').close()
+            with open(os.path.join(remote_dir, names[1] + '.err'), 'w', encoding='utf-8') as f:
+                f.write('Неверная структура файла')
+
+        watcher = AckWatcher(config_path=config_path, timeout=1.5, poll_interval=0.4,
+                             min_poll_interval=0.1).start()
+        for name in names:
+            watcher.add('/mnt/ssd4tb/ftp_server/ip_loans/' + name)
+        threading.Timer(0.3, answer_1c).start()
+        results = watcher.finish()
+        close_sftp_sessions()
+
+        statuses = [results['/mnt/ssd4tb/ftp_server/ip_loans/' + name][0] for name in names]
+        assert statuses == ['success', 'fail', 'timeout'], statuses
+        assert 'Неверная структура' in results['/mnt/ssd4tb/ftp_server/ip_loans/' + names[1]][1]
+        print("✅ Квитанции .ok/.err/таймаут разрешаются независимо")
+
+def test_creditor_split():
+    """Тестирование разбиения суточной агрегации по кредиторам"""
+    print("\n=== Тестирование выгрузок по кредиторам ===")
+
+    import tempfile
+    from modules import aggregate_exports
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exports_dir, aggregate_exports.EXPORTS_DIR = aggregate_exports.EXPORTS_DIR, tmp_dir
+        try:
+            records = [
+                {"number_ip": "12345678901", "date": "30.07.2025", "creditor": "VALB"},
+                {"number_ip": "98765432109", "date": "30.07.2025", "creditor": "OZON"},
+                {"number_ip": "12345678901", "date": "30.07.2025", "creditor": "VALB"},
+            ]
+            with open(os.path.join(tmp_dir, 'export_20250730_101010.json'), 'w', encoding='utf-8') as f:
+                json.dump(records, f)
+            partitions = aggregate_exports.aggregate_jsons_by_creditor('20250730')
+            paths = aggregate_exports.save_creditor_aggregates(partitions, '20250730')
+            # Повторная агрегация не должна подхватывать собственные итоговые файлы
+            assert aggregate_exports.aggregate_jsons_by_creditor('20250730') == partitions
+        finally:
+            aggregate_exports.EXPORTS_DIR = exports_dir
+
+    assert {c: len(docs) for c, docs in partitions.items()} == {"VALB": 1, "OZON": 1}
+    assert os.path.basename(paths["VALB"]) == "выгрузка_20250730_VALB.json"
+    print("✅ Записи разложены по кредиторам")
+
+def test_ocr_cache():
+    """Тестирование кэша OCR: повторный скан не уходит в Tesseract"""
+    print("\n=== Тестирование кэша OCR ===")
+
+    import tempfile
+    from PIL import Image
+    from modules.ocr_engine import (OCR_SETTINGS_DEFAULT, rasterize_page, page_hash,
+                                    cache_put, ocr_files)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scan_path = os.path.join(tmp_dir, 'паспорт.png')
+        Image.new('RGB', (200, 100), 'white').save(scan_path)
+        settings = dict(OCR_SETTINGS_DEFAULT, cache_dir=os.path.join(tmp_dir, 'cache'), workers=1)
+
+        page = rasterize_page(scan_path, 'png', 0, settings['dpi'])
+        digest = page_hash(page, settings)
+        cache_put(settings['cache_dir'], digest, settings['lang'], 'Иванов Иван Иванович')
+        texts, errors = ocr_files([(scan_path, 'png')], settings)
+        # Другая предобработка — другой ключ кэша
+        assert page_hash(page, dict(settings, deskew=not settings['deskew'])) != digest
+        assert page_hash(page, dict(settings, max_skew_angle=10.0)) != digest
+
+    assert not errors, errors
+    assert texts[scan_path] == 'Иванов Иван Иванович'
+    print("✅ Текст страницы взят из кэша по хэшу растра")
+
+def test_config_snapshot():
+    """Тестирование снимка конфигов: изменённый файл перечитывается"""
+    print("\n=== Тестирование снимка конфигов ===")
+
+    import pickle
+    import tempfile
+    from modules.config import load_configs, load_config_file
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, 'snapshot.pickle')
+        configs = load_configs(snapshot_path=snapshot_path)
+        assert os.path.exists(snapshot_path)
+        # Оценки шаблонов regex_guard сохраняются вместе с конфигами
+        with open(snapshot_path, 'rb') as f:
+            profiles = pickle.load(f)['regex_profiles']
+        fio = configs['patterns']['validators']['fio']
+        assert profiles[(fio.pattern, fio.flags)] == {'slow': False, 'reason': ''}
+        assert configs['formats.csv'][0]['extension'] == 'xlsx'
+        assert configs['patterns']['validators']['fio'].search('Иванов Иван Иванович')
+        assert load_configs(snapshot_path=snapshot_path)['formats.csv'] is configs['formats.csv']
+
+        path = os.path.join(tmp_dir, 'formats.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('extension,priority\npdf,1\n')
+        assert load_config_file(path, snapshot_path)[0]['extension'] == 'pdf'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('extension,priority\ndoc,1\n')
+        assert load_config_file(path, snapshot_path)[0]['extension'] == 'doc'
+    print("✅ Конфиги берутся из снимка, изменения файлов подхватываются")
+
+def test_startup_imports():
+    """Тестирование старта: import main не тянет тяжёлые зависимости этапов"""
+    print("\n=== Тестирование времени старта ===")
+
+    from benchmarks.bench_startup import import_profile, heavy_imports
+
+    elapsed, modules, code = import_profile(['-c', 'import main'])
+    assert code == 0
+    assert 'main' in modules
+    heavy = heavy_imports(modules)
+    assert not heavy, f"При старте загружены: {heavy}"
+    # Запас на медленные машины; сейчас импорт main занимает ~30 мс
+    assert modules['main'][1] < 500_000, f"import main: {modules['main'][1] / 1000:.0f} мс"
+    print(f"✅ import main: {modules['main'][1] / 1000:.0f} мс, процесс целиком {elapsed:.2f} с")
+
+def test_synthetic_corpus():
+    """Тестирование генератора корпуса и прогона этапов бенчмарка"""
+    print("\n=== Тестирование синтетического корпуса ===")
+
+    import tempfile
+    from benchmarks.corpus import generate_corpus
+    from benchmarks.bench_stages import run_all
+
+    params = dict(creditors=1, contracts=1, rows=5, pdf_pages=1, emails=1, exports=2, export_records=10)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        first = generate_corpus(os.path.join(tmp_dir, 'a'), **params)
+        second = generate_corpus(os.path.join(tmp_dir, 'b'), **params)
+        assert first['fingerprint'] == second['fingerprint']
+
+        results = run_all(os.path.join(tmp_dir, 'a'), ['unpack_archives', 'collect_files', 'aggregate_jsons'])
+    assert results['unpack_archives']['files'] == first['archive_files']
+    assert results['collect_files']['files'] == first['share_files']
+    assert results['aggregate_jsons']['files'] == 2
+    print(f"✅ Корпус детерминирован, этапы отработали: {sorted(results)}")
+
+def test_metrics():
+    """Тестирование метрик: таймер этапа, гистограмма задержек, .prom-файл"""
+    print("\n=== Тестирование метрик ===")
+
+    import time
+    import tempfile
+    from modules import metrics
+
+    metrics.reset()
+    with metrics.stage_timer("parser"):
+        for delay in (0.001, 0.002, 0.3):
+            metrics.observe("parse", delay)
+        time.sleep(0.01)
+
+    summary = metrics.snapshot()
+    assert summary['stages']['parser']['seconds'] >= 0.01
+    assert summary['latency']['parse']['count'] == 3
+    assert summary['latency']['parse']['p50'] == 0.01
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = metrics.write_prometheus(os.path.join(tmp_dir, 'ip_processor.prom'), exit_code=0)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    assert 'ip_processor_stage_duration_seconds{stage="parser"}' in text
+    assert 'ip_processor_file_latency_seconds_bucket{op="parse",le="0.25"} 2' in text
+    assert 'ip_processor_file_latency_seconds_bucket{op="parse",le="+Inf"} 3' in text
+    assert 'ip_processor_last_run_exit_code 0' in text
+    metrics.reset()
+    print("✅ Метрики этапа и гистограммы выгружаются в формате Prometheus")
+
+def test_profiler():
+    """Тестирование профилирования этапов: pstats, свёрнутые стеки, топ выделений памяти"""
+    print("\n=== Тестирование профилирования ===")
+
+    import tempfile
+    from modules import metrics, profiler
+
+    assert profiler.parse_stages('') == set(profiler.DEFAULT_PROFILE_STAGES)
+    assert profiler.parse_stages('process_files,aggregate') == {'parser', 'aggregate'}
+    assert profiler.parse_stages('all') is None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run = profiler.start_run({'parser'}, memory=True, root=tmp_dir)
+        try:
+            with metrics.stage_timer("parser"):
+                rows = [str(i) * 10 for i in range(20000)]
+            with metrics.stage_timer("exporter"):
+                pass
+        finally:
+            artifacts = profiler.finish_run()
+        metrics.reset()
+
+        assert set(artifacts) == {'parser'}
+        for path in artifacts['parser'].values():
+            assert os.path.exists(path), path
+        with open(artifacts['parser']['memory'], encoding='utf-8') as f:
+            assert 'test_system.py' in f.read()
+        assert os.listdir(run.dir)
+    assert len(rows) == 20000
+    print("✅ Выбранный этап профилируется, артефакты записаны")
+
+def test_parsed_records():
+    """Тестирование компактных записей парсера: интерфейс словаря, интернирование, JSON"""
+    print("\n=== Тестирование записей парсера ===")
+
+    import json
+    import sys
+    from modules.records import ParsedRecord, as_dict
+
+    values = {'date': '01.02.2024', 'number_ip': '1234567890', 'fio': '',
+              'file': os.path.join('data', 'in', 'VALB', 'doc.pdf'), 'creditor': ''.join('VALB')}
+    record = ParsedRecord(values)
+    assert record == values and dict(record) == values and list(record) == list(values)
+    assert record.get('ext') is None and 'ocr_required' not in record
+    assert record['creditor'] is sys.intern('VALB')
+
+    copy = record.copy()
+    copy['fio'] = 'Петров Петр Петрович'
+    copy['confidence'] = 0.9
+    assert record['fio'] == '' and copy['confidence'] == 0.9
+    assert json.loads(json.dumps([copy], default=as_dict)) == [dict(values, fio='Петров Петр Петрович', confidence=0.9)]
+    assert not hasattr(record, '__dict__')
+    print("✅ Записи компактны и выгружаются в JSON как словари")
+
+def test_leases():
+    """Тестирование аренд на общей папке: исключительность, перехват истёкшей, шардирование"""
+    print("\n=== Тестирование аренд ===")
+
+    import time
+    import tempfile
+    from modules.leases import LeaseManager, ShardCoordinator, LEASE_SETTINGS_DEFAULT, unit_roots, work_unit
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lease_dir = os.path.join(tmp_dir, 'leases')
+        host_a = LeaseManager(lease_dir, 'host-a', ttl=0.2, clock_skew=0)
+        host_b = LeaseManager(lease_dir, 'host-b', ttl=0.2, clock_skew=0)
+        assert host_a.acquire('VALB/1001')
+        assert not host_b.acquire('VALB/1001')
+        # host-a «упал»: аренда не продлевается и истекает
+        time.sleep(0.3)
+        assert host_b.acquire('VALB/1001')
+        assert host_a.renew() == ['VALB/1001'] and 'VALB/1001' not in host_a.held
+        host_b.release('VALB/1001')
+        assert not os.listdir(lease_dir)
+
+        # Договоры лежат в пуле под ссылкой creditors_to_process.csv, как на шаре
+        registry = os.path.join(tmp_dir, 'сеть', 'юристы', '5МК ВБ Финанс', 'Реестры')
+        pool = os.path.join(registry, '!ОБЩИЙ ПУЛ ВБ')
+        creditor_dirs = unit_roots({'creditors_to_process.csv': [
+                                        {'creditor': 'VALB', 'link': registry, 'status': 'К обработке'}],
+                                    'paths.json': {'VALB': pool + os.sep}})
+        assert creditor_dirs == {'VALB': [registry, pool + os.sep]}
+        files = [{'creditor': 'VALB', 'file': os.path.join(pool, str(contract), f'doc{i}.pdf'), 'ext': 'pdf'}
+                 for contract in range(32404294000, 32404294004) for i in range(2)]
+        assert work_unit(files[0], creditor_dirs) == 'VALB/32404294000'
+        assert work_unit(files[2], creditor_dirs) == 'VALB/32404294001'
+        settings = dict(LEASE_SETTINGS_DEFAULT, lease_dir=lease_dir, max_units=2)
+        first = ShardCoordinator(settings, creditor_dirs, LeaseManager(lease_dir, 'host-a'))
+        second = ShardCoordinator(settings, creditor_dirs, LeaseManager(lease_dir, 'host-b'))
+        claimed_a = first.claim(files)
+        claimed_b = second.claim(files)
+        paths_a = {f['file'] for f in claimed_a}
+        paths_b = {f['file'] for f in claimed_b}
+        assert len(paths_a) == len(paths_b) == 4 and not paths_a & paths_b
+
+        first.complete(paths_a)
+        second.complete(paths_b)
+        first.close()
+        second.close()
+        third = ShardCoordinator(settings, creditor_dirs, LeaseManager(lease_dir, 'host-c'))
+        assert third.claim(files) == []
+        third.close()
+    print("✅ Единицы работы не пересекаются, истёкшие аренды перехватываются")
+
+def test_telegram_dispatcher():
+    """Тестирование очереди уведомлений: неблокирующая отправка, 429, сводки"""
+    print("\n=== Тестирование уведомлений Telegram ===")
+
+    import time
+    from modules import telegram_notifier
+    from stubs.telegram_server import LocalTelegramServer
+
+    with LocalTelegramServer(latency=0.05, rate_limited=1, retry_after=0) as server:
+        configs = {'telegram_settings.yaml': {
+            'enabled': True, 'api_url': server.url, 'token': 'test', 'chat_id': 1,
+            'rate': 50, 'burst': 2, 'backoff': 0.01, 'digest_interval': 60}}
+        telegram_notifier.start_dispatcher(configs)
+        try:
+            started = time.perf_counter()
+            telegram_notifier.send_notification("Выгрузка завершена успешно!")
+            for i in range(5):
+                telegram_notifier.send_notification(f"Ошибка передачи файла {i}", error="timeout",
+                                                    creditor="VALB", stage="ftp_send")
+            telegram_notifier.send_notification("Файл не распознан", creditor="OZON", stage="parser", digest=True)
+            # Вызывающий не ждёт HTTP-запросов
+            assert time.perf_counter() - started < 0.05
+        finally:
+            stats = telegram_notifier.stop_dispatcher(timeout=5)
+
+    texts = [message['text'] for message in server.messages]
+    assert stats['sent'] == 3 and stats['coalesced'] == 5 and stats['failed'] == 0, stats
+    assert server.requests == 4
+    assert texts[0] == "Выгрузка завершена успешно!"
+    assert texts[1].startswith("Ошибка передачи файла 0")
+    assert "VALB / ftp_send: 4" in texts[2] and "OZON / parser: 1" in texts[2]
+    print("✅ Уведомления отправляются в фоне, повторы собраны в сводку")
+
+def test_journal_index():
+    """Тестирование индекса журналов: запросы, инкрементальное обновление, пересборка"""
+    print("\n=== Тестирование индекса журналов ===")
+
+    import json
+    import tempfile
+    from modules import journal_index
+
+    def write(path, entries, mode='a'):
+        with open(path, mode, encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        process_log = os.path.join(log_dir, 'process_log.json')
+        write(process_log, [
+            {'datetime': '2024-01-15 10:00:00', 'stage': 'excel_processor', 'status': 'ok', 'contract': '1001'},
+            {'datetime': '2024-01-15 10:01:00', 'stage': 'parser', 'status': 'ok',
+             'file': 'share/VALB/1001/договор.pdf', 'creditor': 'VALB'},
+            {'datetime': '2024-01-15 10:02:00', 'stage': 'parser', 'status': 'ok',
+             'file': 'share/VALB/1002/договор.pdf', 'creditor': 'VALB'},
+        ])
+        write(os.path.join(log_dir, 'error_log.json'), [
+            {'datetime': '2024-01-15 10:03:00', 'stage': 'parser', 'file': 'share/VALB/1001/скан.jpg',
+             'error_msg': 'Empty text'},
+        ])
+
+        rows = journal_index.query(log_dir=log_dir, contract='1001')
+        assert [(journal, entry['stage']) for journal, entry in rows] == [
+            ('process', 'excel_processor'), ('process', 'parser'), ('error', 'parser')]
+        since = journal_index.parse_since('2024-01-15 10:01:30')
+        assert len(journal_index.query(log_dir=log_dir, stage='parser', since=since)) == 2
+
+        # Дописанная строка индексируется без повторного разбора старых
+        write(process_log, [{'datetime': '2024-01-15 10:05:00', 'stage': 'exporter', 'status': 'ok'}])
+        assert journal_index.update_indexes(log_dir) == {'process': 1, 'error': 0}
+        assert journal_index.query(('process',), log_dir, stage='exporter')[0][1]['status'] == 'ok'
+
+        # Журнал заменён — индекс строится заново
+        write(process_log, [{'datetime': '2024-01-16 09:00:00', 'stage': 'parser', 'status': 'error'}], mode='w')
+        rows = journal_index.query(('process',), log_dir, stage='parser')
+        assert [entry['status'] for _, entry in rows] == ['error']
+    print("✅ Индекс журналов находит события и обновляется инкрементально")
+
+def test_attachment_store():
+    """Тестирование хранилища вложений: жёсткие ссылки, same_as, пропуск повторов"""
+    print("\n=== Тестирование хранилища вложений ===")
+
+    import shutil
+    import zipfile
+    import tempfile
+    from email.message import EmailMessage
+    from modules.attachment_store import AttachmentStore
+    from modules.mail_parser import process_email
+    from modules.archive_handler import unpack_archives
+    from modules.filewalker import collect_files
+
+    def message(payload):
+        msg = EmailMessage()
+        msg['Subject'] = 'Реестр'
+        msg.set_content('Реестр во вложении')
+        msg.add_attachment(payload, maintype='application', subtype='pdf', filename='реестр.pdf')
+        return msg
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        os.makedirs('logs')
+        try:
+            store = AttachmentStore('store')
+            process_email(message(b'%PDF-1.4 registry'), 'VALB', 'VALB', 'Реестр', store=store)
+            process_email(message(b'%PDF-1.4 registry'), 'VALB', 'VALB', 'Реестр', store=store)
+            base = os.path.join('сеть', 'asf01', 'files', 'юристы', 'VALB', 'Реестры')
+            first, second = (os.path.join(base, name, 'реестр.pdf') for name in sorted(os.listdir(base)))
+            assert os.stat(first).st_ino == os.stat(second).st_ino
+            # Объект общий для всех сессий — только для чтения
+            assert os.stat(first).st_mode & 0o777 == 0o444
+            with open(os.path.join(os.path.dirname(second), 'meta.json'), encoding='utf-8') as f:
+                assert json.load(f)[0]['same_as'] == first
+
+            configs = {'creditors_to_process.csv': [{'creditor': 'VALB', 'link': base, 'status': 'к обработке'}],
+                       'formats.csv': [{'extension': 'pdf'}]}
+            assert [f['file'] for f in collect_files(configs)] == [first]
+
+            os.makedirs('incoming')
+            with zipfile.ZipFile(os.path.join('incoming', 'VALB_1.zip'), 'w') as zf:
+                zf.writestr('1001/договор.pdf', b'%PDF-1.4 contract')
+            assert len(unpack_archives('incoming', 'data/in', store=store)) == 1
+            shutil.copy(os.path.join('incoming', 'VALB_1.zip'), os.path.join('incoming', 'VALB_2.zip'))
+            assert unpack_archives('incoming', 'data/in', store=store) == []
+        finally:
+            os.chdir(cwd)
+    print("✅ Повторные вложения хранятся один раз и не обрабатываются повторно")
+
+def test_scheduler():
+    """Тестирование планировщика: приоритет форматов, справедливость, ограничения запуска"""
+    print("\n=== Тестирование планировщика очереди ===")
+
+    import time
+    import tempfile
+    from modules.scheduler import schedule_files
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def make(creditor, name, priority, size=100, age_hours=0):
+            path = os.path.join(tmp_dir, f"{creditor}_{name}")
+            with open(path, 'wb') as f:
+                f.write(b'0' * size)
+            mtime = time.time() - age_hours * 3600
+            os.utime(path, (mtime, mtime))
+            return {'creditor': creditor, 'file': path, 'priority': priority}
+
+        # Сканы одного кредитора не задерживают реестр другого
+        scans = [make('BIG', f"scan{i}.pdf", 3, size=1000 + i) for i in range(10)]
+        registry = make('SMALL', 'registry.xlsx', 1)
+        ordered, deferred = schedule_files(scans + [registry], {})
+        assert ordered[0] is registry and not deferred
+
+        # В окне кредитор занимает не больше своей доли
+        configs = {'scheduler_settings.yaml': {'fairness_window': 4, 'max_share': 0.5}}
+        big = [make('BIG', f"reg{i}.xlsx", 1) for i in range(10)]
+        small = [make('SMALL', f"reg{i}.xlsx", 1) for i in range(2)]
+        ordered, _ = schedule_files(big + small, configs)
+        assert [f['creditor'] for f in ordered[:4]].count('SMALL') == 2
+        assert len(ordered) == 12
+
+        # Долго ждущий файл поднимается в приоритете
+        old_scan = make('BIG', 'old.pdf', 3, age_hours=80)
+        fresh = make('SMALL', 'fresh.xlsx', 1)
+        ordered, _ = schedule_files([fresh, old_scan], {})
+        assert ordered[0] is old_scan
+
+        # Ограничение запуска: остальное откладывается
+        configs = {'scheduler_settings.yaml': {'max_files_per_run': 3}}
+        ordered, deferred = schedule_files(scans + [registry], configs)
+        assert len(ordered) == 3 and len(deferred) == 8 and ordered[0] is registry
+    print("✅ Очередь упорядочена по приоритету с долями кредиторов")
+
+def test_retry_queue():
+    """Тестирование очереди повторов: классификация ошибок, backoff, исчерпание попыток"""
+    print("\n=== Тестирование очереди повторов ===")
+
+    import errno
+    import tempfile
+    from modules import parser
+    from modules.retry_queue import classify_error, open_retry_queue
+
+    assert classify_error(TimeoutError("read timed out")) == 'transient'
+    assert classify_error(OSError(errno.EBUSY, "busy")) == 'transient'
+    assert classify_error(FileNotFoundError(errno.ENOENT, "missing")) == 'permanent'
+    assert classify_error("Empty text") == 'permanent'
+    assert classify_error("TimeoutExpired: tesseract") == 'transient'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        configs = {'retry_settings.yaml': {'queue_path': os.path.join(tmp_dir, 'retry.json'),
+                                           'base_delay': 0.05, 'max_wait_in_run': 5}}
+        flaky = os.path.join(tmp_dir, 'flaky.txt')
+        broken = os.path.join(tmp_dir, 'broken.txt')
+        empty = os.path.join(tmp_dir, 'empty.txt')
+        for path, text in ((flaky, 'Петров Петр Петрович'), (broken, 'x'), (empty, '')):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+
+        calls = {}
+        original = parser.extract_text
+
+        def extract_text(file_path, ext):
+            calls[file_path] = calls.get(file_path, 0) + 1
+            if file_path == broken or (file_path == flaky and calls[file_path] < 4):
+                raise TimeoutError("share read timed out")
+            return original(file_path, ext)
+
+        parser.extract_text = extract_text
+        try:
+            queue = open_retry_queue(configs)
+            files = [{'file': path, 'creditor': 'VALB', 'ext': 'txt'} for path in (flaky, broken, empty)]
+            parsed = parser.process_files(files, configs, queue)
+        finally:
+            parser.extract_text = original
+
+        # Временный сбой повторён в том же запуске, постоянная ошибка — нет
+        assert [doc['file'] for doc in parsed] == [flaky]
+        # Первая попытка и три повтора
+        assert calls[flaky] == 4 and calls[broken] == 4 and calls.get(empty) == 1
+        queue = open_retry_queue(configs)
+        assert flaky not in queue.entries
+        assert queue.entries[broken]['state'] == 'failed' and queue.entries[broken]['attempts'] == 4
+        assert queue.entries[empty]['error_class'] == 'permanent'
+        assert queue.filter(files) == [files[0]]
+
+        # Изменённый файл снова берётся в работу
+        with open(broken, 'a', encoding='utf-8') as f:
+            f.write('y')
+        assert [f['file'] for f in queue.filter(files)] == [flaky, broken]
+
+        # Запись на диск — раз на пачку; удалённые и давно не разобранные файлы забываются
+        queue.record_failure(files[1], "Empty text")
+        assert broken not in open_retry_queue(configs).entries
+        queue.entries[broken]['failed_at'] -= 31 * 86400
+        queue.save()
+        os.remove(empty)
+        assert open_retry_queue(configs).entries == {}
+    print("✅ Временные сбои повторяются с паузой, постоянные — нет")
+
+def test_columnar_store():
+    """Тестирование столбцовых пачек: запись без потерь, агрегация по столбцам"""
+    print("\n=== Тестирование столбцовых пачек выгрузок ===")
+
+    import tempfile
+    from modules import aggregate_exports
+    from modules.columnar import write_batch, open_export, BatchReader
+    from modules.records import ParsedRecord
+
+    records = [
+        ParsedRecord(date="30.07.2025", number_ip="12345678901", fio="Петров Петр Петрович",
+                     file="a.pdf", creditor="VALB", ext="pdf", ocr_required=True, ocr_pages=[0, 2]),
+        {"number_ip": "98765432109", "date": "30.07.2025", "creditor": "OZON", "amount": 1500.5},
+        {"number_ip": None, "date": "30.07.2025", "creditor": ""},
+        {"number_ip": "12345678901", "date": "30.07.2025", "creditor": "VALB", "fio": "повтор"},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exports_dir, aggregate_exports.EXPORTS_DIR = aggregate_exports.EXPORTS_DIR, tmp_dir
+        try:
+            first = os.path.join(tmp_dir, 'export_20250730_101010.json')
+            second = os.path.join(tmp_dir, 'export_20250730_111111.json')
+            with open(first, 'w', encoding='utf-8') as f:
+                json.dump([dict(r) for r in records], f, ensure_ascii=False)
+            expected = aggregate_exports.aggregate_jsons_by_creditor('20250730')
+
+            # Пачка по столбцам читается в те же записи, что и JSON
+            batch = BatchReader(write_batch(records, first))
+            assert batch.records() == [dict(r) for r in records]
+            assert batch.column('amount')[1] == 1500.5
+            batch.close()
+            assert aggregate_exports.aggregate_jsons_by_creditor('20250730') == expected
+            assert {c: len(d) for c, d in expected.items()} == {"VALB": 1, "OZON": 1, "UNKNOWN": 1}
+            stats = aggregate_exports.daily_stats('20250730')
+            assert stats['duplicates'] == 1 and stats['by_creditor']['VALB'] == {'records': 2, 'unique': 1}
+
+            # Выгрузка без пачки (старая) агрегируется вместе с пачками
+            with open(second, 'w', encoding='utf-8') as f:
+                json.dump([{"number_ip": "555", "date": "31.07.2025", "creditor": "OZON"}], f)
+            assert type(open_export(second)).__name__ == 'JsonBatch'
+            partitions = aggregate_exports.aggregate_jsons_by_creditor('20250730')
+            assert len(partitions["OZON"]) == 2
+        finally:
+            aggregate_exports.EXPORTS_DIR = exports_dir
+    print("✅ Агрегация по столбцовым пачкам совпадает с JSON")
+
+def test_docx_parsing():
+    """Тестирование DOCX: потоковое чтение абзацев и ячеек, поля договора"""
+    print("\n=== Тестирование разбора DOCX ===")
+
+    import tempfile
+    import docx
+    from modules.parser import iter_docx_blocks, parse_file
+    from benchmarks.bench_docx import make_docx, python_docx_blocks
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'договор.docx')
+        document = docx.Document()
+        document.add_paragraph('Договор займа от 15.03.2024')
+        run = document.add_paragraph('Заёмщик:').add_run()
+        run.add_tab()
+        run.add_text('Петров Петр Петрович')
+        table = document.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = 'Номер ИП'
+        table.cell(0, 1).text = '1234567890'
+        document.save(path)
+
+        assert list(iter_docx_blocks(path)) == ['Договор займа от 15.03.2024', 'Заёмщик:\tПетров Петр Петрович',
+                                                'Номер ИП', '1234567890']
+        doc = parse_file({'file': path, 'creditor': 'VALB', 'ext': 'docx'}, {})
+        assert (doc['date'], doc['number_ip'], doc['fio']) == ('15.03.2024', '1234567890', 'Петров Петр Петрович')
+
+        # Тот же текст, что у python-docx, на документе с таблицей
+        big = os.path.join(tmp_dir, 'большой.docx')
+        make_docx(big, 200, 50)
+        assert sorted(iter_docx_blocks(big)) == sorted(python_docx_blocks(big))
+    print("✅ DOCX разбирается потоково, поля найдены в абзацах и таблицах")
+
+def test_pdf_pages():
+    """Тестирование постраничного PDF: ранний выход, лимит max_pages, страницы без текста — в OCR"""
+    print("\n=== Тестирование постраничного разбора PDF ===")
+
+    import types
+    import tempfile
+    from modules.parser import parse_file
+
+    opened = []
+
+    class FakePage:
+        def __init__(self, index, text):
+            self.index, self.text = index, text
+
+        def extract_text(self):
+            opened.append(self.index)
+            return self.text
+
+        def flush_cache(self):
+            pass
+
+    class FakePDF:
+        def __init__(self, texts):
+            self.pages = [FakePage(index, text) for index, text in enumerate(texts)]
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    documents = {}
+    stub = types.ModuleType('pdfplumber')
+    stub.open = lambda path: FakePDF(documents[os.path.basename(path)])
+    with open('config/document_types.yaml', 'r', encoding='utf-8') as f:
+        configs = {'document_types.yaml': yaml.safe_load(f)}
+    # Сканы без текстового слоя и страница, которую читать уже не нужно
+    documents['договор.pdf'] = ['', 'Договор займа от 15.03.2024, номер ИП 1234567890',
+                                'Заёмщик: Петров Петр Петрович', 'Приложение 1 к договору займа']
+    documents['паспорт.pdf'] = ['', 'Паспорт гражданина: Иванов Иван Иванович', '',
+                                'Выдан 01.02.2010 отделом УФМС России']
+
+    saved = sys.modules.get('pdfplumber')
+    sys.modules['pdfplumber'] = stub
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in documents:
+                open(os.path.join(tmp_dir, name), 'wb').close()
+
+            doc = parse_file({'file': os.path.join(tmp_dir, 'договор.pdf'), 'creditor': 'VALB', 'ext': 'pdf'}, configs)
+            assert opened == [0, 1, 2]
+            assert (doc['date'], doc['number_ip'], doc['fio']) == ('15.03.2024', '1234567890', 'Петров Петр Петрович')
+            assert not doc.get('ocr_required') and 'excerpt' not in doc
+
+            # У паспорта max_pages: 3 — четвёртая страница не открывается, сканы идут в OCR
+            del opened[:]
+            doc = parse_file({'file': os.path.join(tmp_dir, 'паспорт.pdf'), 'creditor': 'VALB', 'ext': 'pdf'}, configs)
+            assert opened == [0, 1, 2]
+            assert doc['fio'] == 'Иванов Иван Иванович' and not doc['date']
+            assert doc['ocr_required'] and doc['ocr_pages'] == [0, 2]
+            # Поля найдены не все — для AI едет отрывок текстового слоя
+            assert doc['excerpt'] == 'Паспорт гражданина: Иванов Иван Иванович'
+    finally:
+        if saved is None:
+            del sys.modules['pdfplumber']
+        else:
+            sys.modules['pdfplumber'] = saved
+    print("✅ Страницы после раннего выхода и лимита не читаются, сканы уходят в OCR")
+
+def test_ai_client():
+    """Тестирование AI-клиента на заглушке: пачки, кэш повторных записей, ошибки и пустые ответы"""
+    print("\n=== Тестирование AI-клиента ===")
+
+    import tempfile
+    from stubs.ai_server import LocalAIServer, FAKE_VALUES
+    from modules.ai_client import analyze_with_ai, build_prompt, prompt_key
+
+    def record(number, fio=''):
+        return {'date': '', 'number_ip': number, 'fio': fio, 'creditor': 'VALB',
+                'file': f'сеть/asf01/files/юристы/VALB/{number}/договор.pdf',
+                'excerpt': f'Договор займа № {number}, заёмщик Иванов Иван Иванович, от 01.01.2024'}
+
+    def without_excerpt(docs):
+        return [{key: value for key, value in doc.items() if key != 'excerpt'} for doc in docs]
+
+    # Отрывок текста — часть запроса и ключа кэша
+    prompt = build_prompt(record('10000000001'), ['fio'])
+    assert prompt['text'].startswith('Договор займа') and 'excerpt' not in prompt['known']
+    assert prompt_key(prompt, 'm') != prompt_key(build_prompt(dict(record('10000000001'), excerpt='Скан'), ['fio']), 'm')
+
+    records = [record(str(10**10 + i)) for i in range(5)]
+    records.append(dict(records[0]))
+    records.append(dict(record('10000000099', 'Петров Петр Петрович'), date='01.02.2024'))
+    # Без текста документа модели угадывать нечего — в AI не уходит
+    records.append({key: value for key, value in record('10000000098').items() if key != 'excerpt'})
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with LocalAIServer() as server:
+            configs = {'ai_settings.yaml': {'enabled': True, 'endpoint': server.url, 'batch_size': 2,
+                                            'concurrency': 2, 'timeout': 10, 'cache_dir': cache_dir}}
+            results = analyze_with_ai(records, configs)
+            # Полная запись в AI не уходит, повтор отправляется один раз; 5 запросов по 2 — 3 пачки
+            assert (server.requests, server.items) == (3, 5)
+            assert all(doc['date'] == FAKE_VALUES['date'] and doc['fio'] == FAKE_VALUES['fio'] for doc in results[:6])
+            assert results[6:] == without_excerpt(records[6:]) and not results[7]['fio']
+            # Отрывок в выгрузку не попадает
+            assert all('excerpt' not in doc for doc in results)
+
+            assert analyze_with_ai(records, configs) == results
+            assert server.requests == 3
+
+        # Ошибка пачки: запись не меняется и не кэшируется, следующий запуск спрашивает заново
+        fresh = [record('20000000001')]
+        with LocalAIServer(fail_requests=1) as server:
+            configs['ai_settings.yaml']['endpoint'] = server.url
+            assert analyze_with_ai(fresh, configs) == without_excerpt(fresh)
+            assert analyze_with_ai(fresh, configs)[0]['fio'] == FAKE_VALUES['fio']
+            assert server.requests == 2
+
+        # Пустой ответ в кэш не попадает
+        empty = [dict(record('30000000001'), file='сеть/asf01/files/юристы/VALB/скан.pdf')]
+        with LocalAIServer(empty_files={'скан.pdf'}) as server:
+            configs['ai_settings.yaml']['endpoint'] = server.url
+            assert analyze_with_ai(empty, configs) == without_excerpt(empty)
+            assert analyze_with_ai(empty, configs) == without_excerpt(empty)
+            assert server.requests == 2
+
+        # AI выключен — отрывок всё равно убирается
+        assert analyze_with_ai(fresh, {}) == without_excerpt(fresh)
+    print("✅ Пачки, кэш и обработка ошибок AI-клиента работают")
+
+def test_delta_exports():
+    """Тестирование разностных выгрузок: added/changed/removed относительно принятого 1С"""
+    print("\n=== Тестирование разностных выгрузок ===")
+
+    import tempfile
+    from modules.delta_export import prepare_deliveries, commit_delivery, DeltaState
+
+    def record(contract, number_ip, fio='Петров Петр Петрович'):
+        return {'number_ip': number_ip, 'date': '30.07.2025', 'fio': fio, 'creditor': 'VALB',
+                'file': f'сеть/asf01/files/юристы/VALB/{contract}/реестр.xlsx'}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        configs = {'delta_settings.yaml': {'enabled': True, 'state_dir': os.path.join(tmp_dir, 'state')}}
+        full_path = os.path.join(tmp_dir, 'выгрузка_20250730_VALB.json')
+        creditor_files = {'VALB': full_path}
+        day = [record('1001', '111'), record('1001', '112'), record('1002', '221'), record('1003', '331')]
+        with open(full_path, 'w', encoding='utf-8') as f:
+            json.dump(day, f, ensure_ascii=False)
+
+        # Без принятого состояния — полная выгрузка
+        first = prepare_deliveries({'VALB': day}, creditor_files, '20250730', configs)
+        assert first == {'VALB': full_path}
+        assert commit_delivery('VALB', os.path.basename(full_path), configs)
+
+        # Тот же день ещё раз: передавать нечего
+        assert prepare_deliveries({'VALB': day}, creditor_files, '20250730', configs) == {}
+
+        # Изменён 1002, пропал 1003, добавлен 1004; 1001 не изменился
+        updated = day[:2] + [record('1002', '221', fio='Иванов Иван Иванович'), record('1004', '441')]
+        paths = prepare_deliveries({'VALB': updated}, creditor_files, '20250730', configs)
+        with open(paths['VALB'], encoding='utf-8') as f:
+            delta = json.load(f)
+        assert delta['manifest']['mode'] == 'delta' and delta['manifest']['base'] == os.path.basename(full_path)
+        assert [d['number_ip'] for d in delta['added']] == ['441']
+        assert [d['fio'] for d in delta['changed']] == ['Иванов Иван Иванович']
+        assert delta['removed'] == [{'key': '1003'}]
+        assert delta['manifest']['counts']['unchanged'] == 1
+
+        # Пока разность не принята, база та же; после квитанции изменений нет
+        assert commit_delivery('VALB', os.path.basename(paths['VALB']), configs)
+        assert prepare_deliveries({'VALB': updated}, creditor_files, '20250730', configs) == {}
+        # Полная выгрузка по запросу
+        assert prepare_deliveries({'VALB': updated}, creditor_files, '20250730', configs, full=True) == creditor_files
+
+        # Запись без номера договора уходит один раз, пока 1С её не приняла
+        loose = {'number_ip': '', 'date': '30.07.2025', 'fio': 'Сидоров Сидор Сидорович', 'creditor': 'VALB'}
+        paths = prepare_deliveries({'VALB': updated + [loose]}, creditor_files, '20250730', configs)
+        with open(paths['VALB'], encoding='utf-8') as f:
+            delta = json.load(f)
+        assert delta['added'] == [loose] and delta['changed'] == delta['removed'] == []
+        assert delta['manifest']['counts']['unkeyed'] == 1
+        # Неподтверждённая более ранняя выгрузка удаляется при квитанции на новую
+        stale = DeltaState(configs['delta_settings.yaml']['state_dir'], 'VALB').pending_path('старая.json')
+        with open(stale, 'w', encoding='utf-8') as f:
+            json.dump({'date': '20250729', 'hashes': {}, 'removed': [], 'file': 'старая.json'}, f)
+        os.utime(stale, (0, 0))
+        assert commit_delivery('VALB', os.path.basename(paths['VALB']), configs)
+        assert not os.path.exists(stale) and os.listdir(os.path.dirname(stale)) == []
+        assert prepare_deliveries({'VALB': updated + [loose]}, creditor_files, '20250730', configs) == {}
+    print("✅ В 1С уходят только изменившиеся договоры")
+
+def test_regex_guard():
+    """Тестирование защищённого поиска: те же совпадения, ограниченное время, пометка медленных"""
+    print("\n=== Тестирование защищённых регулярных выражений ===")
+
+    import re
+    import time
+    import logging
+    from modules.regex_guard import guard, profile_pattern
+
+    warnings = []
+    handler = logging.Handler(logging.WARNING)
+    handler.emit = lambda record: warnings.append(record.getMessage())
+    logging.getLogger().addHandler(handler)
+    try:
+        passport = guard(re.compile(r'паспорт.*?\d{2}\s\d{2}\s?(\d{6})'), 'test:passport')
+        issued = guard(re.compile(r'выдан[^\w\d]*(.+?)(?=,|код|$)'), 'test:issued')
+        # Предупреждение — один раз на шаблон, а не на каждую загрузку конфигов
+        for _ in range(2):
+            guard(re.compile(r'сумма[^\w\d]*(.+?) рублей'), 'test:amount')
+    finally:
+        logging.getLogger().removeHandler(handler)
+    assert passport.anchor == 'паспорт' and passport.groups == 1
+    # Вердикт статический: соседние [^\w\d]* и .+? перекрываются, .*? перед \d{2} — нет
+    assert not passport.profile['slow'] and issued.profile == {'slow': True, 'reason': 'adjacent'}
+    assert len([message for message in warnings if 'test:amount' in message]) == 1
+    assert profile_pattern(re.compile(r'(\d+\s?)+руб'))['reason'] == 'nested'
+    assert profile_pattern(re.compile(r'\d+\s?\d+x'))['reason'] == 'adjacent'
+    for pattern in (r'\b\d{3}-\d{3}\b', r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+',
+                    r'Процентная ставка.*?(\d{1,2}[.,]\d{1,2})\s*%'):
+        assert not profile_pattern(re.compile(pattern))['slow']
+
+    # На обычном тексте — то же, что re.search, в том числе за пределами первого окна
+    filler = 'Стороны договорились о нижеследующем.\n' * 200
+    text = filler + 'Должник: паспорт 45 06 123456, выдан ОВД района Арбат, код 770-001\n' + filler
+    for pattern in (passport, issued):
+        assert pattern.search(text).span() == pattern.regex.search(text).span()
+    assert passport.search(text).group(1) == '123456'
+    assert issued.search(text).group(1).strip() == 'ОВД района Арбат'
+    assert passport.search(filler) is None
+
+    # Шумный OCR-текст: без защиты поиск квадратичен, с защитой — ограничен бюджетом
+    noise = ('паспорт 12 ' * 20000)[:200000]
+    started = time.perf_counter()
+    assert passport.search(noise) is None
+    assert time.perf_counter() - started < 2
+    print("✅ Поиск по тексту документов ограничен по времени")
+
+def test_share_cache():
+    """Тестирование кэша шары: копия один раз за запуск, сверка с источником, prefetch, LRU"""
+    print("\n=== Тестирование локального кэша шары ===")
+
+    import tempfile
+    from modules import share_cache
+    from modules.parser import parse_file
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        share = os.path.join(tmp_dir, 'сеть', 'VALB', '1001')
+        os.makedirs(share)
+        paths = []
+        for i in range(4):
+            path = os.path.join(share, f'документ{i}.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'Договор 1234567{i}01 от 15.03.2024, Петров Петр Петрович ' + 'x' * 1000)
+            paths.append(path)
+        outside = os.path.join(tmp_dir, 'локальный.txt')
+        with open(outside, 'w', encoding='utf-8') as f:
+            f.write('локальный файл')
+        settings = {'roots': [os.path.join(tmp_dir, 'сеть')], 'cache_dir': os.path.join(tmp_dir, 'cache'),
+                    'max_bytes': 3000}
+        configs = {'share_cache_settings.yaml': settings}
+
+        # Парсер читает локальную копию; повторное чтение в запуске шару не трогает
+        share_cache.open_share_cache(configs)
+        try:
+            doc = parse_file({'file': paths[0], 'creditor': 'VALB', 'ext': 'txt'}, configs)
+            assert doc['number_ip'] == '1234567001' and doc['file'] == paths[0]
+            local = share_cache.local_path(paths[0])
+            assert local != paths[0] and local.startswith(settings['cache_dir'])
+            assert share_cache.local_path(outside) == outside
+            share_cache.prefetch(paths[1:3])
+            # Оба файла забираем: незапущенное копирование close() отменяет
+            assert share_cache.local_path(paths[1]) != paths[1] and share_cache.local_path(paths[2]) != paths[2]
+        finally:
+            stats = share_cache.close_share_cache()
+        assert stats['copied'] == 1 and stats['hits'] == 1 and stats['prefetched'] == 2
+        # Под max_bytes помещаются две копии — самая давняя вытеснена
+        assert stats['evicted'] == 1 and not os.path.exists(local)
+
+        # Следующий запуск: неизменённый файл не копируется, изменённый — копируется заново
+        cache = share_cache.ShareCache(dict(share_cache.SHARE_CACHE_SETTINGS_DEFAULT, **settings))
+        with open(paths[2], 'a', encoding='utf-8') as f:
+            f.write(' дополнено')
+        with open(cache.get(paths[2]), encoding='utf-8') as f:
+            assert f.read().endswith('дополнено')
+        cache.get(paths[1])
+        stats = cache.close()
+        assert stats['copied'] == 1 and stats['reused'] == 1
+
+        # prefetch_bytes ограничивает копирование заранее и для ещё не скопированных файлов
+        cache = share_cache.ShareCache(dict(share_cache.SHARE_CACHE_SETTINGS_DEFAULT, **dict(
+            settings, cache_dir=os.path.join(tmp_dir, 'cache2'), prefetch_bytes=1500)))
+        cache.prefetch(paths)
+        assert list(cache.pending) == paths[:1]
+        stats = cache.close()
+        assert stats['prefetched'] == 1
+    print("✅ Файлы шары читаются из локальной копии")
+
+def test_excel_backfill():
+    """Тестирование дополнения Excel договора: пустые ячейки из txt/docx, заполненные не трогаются"""
+    print("\n=== Тестирование дополнения Excel из документов ===")
+
+    import tempfile
+    import docx
+    import pandas as pd
+    from modules import data_enrichment
+    from modules.data_enrichment import enrich_excels
+
+    configs = {'enrichment_fields.yaml': {
+        'enrichment_fields': {'ИНН': r'\b\d{12}\b', 'Телефон': r'7\d{10}', 'ОГРНИП': r'\b\d{15}\b',
+                              'Email': r'[\w.+-]+@[\w-]+\.\w+'},
+        'enrichment_columns': {'Телефон': 'Телефон должника'}}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        folder = os.path.join(tmp_dir, 'VALB', '1001')
+        os.makedirs(folder)
+        pd.DataFrame({'ФИО': ['Петров Петр Петрович', 'Петров Петр Петрович'],
+                      'ИНН': [None, '111111111111'],
+                      'Телефон должника': [None, ''],
+                      'ОГРНИП': ['304500116000157', '304500116000157'],
+                      'Email': [None, None]}).to_excel(
+            os.path.join(folder, '1001.xlsx'), index=False)
+        with open(os.path.join(folder, 'анкета.txt'), 'w', encoding='utf-8') as f:
+            f.write('Заёмщик: Петров Петр Петрович, ИНН 501234567890')
+        document = docx.Document()
+        document.add_paragraph('Контактный телефон: 79161234567')
+        document.save(os.path.join(folder, 'договор.docx'))
+        # Битый Excel соседней папки не останавливает проход
+        broken = os.path.join(tmp_dir, 'VALB', '1002')
+        os.makedirs(broken)
+        with open(os.path.join(broken, '1002.xlsx'), 'wb') as f:
+            f.write(b'not an excel file')
+
+        state_path = os.path.join(tmp_dir, 'enrichment_state.json')
+        totals = enrich_excels(tmp_dir, configs, state_path)
+        assert totals == {'ИНН': (1, 1), 'Телефон должника': (2, 2), 'ОГРНИП': (0, 0), 'Email': (2, 0)}
+        df = pd.read_excel(os.path.join(folder, '1001.xlsx'), dtype=str)
+        assert list(df['ИНН']) == ['501234567890', '111111111111']
+        assert list(df['Телефон должника']) == ['79161234567', '79161234567']
+        assert list(df['ОГРНИП']) == ['304500116000157', '304500116000157']
+
+        # Email в документах нет: пока они не менялись, папка повторно не читается
+        calls = []
+        original = data_enrichment.extract_folder_values
+
+        def extract_folder_values(folder_path, *args):
+            calls.append(folder_path)
+            return original(folder_path, *args)
+
+        data_enrichment.extract_folder_values = extract_folder_values
+        try:
+            assert enrich_excels(tmp_dir, configs, state_path)['Email'] == (2, 0)
+            assert calls == []
+            with open(os.path.join(folder, 'анкета.txt'), 'a', encoding='utf-8') as f:
+                f.write(', почта petrov@example.ru')
+            assert enrich_excels(tmp_dir, configs, state_path)['Email'] == (2, 2)
+            assert calls == [folder]
+        finally:
+            data_enrichment.extract_folder_values = original
+    print("✅ Пустые ячейки дополнены, заполненные не изменены")
+
+def test_routing():
+    """Тестирование маршрутизации: самый глубокий префикс, конфликты, fallback, --debug-routing"""
+    print("\n=== Тестирование маршрутизации ===")
+
+    import tempfile
+    from modules import route_selector
+
+    configs = {
+        'creditors_to_process.csv': [
+            {'creditor': 'VALB', 'link': 'сеть/юристы/VALB/', 'status': 'к обработке'},
+            {'creditor': 'OZON', 'link': 'сеть/юристы/OZON/', 'status': 'К обработке'},
+            {'creditor': 'OLD', 'link': 'сеть/юристы/OLD/', 'status': 'архив'},
+        ],
+        'paths.json': {'VALB_POOL': 'сеть/юристы/VALB/Пул/', 'OZON2': 'сеть/юристы/OZON'},
+        'formats.csv': [
+            {'extension': 'xlsx', 'priority': '1'},
+            {'extension': 'pdf', 'priority': ''},
+            {'extension': '.DOCX', 'priority': 'высокий'},
+        ],
+    }
+    table = route_selector.compile_routes(configs)
+    # Путь OZON из paths.json конфликтует с creditors_to_process.csv — остаётся первое правило
+    assert table.conflicts == [{'path': 'сеть/юристы/OZON', 'kept': 'creditors_to_process.csv:3',
+                                'ignored': 'paths.json:OZON2'}]
+    assert table.format_rule('xlsx') == (1, 'formats.csv:2')
+    assert table.format_rule('pdf') == (None, 'formats.csv:3')
+    assert table.format_rule('docx') == (None, 'formats.csv:4')
+
+    files = [
+        {'file': 'сеть/юристы/VALB/1001/договор.pdf', 'creditor': 'VALB', 'ext': 'pdf'},
+        {'file': 'сеть/юристы/VALB/Пул/1002/реестр.xlsx', 'creditor': 'VALB', 'ext': 'xlsx'},
+        {'file': 'сеть/юристы/OZON/2001/анкета.docx', 'creditor': 'OZON', 'ext': 'docx'},
+        {'file': 'сеть/юристы/OLD/3001/скан.jpg', 'creditor': 'OLD', 'ext': 'jpg'},
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_dir = route_selector.LOG_DIR
+        route_selector.LOG_DIR = tmp_dir
+        try:
+            routed = route_selector.select_route(files, configs, debug=True)
+        finally:
+            route_selector.LOG_DIR = log_dir
+        with open(os.path.join(tmp_dir, route_selector.ROUTING_DEBUG_LOG), encoding='utf-8') as f:
+            debug = [json.loads(line) for line in f]
+
+    assert [(f['creditor'], f['route'], f['priority']) for f in routed] == [
+        ('VALB', 'creditors_to_process.csv:2', None),
+        ('VALB_POOL', 'paths.json:VALB_POOL', 1),
+        ('OZON', 'creditors_to_process.csv:3', None),
+        ('OLD', 'fallback', None),
+    ]
+    assert [d['file'] for d in debug] == [f['file'] for f in files]
+    assert debug[1] == {'file': files[1]['file'], 'creditor': 'VALB_POOL', 'path_rule': 'paths.json:VALB_POOL',
+                        'format_rule': 'formats.csv:2', 'priority': 1}
+    assert debug[3]['path_rule'] == 'fallback' and debug[3]['format_rule'] is None
+    print("✅ Маршруты по самому глубокому префиксу, конфликты и отчёт отладки")
+
 def create_test_data():
     """Создание тестовых данных"""
     print("\n=== Создание тестовых данных ===")
@@ -170,6 +1266,31 @@ def main():
     test_directories()
     test_dependencies()
     test_logging()
+    test_sftp_transfer()
+    test_ack_watcher()
+    test_creditor_split()
+    test_ocr_cache()
+    test_config_snapshot()
+    test_startup_imports()
+    test_synthetic_corpus()
+    test_metrics()
+    test_profiler()
+    test_parsed_records()
+    test_leases()
+    test_telegram_dispatcher()
+    test_journal_index()
+    test_attachment_store()
+    test_scheduler()
+    test_retry_queue()
+    test_columnar_store()
+    test_docx_parsing()
+    test_pdf_pages()
+    test_ai_client()
+    test_delta_exports()
+    test_regex_guard()
+    test_share_cache()
+    test_excel_backfill()
+    test_routing()
     create_test_data()
     
     print("\n" + "=" * 60)